@@ -0,0 +1,158 @@
+# Copyright (C) 2018 Project-EBDO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# EBDO-Ingester
+# Author: Flebdo
+
+"""
+JSON codec used by JSON reader and JSON/Elasticsearch writers
+
+Parameter:
+    - backend: (str) 'auto' (fastest installed backend), 'orjson', 'ujson'
+               or 'json' (python standard library)
+
+Methods:
+    - loads:
+        - string: (str) JSON document to decode
+    - dumps:
+        - data: object to encode as compact JSON (no whitespace, non-ASCII
+                characters are not escaped). Returns a str.
+    - dumpsPretty:
+        - data: object to encode as indented JSON (always encoded by json module)
+
+Output of every backend is identical to the one of json module: documents
+a faster backend would encode or decode differently (e.g. floats written
+with an exponent, NaN, integers longer than 64 bits) are handled by json
+module.
+"""
+
+import logging as log
+import json
+
+
+# Backends tried in this order if backend is 'auto'
+BACKENDS = ('orjson', 'ujson', 'json')
+
+
+# Custom codec exceptions
+class JSONBackendNotInstalled(Exception):
+    """
+    JSON backend set in config file is not installed
+    """
+    pass
+
+
+# Integers with 19 digits or more may not fit in 64 bits.
+# Digits are mapped to '0' and other bytes to ' ': looking for a run of 19
+# digits is then a substring search (much faster than a regular expression)
+DIGITS = bytes(0x30 if 0x30 <= i <= 0x39 else 0x20 for i in range(256))
+LONG_NUMBER = b'0' * 19
+
+
+def hasLongNumber(string):
+    if type(string) is str:
+        string = string.encode('utf-8', 'surrogatepass')
+    return LONG_NUMBER in string.translate(DIGITS)
+
+
+def isPortable(data):
+    """
+    Return True if all backends encode data the same way: floats are written
+    without exponent by all backends between 1e-4 and 1e16 (NaN and infinity
+    are not in this range)
+    """
+    dataType = type(data)
+    if dataType is float:
+        return data == 0.0 or 1e-4 <= abs(data) < 1e16
+    if dataType is dict:
+        return all(map(isPortable, data.values()))
+    if dataType is list or dataType is tuple:
+        return all(map(isPortable, data))
+    return True
+
+
+class JSONCodec():
+
+    def __init__(self, backend='auto'):
+
+        # Standard library encoders (created once, json.dumps creates an
+        # encoder on each call if options are given)
+        stdDumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+        stdLoads = json.loads
+
+        # Indented JSON, same output as json.dumps(data, indent=4)
+        self.dumpsPretty = json.JSONEncoder(indent=4).encode
+
+        candidates = BACKENDS if backend == 'auto' else (backend,)
+        for name in candidates:
+            if name == 'json':
+                self.backend = name
+                self.loads = stdLoads
+                self.dumps = stdDumps
+                break
+
+            try:
+                module = __import__(name)
+            except ImportError:
+                continue
+
+            self.backend = name
+            if name == 'orjson':
+                fastLoads = module.loads
+
+                def fastDumps(data):
+                    return module.dumps(data).decode()
+
+            elif name == 'ujson':
+                fastLoads = module.loads
+
+                def fastDumps(data):
+                    return module.dumps(data, ensure_ascii=False,
+                                        escape_forward_slashes=False)
+
+            else:
+                raise NotImplementedError("Unknown JSON backend: " + name)
+
+            self.loads = self.__checkedLoads(fastLoads, stdLoads)
+            self.dumps = self.__checkedDumps(fastDumps, stdDumps)
+            break
+
+        else:
+            log.error("JSON backend '" + backend + "' is not installed.")
+            log.error("Try: pip3 install --user " + backend)
+            raise JSONBackendNotInstalled
+
+        log.debug("JSON backend: " + self.backend)
+
+    def __checkedLoads(self, fastLoads, stdLoads):
+        def loads(string):
+            # Long integers may be decoded as floats
+            if hasLongNumber(string):
+                return stdLoads(string)
+            try:
+                return fastLoads(string)
+            except Exception:  # e.g. NaN (not valid JSON, accepted by json module)
+                return stdLoads(string)
+        return loads
+
+    def __checkedDumps(self, fastDumps, stdDumps):
+        def dumps(data):
+            if not isPortable(data):
+                return stdDumps(data)
+            try:
+                return fastDumps(data)
+            except Exception:  # e.g. keys are not strings
+                return stdDumps(data)
+        return dumps
+
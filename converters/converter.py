@@ -17,7 +17,18 @@
 
 import sys
 import logging as log
-from datetime import datetime
+from functools import lru_cache
+from converters.dateparser import DateParser
+
+
+# Default number of dates memoized per timestamp converter
+DATE_CACHE_SIZE = 65536
+
+# 'cache: auto' converters: number of memoized values, number of conversions
+# before checking the hit rate and minimum hit rate to keep the cache
+AUTO_CACHE_SIZE = 4096
+AUTO_CACHE_PROBE = 10000
+AUTO_CACHE_MIN_HIT_RATE = 0.5
 
 
 # Custom exceptions
@@ -54,10 +65,197 @@ class FailedToParseDate(Exception):
     pass
 
 
+# Exceptions raised by a value of a row (not by the config)
+ROW_ERRORS = (defaultNotDefined, TypeMismatchForInput, TypeConversionFailed,
+              FailedToParseDate)
+
+
+class ValueCache():
+    """
+    Memoize conversions of one converter (see 'cache' option of converters).
+
+    Parameters:
+        convert: (callable) conversion function of the converter (see compileValue)
+        convertColumn: (callable) column conversion function (see compileColumn)
+        size: (int) maximum number of memoized values (least recently used
+              values are evicted)
+        auto: (bool) cache is disabled by ConversionPlan.tuneCaches() if its
+              hit rate is too low
+    """
+
+    def __init__(self, convert, convertColumn, size, auto):
+        self.uncached = (convert, convertColumn)
+        self.auto = auto
+        self.enabled = True
+        self.decided = not auto  # hit rate of automatic cache checked
+
+        # typed: 1 and 1.0 must not share a cache entry (inputType is checked)
+        cachedConvert = lru_cache(maxsize=size, typed=True)(convert)
+        self.cacheInfo = cachedConvert.cache_info
+
+        def checkedConvert(value):
+            try:
+                return cachedConvert(value)
+            except TypeError:
+                # Unhashable value (e.g. list of JSON input): the converter
+                # raises TypeMismatchForInput
+                return convert(value)
+
+        def convertColumn(column):
+            try:
+                return list(map(cachedConvert, column))
+            except TypeError:
+                return list(map(checkedConvert, column))
+
+        self.convert = checkedConvert
+
+        self.convertColumn = convertColumn
+
+    def hitRate(self):
+        info = self.cacheInfo()
+        if info.hits + info.misses == 0:
+            return 0.0
+        return info.hits / (info.hits + info.misses)
+
+
+class ConversionPlan():
+    """
+    Compiled form of the converters config. It is built once per ingestion
+    (see Converter.compile) so that the config is not interpreted again for
+    each row.
+
+    Parameters:
+        fields: (tuple) one (inputName, outputName, convert) tuple per converter,
+                convert being a callable returning the converted value
+        columns: (tuple) one (inputName, outputName, convertColumn) tuple per
+                 converter, convertColumn being a callable returning the list
+                 of converted values of a column (see convertBatch)
+        location: (tuple or None) (latitudeInputName, longitudeInputName) if
+                  lat/long must be converted to elasticsearch geo data format
+        dateParsers: (dict) {inputName: DateParser, ...} for timestamp converters
+        valueCaches: (dict) {inputName: ValueCache, ...} for converters with
+                     'cache' option
+    """
+
+    def __init__(self, fields, columns, location, dateParsers, valueCaches):
+        self.fields = fields
+        self.columns = columns
+        self.location = location
+        self.dateParsers = dateParsers
+        self.valueCaches = valueCaches
+
+    def tuneCaches(self):
+        """
+        Disable 'cache: auto' caches with a hit rate lower than
+        AUTO_CACHE_MIN_HIT_RATE (high-cardinality values) once they have been
+        used AUTO_CACHE_PROBE times. Return True while some automatic caches
+        have not been used enough (rejected rows, None values): call it again
+        later.
+        """
+        undecided = False
+        for inputName, cache in self.valueCaches.items():
+            if cache.decided:
+                continue
+            cacheInfo = cache.cacheInfo()
+            if cacheInfo.hits + cacheInfo.misses < AUTO_CACHE_PROBE:
+                undecided = True
+                continue
+            cache.decided = True
+            if cache.hitRate() >= AUTO_CACHE_MIN_HIT_RATE:
+                continue
+
+            log.info("Cache of '" + inputName + "' disabled (hit rate: " +
+                     format(cache.hitRate(), '.1%') + ")")
+            cache.enabled = False
+            self.fields = tuple((name, outputName,
+                                 cache.uncached[0] if name == inputName else convert)
+                                for name, outputName, convert in self.fields)
+            self.columns = tuple((name, outputName,
+                                  cache.uncached[1] if name == inputName else convertColumn)
+                                 for name, outputName, convertColumn in self.columns)
+        return undecided
+
+    def convert(self, data):
+        """
+        Check and convert data (dictionary: {inputName: value, ...}) and return
+        a dictionary with checked and converted data that will be used by writer.
+        """
+        # Readers return one empty dictionary if source is empty
+        if not data:
+            return {}
+
+        converted_data = {}
+        try:
+            for inputName, outputName, convert in self.fields:
+                converted_data[outputName] = convert(data[inputName])
+        except ROW_ERRORS as e:
+            # Name of the converter which rejected the row (see error policy),
+            # the error is logged by the ingester according to error policy
+            e.inputName = inputName
+            raise e
+
+        # Convert lat/long data to format expected by ES
+        if self.location is not None:
+            try:
+                converted_data['location'] = {
+                                                'lat': str(data[self.location[0]]).strip(),
+                                                'lon': str(data[self.location[1]]).strip()
+                                             }
+            except Exception as e:
+                log.error('Failed to import location data in ElasticSearch')
+                log.debug('data: %s', data)
+                raise e
+
+        return converted_data
+
+    def convertBatch(self, columns):
+        """
+        Check and convert a block of rows given column by column
+        (dictionary: {inputName: [value, ...], ...}) and return the list of
+        converted rows (same as convert() called on each row).
+        """
+        if not columns:
+            return []
+
+        outputNames = []
+        outputColumns = []
+        for inputName, outputName, convertColumn in self.columns:
+            outputNames.append(outputName)
+            outputColumns.append(convertColumn(columns[inputName]))
+
+        # Convert lat/long data to format expected by ES
+        if self.location is not None:
+            try:
+                outputColumns.append([{'lat': str(latitude).strip(),
+                                       'lon': str(longitude).strip()}
+                                      for latitude, longitude in
+                                      zip(columns[self.location[0]],
+                                          columns[self.location[1]])
+                                      ])
+            except Exception as e:
+                log.error('Failed to import location data in ElasticSearch')
+                raise e
+            outputNames.append('location')
+
+        if not outputColumns:
+            return [{} for value in next(iter(columns.values()))]
+
+        return [dict(zip(outputNames, values)) for values in zip(*outputColumns)]
+
+
 class Converter():
+    """
+    Converter class
+    Parameters:
+        configConverters: (dict) {inputName: {inputName: '', outputName: '', ...}, ...}
+        configFormat: (dict) {'noneValues': ['', None, etc], 'elasticsearch': {...}}
+        If both are given, the conversion plan is compiled once and used by convert().
+    """
 
-    def __init__(self):
-        pass
+    def __init__(self, configConverters=None, configFormat=None):
+        self.plan = None
+        if configConverters is not None:
+            self.plan = self.compile(configConverters, configFormat)
 
     def ParseType(self, string):
         """
@@ -113,7 +311,7 @@ class Converter():
 
             if defaultValueDefined:
                 value = defaultValue
-                log.debug("Default value found in config file: " + str(defaultValue))
+                log.debug("Default value found in config file: %s", defaultValue)
             else:
                 raise defaultNotDefined
 
@@ -126,93 +324,250 @@ class Converter():
                 return outputValue
             except Exception:
                 log.exception("Failed to convert type")
-                log.debug("Original value: " + str(value))
-                log.debug("Trying to convert to type: " + str(outputType))
+                log.debug("Original value: %s", value)
+                log.debug("Trying to convert to type: %s", outputType)
                 raise TypeConversionFailed
 
 
-    def convertDict(self, data, configConverters, configFormat):
+    def compileValue(self, inputType, outputType, noneValues, defaultValueDefined, defaultValue):
         """
-        Check and convert data according to configConverters and configFormat.
+        Return a callable equivalent to convertValue with all parameters
+        (except value) bound. See convertValue for parameters.
+        """
+        # Membership test on a frozenset is cheaper than on a list,
+        # but lists (list inputType) are not hashable
+        if inputType is list:
+            noneValues = tuple(noneValues)
+        else:
+            try:
+                noneValues = frozenset(noneValues)
+            except TypeError:
+                noneValues = tuple(noneValues)
 
-        Parameters:
-        data is a dictionary: {inputName: value, ...}
-        configConverters: {inputName: {inputName: '', outputName: '', ...}, ...}
-        configFormat: {'noneValues': ['', None, etc]}
+        # Values are sanitized (stripped) only if they are strings
+        sanitize = inputType is str
 
-        This function is called by Ingester class and returns dictionary with checked
-        and converted data that will be used by writer.
-        """
+        def convert(value):
+            # Check input type
+            if type(value) is not inputType:
+                raise TypeMismatchForInput("expected " + inputType.__name__ + ", found " +
+                                           type(value).__name__ + ": " + repr(value))
 
-        converted_data = {}
-        for inputName in data.keys():
-            outputName = configConverters[inputName]['outputName']
+            if sanitize:
+                value = value.strip()
 
-            # Handle timestamp type
-            if configConverters[inputName]['outputType'] == 'timestamp':
-                log.debug("Trying to parse value as date...")
-                try:
-                    date = datetime.strptime(data[inputName],
-                                    configConverters[inputName]['dateFormat']
-                                    )
-                except ValueError:
-                    log.error("Failed to parse \"" + data[inputName] + "\": date "\
-                    "format defined in config file is not correct.")
-                    raise FailedToParseDate
-
-                if configConverters[inputName]['convertToEpoch']:
-                    converted_data[outputName] = int(datetime.timestamp(date)*1000)  # epoch (in milliseconds)
+            if value in noneValues:
+                if defaultValueDefined:
+                    value = defaultValue
                 else:
-                    converted_data[outputName] = data[inputName]
+                    raise defaultNotDefined("empty value " + repr(value) +
+                                            " and no default value")
 
-                continue  # no need of convertValue
+            if value is None:
+                return None
+            try:
+                return outputType(value)
+            except Exception as e:
+                raise TypeConversionFailed("can't convert " + repr(value) + " to " +
+                                           outputType.__name__ + ": " + str(e))
 
-            # Don't add long/lat to converted_data (will be processed after)
-            if configConverters[inputName]['outputType'] in ('latitude', 'longitude'):
-                continue
+        return convert
 
-            # Convert value
+
+    def compileColumn(self, inputType, outputType, noneValues, defaultValueDefined,
+                      defaultValue, convert):
+        """
+        Return a callable converting a list of values (a column), equivalent to
+        calling convert (see compileValue) on each value.
+
+        Columns of strings converted to a non-list type are converted with
+        builtins applied on the whole column. If a value is not valid, the
+        column is converted again value by value so that errors are the same.
+        """
+        def convertRows(column):
+            return [convert(value) for value in column]
+
+        # list and mixed columns are converted value by value
+        if inputType is not str or outputType is list:
+            return convertRows
+
+        try:
+            noneValues = frozenset(noneValues)
+        except TypeError:
+            return convertRows
+
+        strip = str.strip
+        strType = {str}
+
+        def convertColumn(column):
+            if not strType.issuperset(map(type, column)):
+                return convertRows(column)  # Raise TypeMismatchForInput
+
+            values = list(map(strip, column))
             try:
-                converted_data[outputName] = self.convertValue(data[inputName],
-                    self.ParseType(configConverters[inputName]['inputType']),
-                    self.ParseType(configConverters[inputName]['outputType']),
-                    configFormat['noneValues'],
-                    True if 'defaultValue' in configConverters[inputName] else False,
-                    configConverters[inputName]['defaultValue'] if 'defaultValue'
-                    in configConverters[inputName] else None
-                    )
-            except defaultNotDefined:
-                log.error("Error during conversion.")
-                log.error("Value "+inputName+" is empty and no default value was specified")
-                log.error("data :"+str(data))
-                raise defaultNotDefined
+                if noneValues.isdisjoint(values):
+                    return list(map(outputType, values))
+                if defaultValueDefined:
+                    default = None if defaultValue is None else outputType(defaultValue)
+                    return [default if value in noneValues else outputType(value)
+                            for value in values]
+            except Exception:
+                pass
 
-            log.info(inputName + ' imported to ' + outputName +
-                     ' (' +
-                     configConverters[inputName]['inputType'] +
-                     ' --> ' +
-                     configConverters[inputName]['outputType'] +
-                     ')'
-                     )
+            return convertRows(column)  # Raise the exception of the invalid value
 
-        # Convert lat/long data to format expected by ES
-        if 'latitudeInputName' in configFormat['elasticsearch'] and \
-           'longitudeInputName' in configFormat['elasticsearch']:
+        return convertColumn
+
+
+    def compileDateColumn(self, dateParser, convert):
+        """
+        Return a callable converting a list of dates (a column), equivalent to
+        calling convert (see compileDate) on each value.
+        """
+        parse = dateParser.parse
+
+        def convertColumn(column):
             try:
-                converted_data['location'] = {
-                                                'lat': str(data[configFormat['elasticsearch']['latitudeInputName']]).strip(),
-                                                'lon': str(data[configFormat['elasticsearch']['longitudeInputName']]).strip()
-                                             }
-                log.debug("lat/long converted to elasticsearch geo data format: " +
-                          str(converted_data['location']))
-            except Exception as e:
-                log.error('Failed to import location data in ElasticSearch')
-                log.debug('data:' + str(data))
-                raise e
+                return list(map(parse, column))
+            except (ValueError, TypeError):
+                return [convert(value) for value in column]  # Raise row error
+
+        return convertColumn
+
+
+    def compileDate(self, dateParser):
+        """
+        Return a callable checking that a value matches the date format of
+        dateParser (see converters.dateparser.DateParser).
+        """
+        parse = dateParser.parse
+
+        def convert(value):
+            try:
+                return parse(value)
+            except ValueError as e:
+                raise FailedToParseDate(str(e))
+            except TypeError:
+                # e.g. null timestamp of JSON or Parquet input: a row error
+                raise TypeMismatchForInput("expected str (date), found " +
+                                           type(value).__name__ + ": " + repr(value))
+
+        return convert
+
+
+    def compileCache(self, cacheConfig, inputType, outputType, convert, convertColumn):
+        """
+        Return a ValueCache for the 'cache' option of a converter
+        (number of memoized values or 'auto'), or None if values can't be
+        memoized (list inputType or outputType: lists are not hashable, and
+        a memoized list would be shared by rows, changing one changes all).
+        """
+        if list in (inputType, outputType):
+            log.warning("cache option ignored: list values can't be memoized")
+            return None
+
+        if cacheConfig == 'auto':
+            return ValueCache(convert, convertColumn, AUTO_CACHE_SIZE, True)
+
+        if type(cacheConfig) is not int or cacheConfig < 0:
+            log.error("cache must be a positive integer or 'auto'")
+            raise ValueError("Invalid cache option: " + str(cacheConfig))
+
+        return ValueCache(convert, convertColumn, cacheConfig, False)
+
+
+    def compile(self, configConverters, configFormat):
+        """
+        Compile configConverters and configFormat into a ConversionPlan.
+
+        Parameters:
+        configConverters: {inputName: {inputName: '', outputName: '', ...}, ...}
+        configFormat: {'noneValues': ['', None, etc], 'elasticsearch': {...}}
+        """
+        fields = []
+        columns = []
+        dateParsers = {}
+        valueCaches = {}
+        for inputName, definition in configConverters.items():
+            outputType = definition['outputType']
+
+            # Handle timestamp type
+            if outputType == 'timestamp':
+                dateParsers[inputName] = DateParser(definition['dateFormat'],
+                                                    definition.get('convertToEpoch', False),
+                                                    configFormat.get('dateCacheSize',
+                                                                     DATE_CACHE_SIZE)
+                                                    )
+                convert = self.compileDate(dateParsers[inputName])
+                convertColumn = self.compileDateColumn(dateParsers[inputName], convert)
+
+            # Don't add long/lat to converted data (will be processed after)
+            elif outputType in ('latitude', 'longitude'):
+                continue
+
+            else:
+                valueConfig = (self.ParseType(definition['inputType']),
+                               self.ParseType(outputType),
+                               configFormat['noneValues'],
+                               'defaultValue' in definition,
+                               definition.get('defaultValue')
+                               )
+                convert = self.compileValue(*valueConfig)
+                convertColumn = self.compileColumn(*valueConfig, convert)
+
+                # Memoize conversions (low-cardinality values)
+                if definition.get('cache'):
+                    cache = self.compileCache(definition['cache'], valueConfig[0],
+                                              valueConfig[1], convert, convertColumn)
+                    if cache is not None:
+                        valueCaches[inputName] = cache
+                        convert = cache.convert
+                        convertColumn = cache.convertColumn
+
+            fields.append((inputName, definition['outputName'], convert))
+            columns.append((inputName, definition['outputName'], convertColumn))
+            log.info(inputName + ' imported to ' + definition['outputName'] +
+                     ' (' + definition['inputType'] + ' --> ' + outputType + ')')
+
+        # Convert lat/long data to format expected by ES
+        esFormat = configFormat['elasticsearch']
+        if 'latitudeInputName' in esFormat and 'longitudeInputName' in esFormat:
+            location = (esFormat['latitudeInputName'], esFormat['longitudeInputName'])
+            log.info('lat/long converted to elasticsearch geo data format')
         else:
+            location = None
             log.debug('lat/long NOT converted to elasticsearch geo data format')
 
-        log.debug('convertedData: ' + str(converted_data))
-        log.debug('---')
+        return ConversionPlan(tuple(fields), tuple(columns), location, dateParsers,
+                              valueCaches)
 
-        return converted_data
+
+    def convertDict(self, data, configConverters, configFormat):
+        """
+        Check and convert data according to configConverters and configFormat.
+
+        Parameters:
+        data is a dictionary: {inputName: value, ...}
+        configConverters: {inputName: {inputName: '', outputName: '', ...}, ...}
+        configFormat: {'noneValues': ['', None, etc]}
+
+        This function compiles the config on each call: Ingester class compiles
+        it once (see compile) and calls convert() instead.
+        """
+        return self.compile(configConverters, configFormat).convert(data)
+
+
+    def convert(self, data):
+        """
+        Check and convert data using the plan compiled in __init__.
+        """
+        return self.plan.convert(data)
+
+
+    def convertBatch(self, columns):
+        """
+        Check and convert a block of rows given column by column
+        ({inputName: [value, ...], ...}) using the plan compiled in __init__.
+        Return the list of converted rows.
+        """
+        return self.plan.convertBatch(columns)
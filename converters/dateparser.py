@@ -0,0 +1,168 @@
+# Copyright (C) 2018 Project-EBDO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# EBDO-Ingester
+# Author: Flebdo
+
+"""
+Date parser
+
+Parameters:
+    - dateFormat: (str) strftime format of expected date in input
+    - convertToEpoch: (bool) return date converted to epoch (in milliseconds)
+                      instead of the original value
+    - cacheSize: (int) maximum number of values memoized (0 to disable cache)
+
+Methods:
+    - parse:
+        - value: (str) date to parse. Returns epoch (in milliseconds) or the
+                 original value (see convertToEpoch). Raises ValueError if
+                 value does not match dateFormat.
+    - cacheInfo: returns hits, misses, maxsize and currsize of the cache
+    - hitRate: returns the ratio of values found in cache
+
+Formats made of fixed-width numeric directives (%Y, %m, %d, %H, %M, %S) and
+literals are compiled once to a regular expression with one group per
+directive. Values not matching it (and other formats) are parsed by strptime,
+so results and errors are always the ones of strptime.
+"""
+
+import re
+from datetime import datetime
+from functools import lru_cache
+
+
+# Fixed-width directives supported by the fast parser: (regex, default value)
+# Default values are the ones used by strptime if directive is missing
+FIXED_WIDTH_DIRECTIVES = {
+    'Y': (r'(\d\d\d\d)', 1900),
+    'm': (r'(\d\d)', 1),
+    'd': (r'(\d\d)', 1),
+    'H': (r'(\d\d)', 0),
+    'M': (r'(\d\d)', 0),
+    'S': (r'(\d\d)', 0)
+    }
+
+# Order of datetime arguments
+DATETIME_ARGUMENTS = 'YmdHMS'
+
+
+def compileFormat(dateFormat):
+    """
+    Compile dateFormat and return a function parsing a string to a datetime
+    object, or None if the string does not match the fixed-width layout.
+    Return None if dateFormat is not supported by the fast parser.
+    """
+    pattern = ''
+    directives = []
+    i = 0
+    while i < len(dateFormat):
+        char = dateFormat[i]
+        if char == '%':
+            if i + 1 == len(dateFormat):
+                return None
+            directive = dateFormat[i + 1]
+            if directive == '%':
+                pattern += '%'
+            elif directive in FIXED_WIDTH_DIRECTIVES and directive not in directives:
+                pattern += FIXED_WIDTH_DIRECTIVES[directive][0]
+                directives.append(directive)
+            else:
+                return None
+            i += 2
+        elif char.isspace():
+            # Same rule as strptime: whitespaces match any whitespace sequence
+            pattern += r'\s+'
+            while i < len(dateFormat) and dateFormat[i].isspace():
+                i += 1
+        else:
+            pattern += re.escape(char)
+            i += 1
+
+    if not directives:
+        return None
+
+    # strptime ignores case of literals
+    match = re.compile(pattern, re.ASCII | re.IGNORECASE).fullmatch
+
+    # datetime requires at least year, month and day: shorter formats (e.g.
+    # '%Y-%m') get default values for missing directives
+    if len(directives) >= 3 and ''.join(directives) == DATETIME_ARGUMENTS[:len(directives)]:
+        # Directives are in datetime arguments order (e.g. ISO 8601)
+        def parse(value):
+            m = match(value)
+            if m is None:
+                return None
+            return datetime(*map(int, m.groups()))
+
+    else:
+        # Position of each datetime argument in groups (or default value)
+        positions = tuple(directives.index(d) if d in directives else None
+                          for d in DATETIME_ARGUMENTS)
+        defaults = tuple(FIXED_WIDTH_DIRECTIVES[d][1] for d in DATETIME_ARGUMENTS)
+
+        def parse(value):
+            m = match(value)
+            if m is None:
+                return None
+            groups = m.groups()
+            return datetime(*[default if position is None else int(groups[position])
+                              for position, default in zip(positions, defaults)])
+
+    return parse
+
+
+class DateParser():
+
+    def __init__(self, dateFormat, convertToEpoch, cacheSize):
+
+        fastParse = compileFormat(dateFormat)
+        strptime = datetime.strptime
+
+        if fastParse is None:
+            def parseDate(value):
+                return strptime(value, dateFormat)
+        else:
+            def parseDate(value):
+                try:
+                    date = fastParse(value)
+                except ValueError:  # e.g. month is 13: let strptime raise
+                    date = None
+                if date is None:
+                    date = strptime(value, dateFormat)
+                return date
+
+        if convertToEpoch:
+            def parse(value):
+                return int(datetime.timestamp(parseDate(value))*1000)  # epoch (in milliseconds)
+        else:
+            def parse(value):
+                parseDate(value)
+                return value
+
+        self.fast = fastParse is not None
+
+        # Errors (ValueError) are not cached
+        if cacheSize:
+            self.parse = lru_cache(maxsize=cacheSize)(parse)
+            self.cacheInfo = self.parse.cache_info
+        else:
+            self.parse = parse
+            self.cacheInfo = lambda: None
+
+    def hitRate(self):
+        info = self.cacheInfo()
+        if info is None or info.hits + info.misses == 0:
+            return 0.0
+        return info.hits / (info.hits + info.misses)
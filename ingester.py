@@ -20,7 +20,7 @@
 """Ingester
 
 Usage:
-  ingester.py [-v | -vv] [--progress] (-c | --config) <config_paths>...
+  ingester.py [-v | -vv] [--progress] [--trace=<n>] [--resume] [--follow] (-c | --config) <config_paths>...
   ingester.py (-h | --help)
   ingester.py (-V |--version)
 
@@ -28,6 +28,11 @@ Options:
   -c --config    Paths to config files (separated by spaces or wildcard)
   -v -vv         Increase verbosity level to INFO or DEBUG. Default to WARNING.
   -p --progress  Show progress
+  -t --trace=<n> Log input and converted data of 1 row out of n (whatever the verbosity)
+  -r --resume    Resume ingestion from the last checkpoint (see checkpoint
+                 section of config file)
+  -f --follow    Keep reading lines appended to input file until interrupted
+                 (see follow option of local scheme)
   -h --help      Show this screen
   -V --version   Show version
 
@@ -41,12 +46,300 @@ version = "0.1"
 
 # import required modules
 import sys, os
+import io
+import time
+from itertools import islice
 from docopt import docopt
 import logging as log
+import json
 import yaml
 
 # Only required reader and writer will be imported
-from converters.converter import Converter
+from converters.converter import Converter, AUTO_CACHE_PROBE, ROW_ERRORS
+from codec.jsoncodec import JSONCodec
+
+
+# Parallel DSV ingestion: default size of byte ranges read by workers and
+# number of rows read at once in a range (row by row conversion)
+RANGE_SIZE = 16 * 1024 * 1024
+RANGE_BLOCK_SIZE = 1000
+
+# Multi-file input and parallel DSV ingestion: number of converted rows sent
+# at once by workers and number of such chunks buffered per worker
+WORKER_CHUNK_SIZE = 65536
+WORKER_CHUNK_QUEUE_SIZE = 4
+
+# Columnar input formats (see readers.ParquetReader) and default number of
+# rows converted at once (column by column)
+COLUMNAR_FORMATS = ('PARQUET', 'ARROW', 'FEATHER')
+COLUMNAR_BATCH_SIZE = 65536
+
+# Default number of rows between two checkpoints
+CHECKPOINT_EVERY = 100000
+
+
+class TooManyErrors(Exception):
+    """
+    Exception raised if more rows than maxErrors (see errors section of
+    config file) were rejected by converter
+    """
+    pass
+
+
+class CannotResume(Exception):
+    """
+    Exception raised if ingestion can't be resumed from the state file
+    (checkpoints disabled or state saved for another input file)
+    """
+    pass
+
+
+# State of worker processes (parallel ingestion), see initializeWorker
+worker = {}
+
+
+def openReader(fd, configInputFormat, inputNames, jsonCodec, header=None):
+    """
+    Open reader of input format on fd. header (DSV only) overrides the header
+    set in config file.
+    """
+    filetype = configInputFormat['type'].upper()
+    if filetype == 'DSV':
+        from readers.DSVReader import DSVReader
+
+        dsvConfig = configInputFormat['dsv']
+        try:
+            return DSVReader(fd,
+                             inputNames,
+                             dsvConfig['delimiter'],
+                             header if header is not None else dsvConfig.get('header'),
+                             dsvConfig['strictParsing']
+                             )
+        except Exception as e:
+            log.exception("DSV Reader failed")
+            raise e
+
+    elif filetype == 'JSON':
+        from readers.JSONReader import JSONReader
+
+        try:
+            jsonConfig = configInputFormat.get('json') or {}
+            return JSONReader(fd, inputNames, jsonCodec,
+                              jsonConfig.get('lazyParsing', True),
+                              jsonConfig.get('layout', 'ndjson'),
+                              jsonConfig.get('path'))
+        except Exception as e:
+            log.exception("JSON Reader failed")
+            raise e
+
+    elif filetype in COLUMNAR_FORMATS:
+        from readers.ParquetReader import ParquetReader, TIMESTAMP_FORMAT
+
+        try:
+            columnarConfig = configInputFormat.get(filetype.lower()) or {}
+            return ParquetReader(fd, inputNames, filetype.lower(),
+                                 columnarConfig.get('timestampFormat', TIMESTAMP_FORMAT))
+        except Exception as e:
+            log.exception(filetype.capitalize() + " Reader failed")
+            raise e
+
+    else:
+        raise NotImplementedError("Unknown input type: " + filetype)
+
+
+def initializeWorker(configConverters, configFormat, configInputFormat, errorPolicy,
+                     inputPath=None, header=None, queues=None):
+    """
+    Initialize a worker process: the conversion plan can't be sent to workers
+    (closures are not picklable), each worker compiles its own. queues are
+    the chunk queues of worker slots (see convertFile and convertRange).
+    """
+    worker['converter'] = Converter(configConverters, configFormat)
+    worker['jsonCodec'] = JSONCodec(configFormat.get('jsonBackend', 'auto'))
+    worker['inputNames'] = tuple(configConverters.keys())
+    worker['configInputFormat'] = configInputFormat
+    worker['inputPath'] = inputPath
+    worker['header'] = header
+    worker['errorPolicy'] = errorPolicy
+    worker['batchSize'] = configFormat.get('batchSize')
+    worker['queues'] = queues
+
+
+def convertChunks(source):
+    """
+    Read and convert the rows of source in a worker process, block by block.
+    Yield converted rows and rejected rows ([(exception, data), ...]) of
+    each block, rows are rejected only if error policy is not abort.
+    """
+    plan = worker['converter'].plan
+
+    def convertData(block):
+        # block is a list of dictionaries: {inputName: value, ...}
+        rows = []
+        rejected = []
+        for data in block:
+            try:
+                rows.append(plan.convert(data))
+            except ROW_ERRORS as e:
+                if worker['errorPolicy'] == 'abort':
+                    raise e
+                rejected.append((e, data))
+        return rows, rejected
+
+    def convertBlocks():
+        batchSize = worker['batchSize']
+        if batchSize:
+            for columns in source.columns(batchSize):
+                try:
+                    chunk = plan.convertBatch(columns), []
+                except ROW_ERRORS:
+                    chunk = None
+                if chunk is None:
+                    # Find and reject invalid rows (out of except block: no
+                    # chained traceback)
+                    chunk = convertData([dict(zip(columns, values))
+                                         for values in zip(*columns.values())])
+                yield chunk
+        else:
+            for block in source.batches(RANGE_BLOCK_SIZE):
+                yield convertData(block)
+
+    # Check hit rate of automatic caches after each block, until all of
+    # them have been used enough (caches are kept from a source to the next)
+    undecided = True
+    for chunk in convertBlocks():
+        yield chunk
+        if undecided:
+            undecided = plan.tuneCaches()
+    source.close()
+
+
+def convertSource(source):
+    """
+    Read and convert the rows of source in a worker process. Yield converted
+    rows and rejected rows (see convertChunks) by chunks of at least
+    WORKER_CHUNK_SIZE rows (except the last one), to be sent to the main
+    process.
+    """
+    rows = []
+    rejected = []
+    for chunkRows, chunkRejected in convertChunks(source):
+        rows.extend(chunkRows)
+        rejected.extend(chunkRejected)
+        if len(rows) + len(rejected) >= WORKER_CHUNK_SIZE:
+            yield rows, rejected
+            rows = []
+            rejected = []
+    if rows or rejected:
+        yield rows, rejected
+
+
+def skipRows(blocks, nbRows):
+    """
+    Skip the first nbRows rows of blocks of rows ({inputName: [value, ...], ...})
+    """
+    for columns in blocks:
+        if nbRows:
+            nbRowsInBlock = len(next(iter(columns.values())))
+            if nbRows >= nbRowsInBlock:
+                nbRows -= nbRowsInBlock
+                continue
+            columns = {inputName: values[nbRows:] for inputName, values in columns.items()}
+            nbRows = 0
+        yield columns
+
+
+def traceRows(trace, traceEvery, rows, rowNumbers):
+    """
+    Log the converted rows of a block whose row number is a multiple of
+    traceEvery (same rows as row by row conversion). rowNumbers are the row
+    numbers of rows: a range, or a list if rows were rejected.
+    """
+    if type(rowNumbers) is range:
+        indexes = range(-rowNumbers.start % traceEvery, len(rows), traceEvery)
+    else:
+        indexes = [index for index, rowNumber in enumerate(rowNumbers)
+                   if rowNumber % traceEvery == 0]
+    for index in indexes:
+        trace("Trace of row %d: %s", rowNumbers[index], rows[index])
+
+
+def syncFile(fd):
+    """
+    Flush fd to disk and return the size of the file (None if fd is not a
+    regular file, e.g. compressed file)
+    """
+    fd.flush()
+    try:
+        fileno = fd.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return None
+    os.fsync(fileno)
+    return os.fstat(fileno).st_size
+
+
+def convertRange(task):
+    """
+    Read and convert a byte range of the input file (see schemes.local.splitFile)
+    in a worker process. task is (byteRange, slot): converted rows are put in
+    the queue of slot by chunks (see convertSource), as (slot, rows, rejected),
+    then (slot, None, None) at the end of the range. The queue is bounded:
+    memory used doesn't depend on the speed of the writer.
+    """
+    from schemes import local
+
+    byteRange, slot = task
+    queue = worker['queues'][slot]
+    source = openReader(local.LocalFile(worker['inputPath'], 'read', byteRange).fd,
+                        worker['configInputFormat'],
+                        worker['inputNames'],
+                        worker['jsonCodec'],
+                        worker['header']
+                        )
+    for rows, rejected in convertSource(source):
+        queue.put((slot, rows, rejected))
+    queue.put((slot, None, None))
+
+
+def convertFile(task):
+    """
+    Read and convert a file of a multi-file input (see schemes.local.InputFile)
+    in a worker process. task is (inputFile, slot): converted rows are put
+    in the queue of slot by chunks (see convertSource), as
+    (name, rows, rejected, None), then (name, [], [], seconds) once a file
+    is read (a tar archive contains several files) and None at the end.
+    The queue is bounded: memory used doesn't depend on the size of files.
+    """
+    inputFile, slot = task
+    queue = worker['queues'][slot]
+    for name, fd in inputFile.files():
+        start = time.perf_counter()
+        source = openReader(fd,
+                            worker['configInputFormat'],
+                            worker['inputNames'],
+                            worker['jsonCodec']
+                            )
+        for rows, rejected in convertSource(source):
+            queue.put((name, rows, rejected, None))
+        queue.put((name, [], [], time.perf_counter() - start))
+    queue.put(None)
+
+
+def nextChunk(queue, results):
+    """
+    Return next chunk of queue (see convertFile and convertRange), raise the
+    exception of a worker if one of results (tasks putting chunks in queue)
+    failed
+    """
+    from queue import Empty
+
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Empty:
+            for result in results:
+                if result.ready() and not result.successful():
+                    result.get()
 
 
 class Ingester():
@@ -56,14 +349,30 @@ class Ingester():
         configPath: (str) path to YAML config file
         logLevel: (int) verbosity (according to logging module values)
         showProgress: (bool) Show progress of ingestion
+        traceEvery: (int) Log input and converted data of 1 row out of traceEvery
+                    (0 to disable)
+        resume: (bool) Resume ingestion from the state file saved by the last
+                checkpoint (see checkpoint section of config file)
+        follow: (bool) Keep reading lines appended to input file until SIGINT
+                or SIGTERM is received (or idleTimeout of follow option)
     """
 
-    def __init__(self, configPath, logLevel, showProgress):
+    def __init__(self, configPath, logLevel, showProgress, traceEvery=0, resume=False,
+                 follow=False):
 
         # Setup log format
         log.basicConfig(format='%(levelname)s:%(message)s', level=logLevel)
 
+        # Sampled trace has its own logger, enabled whatever the verbosity
+        self.__traceEvery = traceEvery
+        self.__trace = log.getLogger('trace')
+        if traceEvery:
+            self.__trace.setLevel(log.DEBUG)
+
         # Ingestion
+        self.__resume = resume
+        self.__follow = follow
+        self.__destination = None
         self.ingest(configPath, showProgress)
 
 
@@ -88,6 +397,8 @@ class Ingester():
         self.__configOutput = config['output']
         self.__configFormat = config['format']
         self.__configFormat['elasticsearch'] = {}
+        self.__configErrors = config.get('errors', {})
+        self.__configCheckpoint = (config['checkpoint'] or {}) if 'checkpoint' in config else None
 
         # Store config of converters in a nice format (searchable by inputName...)
         # and check if config is consistent
@@ -113,28 +424,78 @@ class Ingester():
                         "It's maybe not what you want.")
 
 
-    def initializeSource(self):
-        # Parse input and open fd
-        if self.__configInput['scheme'] == 'local':
-            from schemes import local
+    def initializeCheckpoint(self, configPath):
+        """
+        Check if checkpoints can be saved and load state file if ingestion is
+        resumed. Output files are truncated to their size at last checkpoint
+        and appended: they must be uncompressed JSON files (or elasticsearch).
+        """
+        self.__checkpoint = None
+        self.__state = None
+
+        if self.__configCheckpoint is None:
+            if self.__resume:
+                log.error("Checkpoints are not configured in config file, can't resume.")
+                raise CannotResume
+            return
+
+        from schemes import local
+
+        self.__checkpoint = {'every': self.__configCheckpoint.get('every', CHECKPOINT_EVERY),
+                             'path': self.__configCheckpoint.get('path', configPath + '.state')}
+
+        outputFiles = []
+        if self.__configOutput['scheme'] == 'local':
+            outputFormat = self.__configOutput.get('format') or {'type': 'json'}
+            if outputFormat['type'].upper() != 'JSON':
+                self.disableCheckpoints(outputFormat['type'] + " output files can't be appended")
+                return
+            if '{' in self.__configOutput['local']['path']:
+                self.disableCheckpoints("partitioned output files can't be truncated")
+                return
+            outputFiles.append((self.__configOutput['local']['path'],
+                                self.__configOutput['local'].get('compression', 'auto')))
+        if self.__configErrors.get('policy') == 'deadletter' and 'deadletter' in self.__configErrors:
+            outputFiles.append((self.__configErrors['deadletter']['path'], 'auto'))
 
+        for path, compression in outputFiles:
+            if compression == 'auto':
+                compression = local.detectCompression(path, 'write')
+            if compression is not None:
+                self.disableCheckpoints("compressed output files can't be appended")
+                return
+
+        if self.__resume:
             try:
-                inputFd = local.LocalFile(self.__configInput['local']['path'], 'read').fd
-            except Exception as e:
-                log.error("Failed to open input file.")
-                raise e
+                with open(self.__checkpoint['path'], 'rt') as stateFile:
+                    self.__state = json.load(stateFile)
+            except FileNotFoundError:
+                log.warning("No state file found (" + self.__checkpoint['path'] + "), "
+                            "ingestion starts from the beginning.")
+            else:
+                log.info("Resuming ingestion from row " + str(self.__state['rows']))
 
-        elif self.__configInput['scheme'] == 'hdfs':
-            raise NotImplementedError("HDFS scheme not yet implemented")
 
-        else:
-            raise NotImplementedError("Unknown input scheme: " + self.__configInput['scheme'])
+    def disableCheckpoints(self, reason):
+        if self.__resume:
+            log.error("Ingestion can't be resumed: " + reason + ".")
+            raise CannotResume
+        log.warning("Checkpoints disabled: " + reason + ".")
+        self.__checkpoint = None
 
-        # Open reader
+
+    def initializeSource(self):
+        self.__configParallel = None
+        self.__inputFiles = None
+        self.__source = None
+        self.__inputFd = None
+        self.__skipRows = 0
+        inputCompression = None
+        header = None
+
+        # Check reader config
         filetype = self.__configInput['format']['type'].upper()
         if filetype == 'DSV':
-            from readers.DSVReader import DSVReader
-
             try:  # Use try/except to avoid nested if
                 dsvConfig = self.__configInput['format']['dsv']
             except KeyError:
@@ -144,110 +505,740 @@ class Ingester():
                 if param not in dsvConfig:
                     raise KeyError("DSV '" + param + "' not configured in config file")
 
+            # Parallel ingestion (byte ranges of input file read by workers)
+            self.__configParallel = dsvConfig.get('parallel')
+            if self.__configParallel and self.__configInput['scheme'] != 'local':
+                raise NotImplementedError("Parallel DSV ingestion requires local scheme")
+
+        elif filetype in COLUMNAR_FORMATS:
+            # Values are read column by column, don't convert them row by row
+            self.__configFormat.setdefault('batchSize', COLUMNAR_BATCH_SIZE)
+
+        # Parse input and open fd
+        if self.__configInput['scheme'] == 'local':
+            from schemes import local
+
             try:
-                self.__source = DSVReader(inputFd,
-                                          tuple(self.__configConverters.keys()),
-                                          dsvConfig['delimiter'],
-                                          dsvConfig['header'] if 'header' in dsvConfig else None,
-                                          dsvConfig['strictParsing']
-                                          )
+                inputFiles = local.expandPath(self.__configInput['local']['path'])
             except Exception as e:
-                log.exception("DSV Reader failed")
+                log.error("Failed to open input file.")
                 raise e
 
-        elif filetype == 'JSON':
-            from readers.JSONReader import JSONReader
+            if len(inputFiles) > 1 or inputFiles[0].archive is not None:
+                # Multi-file input: each file is read by a worker process
+                log.info(str(len(inputFiles)) + " input files (or archives) found")
+                if self.__configParallel:
+                    log.warning("Input files are read in parallel, "
+                                "parallel option of DSV format ignored.")
+                    self.__configParallel = None
+                if self.__checkpoint is not None:
+                    self.disableCheckpoints("input files are read in parallel")
+                if self.__follow:
+                    raise NotImplementedError("Follow mode requires a single input file")
+                self.__inputFiles = inputFiles
+                return
+
+            self.__inputPath = inputFiles[0].path
+            inputCompression = self.__configInput['local'].get('compression', 'auto')
+            if inputCompression == 'auto':
+                inputCompression = local.detectCompression(self.__inputPath, 'read')
+
+            if self.__configParallel and inputCompression is not None:
+                log.warning("Compressed input file can't be split in byte ranges, "
+                            "parallel ingestion disabled.")
+                self.__configParallel = None
+
+            # Lines of DSV and JSON lines files can be read from an offset
+            jsonConfig = self.__configInput['format'].get('json') or {}
+            lineBased = inputCompression is None and \
+                (filetype == 'DSV' or filetype == 'JSON' and jsonConfig.get('layout', 'ndjson') == 'ndjson')
+
+            if self.__follow:
+                if not lineBased:
+                    raise NotImplementedError("Follow mode requires an uncompressed DSV "
+                                              "or JSON lines input file")
+                if self.__configParallel:
+                    log.warning("Input file is read sequentially in follow mode, "
+                                "parallel option of DSV format ignored.")
+                    self.__configParallel = None
+
+            # Checkpoints save the offset following the last row read (line
+            # based files), or else the number of rows read
+            offset = None
+            if self.__checkpoint is not None and self.__configParallel:
+                self.disableCheckpoints("byte ranges of input file are read in parallel")
+            if self.__checkpoint is not None:
+                if lineBased:
+                    offset = 0
+
+                if self.__state is not None:
+                    if self.__state['input'] != self.__inputPath:
+                        log.error("State file was saved for input file " + self.__state['input'] +
+                                  ", can't resume.")
+                        raise CannotResume
+                    if offset is not None and self.__state['offset'] is not None:
+                        offset = self.__state['offset']
+                    else:
+                        self.__skipRows = self.__state['rows']
 
             try:
-                self.__source = JSONReader(inputFd, tuple(self.__configConverters.keys()))
+                if self.__follow:
+                    followConfig = self.__configInput['local'].get('follow') or {}
+                    inputFd = local.FollowedLines(self.__inputPath,
+                                                  offset or 0,
+                                                  filetype == 'DSV' and 'header' not in dsvConfig,
+                                                  followConfig.get('pollInterval', local.POLL_INTERVAL),
+                                                  followConfig.get('flushInterval', local.FLUSH_INTERVAL),
+                                                  self.flush,
+                                                  followConfig.get('idleTimeout')
+                                                  )
+                else:
+                    inputFd = local.LocalFile(self.__inputPath, 'read',
+                                              compression=inputCompression, offset=offset).fd
             except Exception as e:
-                log.exception("JSON Reader failed")
+                log.error("Failed to open input file.")
                 raise e
+            self.__inputFd = inputFd
+
+            # Header is read from the beginning of the file
+            if offset and filetype == 'DSV' and 'header' not in dsvConfig:
+                headerSource = openReader(local.LocalFile(self.__inputPath, 'read').fd,
+                                          self.__configInput['format'],
+                                          tuple(self.__configConverters.keys()),
+                                          self.__jsonCodec
+                                          )
+                header = headerSource.header
+                headerSource.close()
+
+        elif self.__configInput['scheme'] == 'hdfs':
+            raise NotImplementedError("HDFS scheme not yet implemented")
 
         else:
-            raise NotImplementedError("Unknown input type: " + filetype)
+            raise NotImplementedError("Unknown input scheme: " + self.__configInput['scheme'])
+
+        # Open reader
+        self.__source = openReader(inputFd,
+                                   self.__configInput['format'],
+                                   tuple(self.__configConverters.keys()),
+                                   self.__jsonCodec,
+                                   header
+                                   )
 
 
     def initializeDestination(self):
+        self.__outputFd = None
+
+        # One index or file per time partition if its name has date fields
         if self.__configOutput['scheme'] == 'elasticsearch':
-            from writers.ESWriter import ESWriter
+            target = self.__configOutput['elasticsearch']['index']
+        else:
+            target = (self.__configOutput.get(self.__configOutput['scheme']) or {}).get('path', '')
+        partitioner = None
+        if '{' in target:
+            from writers.PartitionedWriter import Partitioner, MAX_OPEN
+            partitionConfig = self.__configOutput.get('partition') or {}
+            timestamps = [definition for definition in self.__configConverters.values()
+                          if definition['outputType'] == 'timestamp']
+            if 'field' in partitionConfig:
+                timestamps = [definition for definition in timestamps
+                              if definition['outputName'] == partitionConfig['field']]
+            if len(timestamps) != 1:
+                raise KeyError("Output is partitioned by date: set partition field (outputName "
+                               "of a timestamp converter)")
+            partitioner = Partitioner(target, timestamps[0]['outputName'], timestamps[0])
+            maxOpen = partitionConfig.get('maxOpen', MAX_OPEN)
+
+        if self.__configOutput['scheme'] == 'elasticsearch':
+            from writers.ESWriter import ESWriter, BULK_SIZE, BULK_BYTES, MAX_RETRIES, RETRY_DELAY
+            from writers.ESWriter import TIMEOUT
+            from writers.bulkcontrol import MIN_BULK_SIZE, MAX_BULK_SIZE, TARGET_LATENCY
 
             es_config = self.__configOutput['elasticsearch']
-            self.__destination = ESWriter(host=es_config['host'],
-                                          port=es_config['port'],
-                                          index=es_config['index']
+            if 'nodes' not in es_config and not ('host' in es_config and 'port' in es_config):
+                raise KeyError("host and port (or nodes) must be set in elasticsearch output")
+            self.__destination = ESWriter(host=es_config.get('host'),
+                                          port=es_config.get('port'),
+                                          index=es_config['index'],
+                                          codec=self.__jsonCodec,
+                                          bulkSize=es_config.get('bulkSize', BULK_SIZE),
+                                          bulkBytes=es_config.get('bulkBytes', BULK_BYTES),
+                                          maxRetries=es_config.get('maxRetries', MAX_RETRIES),
+                                          retryDelay=es_config.get('retryDelay', RETRY_DELAY),
+                                          concurrency=es_config.get('concurrency', 1),
+                                          nodes=es_config.get('nodes'),
+                                          timeout=es_config.get('timeout', TIMEOUT),
+                                          adaptive=es_config.get('adaptive', False),
+                                          minBulkSize=es_config.get('minBulkSize', MIN_BULK_SIZE),
+                                          maxBulkSize=es_config.get('maxBulkSize', MAX_BULK_SIZE),
+                                          targetLatency=es_config.get('targetLatency',
+                                                                      TARGET_LATENCY),
+                                          maxDocsPerSecond=es_config.get('maxDocsPerSecond'),
+                                          maxBytesPerSecond=es_config.get('maxBytesPerSecond'),
+                                          configConverters=self.__configConverters,
+                                          createIndex=es_config.get('createIndex', True),
+                                          ingestSettings=es_config.get('ingestSettings', False),
+                                          idFields=es_config.get('idFields'),
+                                          idHash=es_config.get('idHash', False),
+                                          opType=es_config.get('opType', 'index'),
+                                          partitioner=partitioner
                                           )
 
+        elif self.__configOutput['scheme'] == 'local':
+            if partitioner is not None:
+                from writers.PartitionedWriter import PartitionedWriter
+                from schemes.compression import detectCompression
+
+                # Only uncompressed JSON files can be closed and appended later
+                outputFormat = self.__configOutput.get('format') or {'type': 'json'}
+                compression = self.__configOutput['local'].get('compression', 'auto')
+                if compression == 'auto':
+                    compression = detectCompression(target, 'write')
+                appendable = outputFormat['type'].upper() == 'JSON' and compression is None
+                self.__destination = PartitionedWriter(partitioner,
+                                                       self.openFileWriter,
+                                                       maxOpen,
+                                                       appendable
+                                                       )
+            else:
+                self.__destination = self.openFileWriter(target, 'write')
+
+        elif self.__configOutput['scheme'] == 'hdfs':
+            raise NotImplementedError("HDFS scheme not yet implemented")
+
         else:
-            # Open fd
-            if self.__configOutput['scheme'] == 'local':
-                from schemes import local  # Required if input scheme is not local
+            raise NotImplementedError("Unknown output scheme: " + self.__configOutput['scheme'])
 
-                try:
-                    outputFd = local.LocalFile(self.__configOutput['local']['path'], 'write').fd
-                except Exception as e:
-                    log.error("Failed to open output file.")
-                    raise e
 
-            elif self.__configOutput['scheme'] == 'hdfs':
-                raise NotImplementedError("HDFS scheme not yet implemented")
+    def openFileWriter(self, outputPath, mode):
+        """
+        Open output file (mode is 'write' or 'append') and its writer
+        """
+        from schemes import local  # Required if input scheme is not local
+
+        partitioned = '{' in self.__configOutput['local']['path']
+        outputFormat = self.__configOutput.get('format') or {'type': 'json'}
+        filetype = outputFormat['type'].upper()
+        if mode == 'append' and filetype != 'JSON':
+            log.error("Partition " + outputPath + " was closed (maxOpen partitions) and " +
+                      filetype + " files can't be appended.")
+            raise NotImplementedError("Can't append " + filetype + " files")
 
+        # Open fd
+        try:
+            if self.__state is not None:
+                # Rows written after last checkpoint are written again
+                os.truncate(outputPath, self.__state['output'])
+                outputFd = local.LocalFile(outputPath, 'append').fd
             else:
-                raise NotImplementedError("Unknown output scheme: " + self.__configOutput['scheme'])
+                if partitioned and os.path.dirname(outputPath):
+                    os.makedirs(os.path.dirname(outputPath), exist_ok=True)
+                outputFd = local.LocalFile(outputPath, mode,
+                                           compression=self.__configOutput['local'].get('compression', 'auto')).fd
+        except Exception as e:
+            log.error("Failed to open output file.")
+            raise e
+        if not partitioned:
+            self.__outputFd = outputFd
 
-            # Open writer
-            from writers.JSONWriter import JSONWriter
+        # Open writer
+        if filetype == 'JSON':
+            from writers.JSONWriter import JSONWriter, BUFFER_SIZE
+            jsonConfig = outputFormat.get('json') or {}
             try:
-                self.__destination = JSONWriter(outputFd)
+                return JSONWriter(outputFd,
+                                  self.__jsonCodec,
+                                  jsonConfig.get('layout', 'pretty'),
+                                  jsonConfig.get('bufferSize', BUFFER_SIZE)
+                                  )
             except Exception as e:
                 log.exception("Failed to open JSON writer file.")
                 raise e
 
+        elif filetype == 'PARQUET':
+            from writers.ParquetWriter import ParquetWriter, ROW_GROUP_SIZE
+            parquetConfig = outputFormat.get('parquet') or {}
+            try:
+                return ParquetWriter(outputFd,
+                                     self.__configConverters,
+                                     parquetConfig.get('rowGroupSize', ROW_GROUP_SIZE),
+                                     parquetConfig.get('compression', 'snappy')
+                                     )
+            except Exception as e:
+                log.exception("Failed to open Parquet writer file.")
+                raise e
+
+        else:
+            raise NotImplementedError("Unknown output type: " + filetype)
+
+
+    def initializeErrorPolicy(self):
+        # Policy applied to rows rejected by converter
+        self.__errorPolicy = self.__configErrors.get('policy', 'abort')
+        if self.__errorPolicy not in ('abort', 'skip', 'deadletter'):
+            raise NotImplementedError("Unknown error policy: " + self.__errorPolicy)
+
+        self.__maxErrors = self.__configErrors.get('maxErrors')
+        self.__nbErrors = 0
+        self.__errorsByConverter = {}
+        if self.__state is not None:
+            self.__nbErrors = self.__state['errors']
+            self.__errorsByConverter = dict(self.__state['errorsByConverter'])
+
+        # Open dead-letter file (rejected rows and error reasons)
+        self.__deadLetter = None
+        if self.__errorPolicy == 'deadletter':
+            from schemes import local
+
+            try:
+                deadLetterPath = self.__configErrors['deadletter']['path']
+                if self.__state is not None and self.__state['deadletter'] is not None:
+                    os.truncate(deadLetterPath, self.__state['deadletter'])
+                    self.__deadLetter = local.LocalFile(deadLetterPath, 'append').fd
+                else:
+                    self.__deadLetter = local.LocalFile(deadLetterPath, 'write').fd
+            except KeyError:
+                raise KeyError("deadletter path not configured in config file")
+            except Exception as e:
+                log.error("Failed to open dead-letter file.")
+                raise e
+
 
     def convertValues(self, showProgress):
-        # Loop on data
+        if self.__inputFiles is not None:
+            self.convertValuesMultiFile(showProgress)
+            return
+        if self.__configParallel:
+            self.convertValuesParallel(showProgress)
+            return
+
+        # Bind methods used in the loops once
+        write = self.__destination.write
+        writeBatch = self.__destination.writeBatch
+        reject = self.reject
+        traceEvery = self.__traceEvery
+        trace = self.__trace.debug
+        tuneCaches = self.__converter.plan.tuneCaches
+        checkpointEvery = self.__checkpoint['every'] if self.__checkpoint is not None else 0
+        nbRowProcessed = self.__state['rows'] if self.__state is not None else 0
+        probeRow = nbRowProcessed + AUTO_CACHE_PROBE
+
+        batchSize = self.__configFormat.get('batchSize')
+        if batchSize and self.__follow:
+            log.warning("Rows are converted one by one in follow mode, batchSize ignored.")
+            batchSize = None
+
+        if batchSize:
+            # Loop on blocks of rows, converted column by column
+            convertBatch = self.__converter.plan.convertBatch
+            blocks = self.__source.columns(batchSize)
+            if self.__skipRows:
+                blocks = skipRows(blocks, self.__skipRows)
+            for columns in blocks:
+                # columns is a dictionary: {inputName: [value, ...], ...}
+
+                # Check and convert data
+                nbRowsInBlock = len(next(iter(columns.values())))
+                try:
+                    rows = convertBatch(columns)
+                except ROW_ERRORS:
+                    rows = None
+                if rows is None:
+                    # Find and reject invalid rows (out of except block: no
+                    # chained traceback)
+                    rows, rowNumbers = self.convertRows(columns, nbRowProcessed)
+                else:
+                    rowNumbers = range(nbRowProcessed, nbRowProcessed + nbRowsInBlock)
+
+                # Write data
+                writeBatch(rows)
+
+                if traceEvery:
+                    traceRows(trace, traceEvery, rows, rowNumbers)
+
+                # Check hit rate of automatic caches, again later if some
+                # were not used enough
+                nbRowProcessed += nbRowsInBlock
+                if probeRow is not None and probeRow <= nbRowProcessed:
+                    probeRow = nbRowProcessed + AUTO_CACHE_PROBE if tuneCaches() else None
+
+                # Save a checkpoint every checkpointEvery rows (at end of block)
+                if checkpointEvery and \
+                    (nbRowProcessed - nbRowsInBlock) // checkpointEvery < nbRowProcessed // checkpointEvery:
+                        self.checkpoint(nbRowProcessed)
+
+                # Print progress
+                if showProgress:
+                    print(nbRowProcessed, end='\r')
+
+        else:
+            # Loop on data
+            convert = self.__converter.plan.convert
+            rows = self.__source.data()
+            if self.__skipRows:
+                rows = islice(rows, self.__skipRows, None)
+            if self.__follow:
+                rows = filter(None, rows)  # no row read before stop: {}
+            for data in rows:
+                # data is a dictionary: {inputName: value, ...}
+
+                # Check, convert and write data
+                try:
+                    converted = convert(data)
+                except ROW_ERRORS as e:
+                    reject(e, data, nbRowProcessed)
+                else:
+                    if traceEvery and nbRowProcessed % traceEvery == 0:
+                        trace("Trace of row %d: %s --> %s", nbRowProcessed, data, converted)
+                    write(converted)
+
+                # Check hit rate of automatic caches, again later if some
+                # were not used enough
+                if nbRowProcessed == probeRow:
+                    probeRow = probeRow + AUTO_CACHE_PROBE if tuneCaches() else None
+
+                # Print progress
+                if showProgress:
+                    print(nbRowProcessed, end='\r')
+                nbRowProcessed += 1
+
+                # Save a checkpoint every checkpointEvery rows
+                if checkpointEvery and nbRowProcessed % checkpointEvery == 0:
+                    self.checkpoint(nbRowProcessed)
+
+            # Followed file may still grow: next run will resume from here
+            if self.__follow and checkpointEvery:
+                self.checkpoint(nbRowProcessed)
+
+        if showProgress:
+            print("Done: " + str(nbRowProcessed - self.__nbErrors) +
+                  " lines processed with success, " +
+                  str(self.__nbErrors) + " lines rejected.")
+
+        self.reportStatistics()
+
+
+    def convertValuesParallel(self, showProgress):
+        import multiprocessing
+        from schemes import local
+
+        # Split input file in byte ranges, header is read once (by source)
+        dsvConfig = self.__configInput['format']['dsv']
+        ranges = local.splitFile(self.__inputPath,
+                                 self.__configParallel.get('rangeSize', RANGE_SIZE),
+                                 'header' not in dsvConfig,
+                                 '"' if self.__configParallel.get('quotedNewlines') else None
+                                 )
+        log.info("Input file split in " + str(len(ranges)) + " ranges")
+
+        order = self.__configParallel.get('order', 'preserved')
+        if order not in ('preserved', 'unordered'):
+            raise NotImplementedError("Unknown parallel order: " + order)
+
+        # One range converted per worker at once. Converted rows are sent
+        # through bounded queues: one per worker (slot) to write ranges in
+        # input order, or one shared by workers
+        nbWorkers = self.__configParallel.get('workers') or os.cpu_count()
+        if order == 'preserved':
+            queues = [multiprocessing.Queue(WORKER_CHUNK_QUEUE_SIZE) for slot in range(nbWorkers)]
+        else:
+            queues = [multiprocessing.Queue(WORKER_CHUNK_QUEUE_SIZE * nbWorkers)] * nbWorkers
+
+        writeBatch = self.__destination.writeBatch
+        nbRowProcessed = 0
+        with multiprocessing.Pool(nbWorkers,
+                                  initializer=initializeWorker,
+                                  initargs=(self.__configConverters,
+                                            self.__configFormat,
+                                            self.__configInput['format'],
+                                            self.__errorPolicy,
+                                            self.__inputPath,
+                                            self.__source.header,
+                                            queues)
+                                  ) as pool:
+            ranges = iter(ranges)
+            pending = {}  # {slot: result} of ranges being converted, in input order
+
+            def submit(slot):
+                byteRange = next(ranges, None)
+                if byteRange is not None:
+                    pending[slot] = pool.apply_async(convertRange, ((byteRange, slot),))
+
+            for slot in range(nbWorkers):
+                submit(slot)
+
+            while pending:
+                if order == 'preserved':
+                    slot = next(iter(pending))  # oldest range
+                    chunk = nextChunk(queues[slot], (pending[slot],))
+                else:
+                    chunk = nextChunk(queues[0], tuple(pending.values()))
+                slot, rows, rejected = chunk
+
+                if rows is None:  # end of range
+                    pending.pop(slot).get()  # Raise the exception of the worker (if any)
+                    submit(slot)
+                    continue
+
+                writeBatch(rows)
+                # Row numbers are not known by workers
+                for error, data in rejected:
+                    self.reject(error, data, None)
+
+                # Print progress
+                nbRowProcessed += len(rows) + len(rejected)
+                if showProgress:
+                    print(nbRowProcessed, end='\r')
+
+        if showProgress:
+            print("Done: " + str(nbRowProcessed - self.__nbErrors) +
+                  " lines processed with success, " +
+                  str(self.__nbErrors) + " lines rejected.")
+
+        self.reportStatistics()
+
+
+    def convertValuesMultiFile(self, showProgress):
+        import multiprocessing
+        from collections import deque
+
+        # One file converted per worker at once, each worker (slot) sends
+        # converted rows through its own bounded queue
+        nbWorkers = self.__configInput['local'].get('workers') or os.cpu_count()
+        queues = [multiprocessing.Queue(WORKER_CHUNK_QUEUE_SIZE) for slot in range(nbWorkers)]
+
+        writeBatch = self.__destination.writeBatch
         nbRowProcessed = 0
-        for data in self.__source.data():
-            # data is a dictionary: {inputName: value, ...}
+        nbFiles = 0
+        with multiprocessing.Pool(nbWorkers,
+                                  initializer=initializeWorker,
+                                  initargs=(self.__configConverters,
+                                            self.__configFormat,
+                                            self.__configInput['format'],
+                                            self.__errorPolicy,
+                                            None,
+                                            None,
+                                            queues)
+                                  ) as pool:
+            inputFiles = iter(self.__inputFiles)
+            pending = deque()  # (slot, result) of files being converted
+
+            def submit(slot):
+                inputFile = next(inputFiles, None)
+                if inputFile is not None:
+                    pending.append((slot, pool.apply_async(convertFile, ((inputFile, slot),))))
+
+            for slot in range(nbWorkers):
+                submit(slot)
+
+            # Files are written in input order
+            while pending:
+                slot, result = pending.popleft()
+                nbRows = nbRejected = 0
+                chunk = nextChunk(queues[slot], (result,))
+                while chunk is not None:
+                    name, rows, rejected, seconds = chunk
+                    writeBatch(rows)
+                    # Row numbers are not known by workers
+                    for error, data in rejected:
+                        self.reject(error, data, None)
+                    nbRows += len(rows)
+                    nbRejected += len(rejected)
 
-            # Check, convert and write data
-            self.__destination.write(self.__converter.convertDict(data,
-                                                                  self.__configConverters,
-                                                                  self.__configFormat
-                                                                 )
-                                    )
+                    if seconds is not None:
+                        log.info(name + ": " + str(nbRows) + " rows converted, " +
+                                 str(nbRejected) + " rows rejected in " +
+                                 format(seconds, '.2f') + "s")
+                        nbFiles += 1
+                        nbRows = nbRejected = 0
 
-            # Print progress
-            if showProgress:
-                print(nbRowProcessed, end='\r')
-            nbRowProcessed += 1
+                    # Print progress
+                    nbRowProcessed += len(rows) + len(rejected)
+                    if showProgress:
+                        print(nbRowProcessed, end='\r')
+                    chunk = nextChunk(queues[slot], (result,))
+                result.get()  # Raise the exception of the worker (if any)
+                submit(slot)
 
+        log.info(str(nbFiles) + " input files processed.")
         if showProgress:
-            print("Done: " + str(nbRowProcessed) + " lines processed with success.")
+            print("Done: " + str(nbRowProcessed - self.__nbErrors) +
+                  " lines processed with success, " +
+                  str(self.__nbErrors) + " lines rejected.")
+
+        self.reportStatistics()
+
+
+    def convertRows(self, columns, firstRowNumber):
+        """
+        Convert a block of rows (see Converter.convertBatch) row by row
+        and apply error policy to invalid rows. Return converted rows and
+        their row numbers (rejected rows are missing).
+        """
+        convert = self.__converter.plan.convert
+        inputNames = tuple(columns)
+        rows = []
+        rowNumbers = []
+        for rowNumber, values in enumerate(zip(*columns.values()), firstRowNumber):
+            data = dict(zip(inputNames, values))
+            try:
+                rows.append(convert(data))
+            except ROW_ERRORS as e:
+                self.reject(e, data, rowNumber)
+            else:
+                rowNumbers.append(rowNumber)
+        return rows, rowNumbers
+
+
+    def reject(self, error, data, rowNumber):
+        """
+        Apply error policy to a row rejected by converter. Rejected rows are
+        logged on one line (debug level) if they don't abort the ingestion:
+        errors are counted (and written to the dead letter file).
+        """
+        inputName = getattr(error, 'inputName', None)
+        if self.__errorPolicy == 'abort':
+            log.error("Row " + str(rowNumber) + " rejected by converter '" +
+                      str(inputName) + "': " + str(error), exc_info=error)
+            raise error
+        log.debug("Row %s rejected by converter '%s': %s: %s",
+                  rowNumber, inputName, type(error).__name__, error)
+
+        self.__nbErrors += 1
+        self.__errorsByConverter[inputName] = self.__errorsByConverter.get(inputName, 0) + 1
+
+        if self.__deadLetter is not None:
+            self.__deadLetter.write(json.dumps({'row': rowNumber,
+                                                'converter': inputName,
+                                                'error': type(error).__name__,
+                                                'message': str(error),
+                                                'data': data
+                                                }) + "\n")
+
+        if self.__maxErrors is not None and self.__nbErrors > self.__maxErrors:
+            log.error("More than " + str(self.__maxErrors) + " rows rejected, exiting...")
+            raise TooManyErrors
+
+
+    def flush(self):
+        """
+        Flush writer, called by followed input file (see schemes.local.FollowedLines)
+        """
+        if self.__destination is not None:
+            self.__destination.flush()
+
+
+    def checkpoint(self, nbRowProcessed):
+        """
+        Flush writers then save position of input, number of rows processed
+        and size of output files in state file
+        """
+        self.__destination.flush()
+        state = {'input': self.__inputPath,
+                 'rows': nbRowProcessed,
+                 'offset': getattr(self.__inputFd, 'offset', None),
+                 'errors': self.__nbErrors,
+                 'errorsByConverter': list(self.__errorsByConverter.items()),
+                 'output': None if self.__outputFd is None else syncFile(self.__outputFd),
+                 'deadletter': None if self.__deadLetter is None else syncFile(self.__deadLetter)
+                 }
+
+        # State file is replaced at once (never partially written)
+        path = self.__checkpoint['path']
+        with open(path + '.tmp', 'wt') as stateFile:
+            json.dump(state, stateFile)
+            stateFile.flush()
+            os.fsync(stateFile.fileno())
+        os.replace(path + '.tmp', path)
+        log.debug("Checkpoint saved at row " + str(nbRowProcessed))
+
+
+    def reportStatistics(self):
+        # Report rows rejected by each converter
+        for inputName, nbErrors in self.__errorsByConverter.items():
+            log.warning(str(nbErrors) + " rows rejected by converter '" +
+                        str(inputName) + "'")
+
+        # Report hit/miss statistics of converters caches
+        for inputName, cache in self.__converter.plan.valueCaches.items():
+            cacheInfo = cache.cacheInfo()
+            if cacheInfo.hits + cacheInfo.misses == 0:  # e.g. used by workers only
+                continue
+            log.info("Cache of '" + inputName + "': " +
+                     str(cacheInfo.hits) + " hits, " +
+                     str(cacheInfo.misses) + " misses (" +
+                     format(cache.hitRate(), '.1%') + " hit rate, " +
+                     str(cacheInfo.currsize) + "/" + str(cacheInfo.maxsize) + " values" +
+                     ("" if cache.enabled else ", disabled") + ")")
+
+        # Report hit rate of date caches
+        for inputName, dateParser in self.__converter.plan.dateParsers.items():
+            cacheInfo = dateParser.cacheInfo()
+            if cacheInfo is None or cacheInfo.hits + cacheInfo.misses == 0:
+                continue
+            log.info("Date cache of '" + inputName + "': " +
+                     str(cacheInfo.hits) + " hits, " +
+                     str(cacheInfo.misses) + " misses (" +
+                     format(dateParser.hitRate(), '.1%') + " hit rate)")
 
 
     def close(self):
-        self.__source.close()
+        if self.__source is not None:
+            self.__source.close()
         self.__destination.close()
+        if self.__deadLetter is not None:
+            self.__deadLetter.close()
 
 
     def ingest(self, configPath, showProgress):
         # Parse config
         self.parseConfig(configPath)
 
+        # JSON codec used by JSON reader and writers
+        self.__jsonCodec = JSONCodec(self.__configFormat.get('jsonBackend', 'auto'))
+
+        # Load state file (resume) before seeking input
+        self.initializeCheckpoint(configPath)
+
         # Open I/O
         self.initializeSource()
         self.initializeDestination()
+        self.initializeErrorPolicy()
+
+        # Create an instance of converter (config is compiled once)
+        self.__converter = Converter(self.__configConverters, self.__configFormat)
 
-        # Create an instance of converter
-        self.__converter = Converter()
+        # Stop following input file on SIGINT or SIGTERM (rows already read
+        # are written)
+        if self.__follow:
+            import signal
+            stop = lambda signum, frame: self.__inputFd.stop()
+            handlers = {signum: signal.signal(signum, stop)
+                        for signum in (signal.SIGINT, signal.SIGTERM)}
 
         # Convert values
-        self.convertValues(showProgress)
+        try:
+            self.convertValues(showProgress)
+        except BaseException:
+            # Index settings changed for ingestion are restored
+            if self.__configOutput['scheme'] == 'elasticsearch':
+                try:
+                    self.__destination.restoreSettings()
+                except Exception:
+                    pass  # error is logged, original error is raised
+            raise
+        finally:
+            if self.__follow:
+                for signum, handler in handlers.items():
+                    signal.signal(signum, handler)
 
         # Exiting properly
         self.close()
 
+        # Ingestion is complete, there is nothing to resume
+        if self.__checkpoint is not None and not self.__follow and \
+            os.path.exists(self.__checkpoint['path']):
+                os.remove(self.__checkpoint['path'])
+
 
 if __name__ == '__main__':
 
@@ -255,6 +1246,9 @@ if __name__ == '__main__':
     arguments = docopt(__doc__, version=version)
 
     showProgress = arguments['--progress']
+    traceEvery = int(arguments['--trace']) if arguments['--trace'] else 0
+    resume = arguments['--resume']
+    follow = arguments['--follow']
     if arguments['-v'] == 0:
         logLevel = log.WARNING
     elif arguments['-v'] == 1:
@@ -272,7 +1266,7 @@ if __name__ == '__main__':
             print("["+str(indexProcessedFiles)+"/"+str(nbConfigFiles)+"] "
                   "Processing config file " + configPath + "...")
 
-        Ingester(configPath, logLevel, showProgress)
+        Ingester(configPath, logLevel, showProgress, traceEvery, resume, follow)
 
     log.info(str(nbConfigFiles) + " config files processed with success.")
     sys.exit(0)
@@ -17,6 +17,8 @@
 
 import logging as log
 import csv
+from itertools import islice
+from readers.projection import itemsGetter
 
 
 # Custom DSV exceptions
@@ -47,6 +49,17 @@ class DSVReader():
         data():
             - an iterable object,
               each iteration returns a dictionary {valueName: value, ...}
+        batches(size, tuples=False):
+            - an iterable object, each iteration returns a list of at most
+              size rows: dictionaries {valueName: value, ...} or, if tuples is
+              True, tuples of values ordered as schema
+        columns(size):
+            - an iterable object, each iteration returns a block of at most
+              size rows as a dictionary {valueName: [value, ...], ...}
+        schema:
+            - tuple of value names (order of values in tuples)
+        header:
+            - list of value names by column (None for ignored columns)
     """
 
     def __init__(self, fd, inputValueNames, delimiter, header, strictParsing):
@@ -103,20 +116,58 @@ class DSVReader():
                 if header[i] is not None:
                     self.__columnsIndexes[header[i]] = i
 
+        # Header with used columns only (None for other columns), to read parts
+        # of the file not starting with header (see schemes.local.splitFile)
+        self.header = [None] * (len(header) if header else 0)
+        for inputName, index in self.__columnsIndexes.items():
+            self.header[index] = inputName
+
+        # Projection of csv rows (lists) on used columns
+        self.schema = tuple(self.__columnsIndexes)
+        self.__project = itemsGetter(self.__columnsIndexes.values())
+
     def data(self):
+        # Checked once: formatting values costs even if message is not logged
+        debug = log.root.isEnabledFor(log.DEBUG)
+
+        schema = self.schema
+        project = self.__project
+
         # No simple way to test if an interator is empty
         noData = True
         for row in self.__csvReader:
             noData = False  # If there is a least one line, set noData to False
-            values = {}
-            for inputName in self.__columnsIndexes:
-                values[inputName] = row[self.__columnsIndexes[inputName]]
-            log.debug("CSVReader returns: " + str(values))
+            values = dict(zip(schema, project(row)))
+            if debug:
+                log.debug("CSVReader returns: %s", values)
             yield values
         # Raise noData exception if self.__csvReader is empty
         if noData:
             log.warning("No data found (empty file or only header)")
             yield {}  # Return a generator with one element: {}
 
+    def batches(self, size, tuples=False):
+        schema = self.schema
+        project = self.__project
+
+        noData = True
+        while True:
+            rows = list(map(project, islice(self.__csvReader, size)))
+            if not rows:
+                break
+            noData = False
+            if tuples:
+                yield rows
+            else:
+                yield [dict(zip(schema, values)) for values in rows]
+
+        if noData:
+            log.warning("No data found (empty file or only header)")
+
+    def columns(self, size):
+        for rows in self.batches(size, tuples=True):
+            yield {inputName: list(column)
+                   for inputName, column in zip(self.schema, zip(*rows))}
+
     def close(self):
         self.__fd.close()
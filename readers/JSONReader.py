@@ -16,7 +16,10 @@
 # Author: Flebdo
 
 import logging as log
-import json
+from itertools import islice
+from codec.jsoncodec import JSONCodec
+from readers.projection import jsonProjection, pathsGetter
+from readers.jsonstream import JSONStream
 
 
 # Custom JSON exceptions
@@ -27,22 +30,52 @@ class ValueNameNotFoundInJSONFile(Exception):
     pass
 
 
+class UnknownJSONLayout(Exception):
+    """
+    JSON layout set in config file is not ndjson, array or concatenated
+    """
+    pass
+
+
 class JSONReader():
     """
     This reader is iterable and expects
-    *one valid json per line*.
+    *one valid json per line* (ndjson layout), or records streamed out of a
+    top-level array (array layout) or of documents written one after the
+    other, possibly on several lines (concatenated layout).
+
+    Value names may be dotted paths to nested values (e.g. 'location.lat'),
+    a key existing as is in a document wins over its dotted path. Only the
+    values of inputValueNames are converted to python objects if simdjson
+    is installed.
 
     Parameters:
         - fd: (fd) file descriptor of input file
         - inputValueNames: (tuple or list of str) Column names specified in config file
+        - codec: (JSONCodec, optional) JSON codec (default to fastest installed backend)
+        - lazyParsing: (bool, optional) Extract values with simdjson if it is
+                       installed (default: True, ndjson layout only)
+        - layout: (str, optional) 'ndjson' (default), 'array' or 'concatenated'
+        - path: (str, optional) dotted path of the array of records in the
+                top-level object (array layout, e.g. 'data.records')
 
     Return:
         data():
             - an iterable object,
               each iteration returns a dictionary {valueName: value, ...}
+        batches(size, tuples=False):
+            - an iterable object, each iteration returns a list of at most
+              size rows: dictionaries {valueName: value, ...} or, if tuples is
+              True, tuples of values ordered as schema
+        columns(size):
+            - an iterable object, each iteration returns a block of at most
+              size rows as a dictionary {valueName: [value, ...], ...}
+        schema:
+            - tuple of value names (order of values in tuples)
     """
 
-    def __init__(self, fd, inputValueNames):
+    def __init__(self, fd, inputValueNames, codec=None, lazyParsing=True,
+                 layout='ndjson', path=None):
 
         # Store fd
         self.__fd = fd
@@ -50,31 +83,64 @@ class JSONReader():
         # Store inputValueNames (it will be used in data() to return only
         # valueNames specified in config file)
         self.__inputValueNames = inputValueNames
+        self.schema = tuple(inputValueNames)
+
+        if path and layout != 'array':
+            log.warning("path is only used by array layout of JSON files, ignored.")
+
+        if layout == 'ndjson':
+            # Parse json lines and project them on inputValueNames
+            self.__records = fd
+            self.__decode = jsonProjection(self.schema, (codec or JSONCodec()).loads,
+                                           lazyParsing)
+        elif layout in ('array', 'concatenated'):
+            # Records are decoded by stream, project them on inputValueNames
+            stream = JSONStream(fd)
+            self.__records = stream.array(path) if layout == 'array' else stream.concatenated()
+            self.__decode = pathsGetter(self.schema)
+        else:
+            log.error("Unknown JSON layout '" + str(layout) + "'.")
+            raise UnknownJSONLayout
+
+    def __notFound(self, error):
+        # error is the KeyError raised by projection
+        log.error(str(error.args[0])+" was set in config file but "
+                  "was not found in JSON input file, exiting...")
+        return ValueNameNotFoundInJSONFile
+
+    def __parse(self, records):
+        try:
+            return list(map(self.__decode, records))
+        except KeyError as e:
+            raise self.__notFound(e)
+        except Exception as e:
+            log.error("Failed to parse JSON source file.")
+            raise e
 
     def data(self):
+        # Checked once: formatting values costs even if message is not logged
+        debug = log.root.isEnabledFor(log.DEBUG)
+
+        schema = self.schema
+        decode = self.__decode
+
         # No simple way to test if an interator is empty
         noData = True
 
-        for line in self.__fd:
-            noData = False  # If there is a least one line, set noData to False
+        for record in self.__records:
+            noData = False  # If there is a least one record, set noData to False
 
             try:
-                jsonReader = json.loads(line)
+                values = dict(zip(schema, decode(record)))
+            except KeyError as e:
+                raise self.__notFound(e)
             except Exception as e:
-                log.debug('line: ' + str(line))
+                log.debug('record: %s', record)
                 log.error("Failed to parse JSON source file.")
                 raise e
 
-            values = {}
-            for inputName in self.__inputValueNames:
-                if inputName in jsonReader:
-                    values[inputName] = jsonReader[inputName]
-                else:
-                    log.error(inputName+" was set in config file but "
-                              "was not found in JSON input file, exiting...")
-                    raise ValueNameNotFoundInJSONFile
-
-            log.debug("JSONReader returns: " + str(values))
+            if debug:
+                log.debug("JSONReader returns: %s", values)
             yield values
 
         # Print a warning if file is empty
@@ -82,5 +148,30 @@ class JSONReader():
             log.warning("No data found (empty input file)")
             yield {}  # Return a generator with one element: {}
 
+    def batches(self, size, tuples=False):
+        schema = self.schema
+
+        noData = True
+        while True:
+            records = list(islice(self.__records, size))
+            if not records:
+                break
+            noData = False
+
+            rows = self.__parse(records)
+
+            if tuples:
+                yield rows
+            else:
+                yield [dict(zip(schema, values)) for values in rows]
+
+        if noData:
+            log.warning("No data found (empty input file)")
+
+    def columns(self, size):
+        for rows in self.batches(size, tuples=True):
+            yield {inputName: list(column)
+                   for inputName, column in zip(self.schema, zip(*rows))}
+
     def close(self):
         self.__fd.close()
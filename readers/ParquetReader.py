@@ -0,0 +1,198 @@
+# Copyright (C) 2018 Project-EBDO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# EBDO-Ingester
+# Author: Flebdo
+
+import logging as log
+
+
+# Custom Parquet exceptions
+class PyarrowModuleNotInstalled(Exception):
+    """
+    pyarrow module for python 3 is not installed
+    (or the install is broken)
+    """
+    pass
+
+
+class ColumnNameNotFoundInParquetFile(Exception):
+    """
+    A column name set in config file was not found in Parquet/Arrow file
+    """
+    pass
+
+
+class UnknownColumnarFormat(Exception):
+    """
+    Format is not parquet, arrow or feather
+    """
+    pass
+
+
+# Try to import pyarrow module (it is not a standard python module),
+# show instructions if it is not installed
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.compute as pc
+except ImportError:
+    log.error("pyarrow module for python is not installed.")
+    log.error("It is required to read Parquet, Arrow and Feather files.")
+    log.error("Try: pip3 install --user pyarrow")
+    raise PyarrowModuleNotInstalled
+
+
+# Number of rows read at once by data()
+BATCH_SIZE = 65536
+
+# Default format of dates and timestamps given to converters
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+class ParquetReader():
+    """
+    This reader is iterable and reads columnar files: Parquet, Arrow IPC
+    (file or stream format) and Feather (version 2).
+    Only the columns set in config file are read, row group by row group
+    (Parquet) or record batch by record batch (Arrow).
+
+    Parameters:
+        - fd: (fd) file descriptor of input file, text fds are read through
+              their binary buffer (must be seekable, except for Arrow stream
+              format)
+        - inputValueNames: (tuple or list of str) Column names specified in config file
+        - fileFormat: (str) 'parquet', 'arrow' or 'feather'
+        - timestampFormat: (str, optional) strftime format of dates and
+                           timestamps returned as strings (converters expect
+                           dates as strings, see dateFormat)
+
+    Return:
+        data():
+            - an iterable object,
+              each iteration returns a dictionary {valueName: value, ...}
+        batches(size, tuples=False):
+            - an iterable object, each iteration returns a list of at most
+              size rows: dictionaries {valueName: value, ...} or, if tuples is
+              True, tuples of values ordered as schema
+        columns(size):
+            - an iterable object, each iteration returns a block of at most
+              size rows as a dictionary {valueName: [value, ...], ...}.
+              Values are converted to python objects column by column.
+        schema:
+            - tuple of value names (order of values in tuples)
+    """
+
+    def __init__(self, fd, inputValueNames, fileFormat, timestampFormat=TIMESTAMP_FORMAT):
+
+        # Store fd
+        self.__fd = fd
+        self.__timestampFormat = timestampFormat
+        self.schema = tuple(inputValueNames)
+
+        # Columnar files are binary
+        fd = getattr(fd, 'buffer', fd)
+
+        if fileFormat == 'parquet':
+            self.__parquetFile = pq.ParquetFile(fd)
+            names = self.__parquetFile.schema_arrow.names
+        elif fileFormat in ('arrow', 'feather'):
+            self.__parquetFile = None
+            try:
+                self.__ipcReader = pa.ipc.open_file(fd)
+            except pa.ArrowInvalid:  # Arrow stream format
+                fd.seek(0)
+                self.__ipcReader = pa.ipc.open_stream(fd)
+            names = self.__ipcReader.schema.names
+        else:
+            log.error("Unknown columnar format '" + str(fileFormat) + "'.")
+            raise UnknownColumnarFormat
+
+        # Check if all converters have a column in file
+        for inputName in self.schema:
+            if inputName not in names:
+                log.error("Column '" + inputName + "' was set in config file but "
+                          "was not found in " + fileFormat + " file, exiting...")
+                raise ColumnNameNotFoundInParquetFile
+        self.__indexes = tuple(names.index(inputName) for inputName in self.schema)
+
+    def __recordBatches(self, size):
+        # Record batches of at most size rows (used columns only)
+        if self.__parquetFile is not None:
+            # Row groups are read one by one
+            yield from self.__parquetFile.iter_batches(batch_size=size,
+                                                        columns=list(self.schema))
+            return
+
+        if isinstance(self.__ipcReader, pa.ipc.RecordBatchFileReader):
+            recordBatches = (self.__ipcReader.get_batch(i)
+                             for i in range(self.__ipcReader.num_record_batches))
+        else:
+            recordBatches = self.__ipcReader
+
+        for recordBatch in recordBatches:
+            columns = [recordBatch.column(index) for index in self.__indexes]
+            recordBatch = pa.RecordBatch.from_arrays(columns, names=list(self.schema))
+            for offset in range(0, recordBatch.num_rows, size):
+                yield recordBatch.slice(offset, size)
+
+    def __toPython(self, column):
+        # Dates and timestamps are given to converters as strings
+        if pa.types.is_date(column.type):
+            column = column.cast(pa.timestamp('s'))
+        if pa.types.is_timestamp(column.type):
+            # Fractions of seconds would be written by %S
+            column = column.cast(pa.timestamp('s', column.type.tz), safe=False)
+            column = pc.strftime(column, format=self.__timestampFormat)
+        return column.to_pylist()
+
+    def columns(self, size):
+        noData = True
+        for recordBatch in self.__recordBatches(size):
+            if recordBatch.num_rows == 0:
+                continue
+            noData = False
+            yield {inputName: self.__toPython(recordBatch.column(inputName))
+                   for inputName in self.schema}
+
+        if noData:
+            log.warning("No data found (empty file)")
+
+    def batches(self, size, tuples=False):
+        schema = self.schema
+        for columns in self.columns(size):
+            rows = list(zip(*columns.values()))
+            if tuples:
+                yield rows
+            else:
+                yield [dict(zip(schema, values)) for values in rows]
+
+    def data(self):
+        # Checked once: formatting values costs even if message is not logged
+        debug = log.root.isEnabledFor(log.DEBUG)
+
+        # No simple way to test if an interator is empty
+        noData = True
+        for rows in self.batches(BATCH_SIZE):
+            for values in rows:
+                noData = False
+                if debug:
+                    log.debug("ParquetReader returns: %s", values)
+                yield values
+
+        if noData:
+            yield {}  # Return a generator with one element: {}
+
+    def close(self):
+        self.__fd.close()
@@ -0,0 +1,165 @@
+# Copyright (C) 2018 Project-EBDO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# EBDO-Ingester
+# Author: Flebdo
+
+"""
+Incremental JSON parser used by JSONReader for documents not written one
+per line
+
+Parameters:
+    - fd: (fd) file descriptor of input file
+    - chunkSize: (int, optional) number of characters read at once
+
+Methods:
+    - concatenated: iterate on documents written one after the other
+                    (whitespaces, including newlines, are ignored)
+    - array:
+        - path: (str or None) dotted path of an array in the top-level
+                object (e.g. 'data.records'), None if the top-level value is
+                the array
+        Iterate on the elements of the array.
+
+The file is read by chunks: memory used is bounded by chunkSize and the
+size of the largest document (or element), whatever the size of the file.
+Documents are decoded by json module (JSONDecoder.raw_decode).
+"""
+
+import logging as log
+import json
+import re
+
+
+# Number of characters read at once
+CHUNK_SIZE = 1024 * 1024
+
+# Whitespaces allowed between JSON tokens
+WHITESPACES = re.compile(r'[ \t\n\r]*').match
+
+
+# Custom JSON stream exceptions
+class PathNotFoundInJSONFile(Exception):
+    """
+    Path of the array of records set in config file was not found in JSON file
+    """
+    pass
+
+
+class InvalidJSONStructure(Exception):
+    """
+    JSON file structure is not the expected one (e.g. top-level value is not
+    an array)
+    """
+    pass
+
+
+class JSONStream():
+
+    def __init__(self, fd, chunkSize=CHUNK_SIZE):
+        self.__fd = fd
+        self.__chunkSize = chunkSize
+        self.__buffer = ''
+        self.__position = 0
+        self.__eof = False
+        self.__rawDecode = json.JSONDecoder().raw_decode
+
+    def __fill(self, grow=False):
+        # Drop consumed characters and read next chunk. If an incomplete value
+        # is buffered, its size is doubled (a value is decoded at most
+        # log2(size / chunkSize) times)
+        remaining = len(self.__buffer) - self.__position
+        chunk = self.__fd.read(max(self.__chunkSize, remaining) if grow else self.__chunkSize)
+        if not chunk:
+            self.__eof = True
+        self.__buffer = self.__buffer[self.__position:] + chunk
+        self.__position = 0
+
+    def __peek(self):
+        """
+        Skip whitespaces and return next character (None at end of file)
+        """
+        while True:
+            self.__position = WHITESPACES(self.__buffer, self.__position).end()
+            if self.__position < len(self.__buffer):
+                return self.__buffer[self.__position]
+            if self.__eof:
+                return None
+            self.__fill()
+
+    def __expect(self, characters):
+        character = self.__peek()
+        if character is None or character not in characters:
+            log.error("Invalid JSON structure: expected one of '" + characters +
+                      "', found " + repr(character))
+            raise InvalidJSONStructure
+        self.__position += 1
+        return character
+
+    def __value(self):
+        """
+        Decode next value, read more data until it is complete
+        """
+        self.__peek()
+        while True:
+            try:
+                value, end = self.__rawDecode(self.__buffer, self.__position)
+            except json.JSONDecodeError as e:
+                if self.__eof:
+                    log.error("Failed to parse JSON source file.")
+                    raise e
+                self.__fill(grow=True)
+                continue
+
+            # A number ending with the buffer may be incomplete
+            if end == len(self.__buffer) and not self.__eof:
+                self.__fill(grow=True)
+                continue
+
+            self.__position = end
+            return value
+
+    def concatenated(self):
+        while self.__peek() is not None:
+            yield self.__value()
+
+    def __findPath(self, path):
+        # Move to the value of path: skip other values of the objects on path
+        for step in path.split('.'):
+            self.__expect('{')
+            found = self.__peek() != '}'
+            while found:
+                key = self.__value()
+                self.__expect(':')
+                if key == step:
+                    break
+                self.__value()  # Skip value
+                found = self.__expect(',}') == ','
+
+            if not found:
+                log.error("Path '" + path + "' was set in config file but "
+                          "was not found in JSON input file, exiting...")
+                raise PathNotFoundInJSONFile
+
+    def array(self, path=None):
+        if path:
+            self.__findPath(path)
+
+        self.__expect('[')
+        if self.__peek() == ']':
+            return
+        while True:
+            yield self.__value()
+            if self.__expect(',]') == ']':
+                return
@@ -0,0 +1,175 @@
+# Copyright (C) 2018 Project-EBDO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# EBDO-Ingester
+# Author: Flebdo
+
+"""
+Projection of rows used by readers
+
+itemsGetter(keys) returns a function returning the tuple of items of a row
+(list or dictionary) for the given keys (indexes or names), in keys order.
+Unlike operator.itemgetter, a tuple is returned whatever the number of keys.
+
+pathsGetter(keys) does the same for decoded JSON documents, keys being
+dotted paths to nested values (e.g. 'location.lat', 'tags.0').
+
+jsonProjection(keys, loads) returns a function parsing a JSON line and
+returning the tuple of values of keys (dotted paths). If simdjson is
+installed, only the selected values are converted to python objects.
+simdjson returns the first value of a duplicate key, json the last one:
+lines where a key (or a step of a path) may be duplicate are decoded by
+loads, results don't depend on simdjson.
+
+A key existing as is in a document always wins over its dotted path.
+A KeyError(key) is raised if a key is not found.
+"""
+
+import json
+from operator import itemgetter
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+
+PATH_SEPARATOR = '.'
+
+
+def itemsGetter(keys):
+    keys = tuple(keys)
+    if len(keys) == 0:
+        return lambda row: ()
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda row: (row[key],)
+    return itemgetter(*keys)
+
+
+def pathGetter(key):
+    steps = key.split(PATH_SEPARATOR)
+
+    def get(document):
+        try:
+            return document[key]
+        except KeyError:
+            pass
+        try:
+            value = document
+            for step in steps:
+                if type(value) is list:
+                    value = value[int(step)]
+                else:
+                    value = value[step]
+            return value
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise KeyError(key)
+
+    return get
+
+
+def pathsGetter(keys):
+    keys = tuple(keys)
+    if not any(PATH_SEPARATOR in key for key in keys):
+        return itemsGetter(keys)
+    getters = tuple(pathGetter(key) if PATH_SEPARATOR in key else itemgetter(key)
+                    for key in keys)
+    return lambda document: tuple([get(document) for get in getters])
+
+
+def jsonPointer(key):
+    # RFC 6901: '~' and '/' are escaped in reference tokens
+    return ''.join('/' + step.replace('~', '~0').replace('/', '~1')
+                   for step in key.split(PATH_SEPARATOR))
+
+
+def jsonProjection(keys, loads, lazy=True):
+    keys = tuple(keys)
+    project = pathsGetter(keys)
+
+    def decode(line):
+        return project(loads(line))
+
+    if simdjson is None or not lazy:
+        return decode
+
+    parser = simdjson.Parser()
+    Object = simdjson.Object
+    Array = simdjson.Array
+    pointers = tuple((key, jsonPointer(key) if PATH_SEPARATOR in key else None)
+                     for key in keys)
+
+    # Names looked up in documents, as encoded in lines. A duplicate name
+    # appears twice, unless it is escaped in one of them: lines with
+    # escapes are decoded by loads
+    names = set()
+    for key in keys:
+        names.add(key)
+        if PATH_SEPARATOR in key:
+            names.update(key.split(PATH_SEPARATOR))
+    names = tuple(json.dumps(name, ensure_ascii=False) for name in names)
+    binaryNames = tuple(name.encode() for name in names)
+
+    def lazyDecode(line):
+        if type(line) is bytes:
+            if b'\\' in line:
+                return decode(line)
+            lineNames = binaryNames
+        else:
+            if '\\' in line:
+                return decode(line)
+            lineNames = names
+        for name in lineNames:
+            if line.count(name) > 1:
+                return decode(line)  # Maybe duplicate keys
+
+        try:
+            document = parser.parse(line)
+        except (ValueError, RuntimeError):
+            # Not parsed by simdjson (e.g. integers longer than 64 bits,
+            # NaN) or invalid: let loads decode it or raise
+            return decode(line)
+
+        try:
+            if type(document) is not Object:
+                document = None
+                return decode(line)
+
+            values = []
+            for key, pointer in pointers:
+                if key in document:
+                    value = document[key]
+                elif pointer is None:
+                    raise KeyError(key)
+                else:
+                    try:
+                        value = document.at_pointer(pointer)
+                    except (KeyError, IndexError, ValueError, TypeError):
+                        raise KeyError(key)
+
+                # Nested values are views on parser buffer
+                valueType = type(value)
+                if valueType is Object:
+                    value = value.as_dict()
+                elif valueType is Array:
+                    value = value.as_list()
+                values.append(value)
+            return tuple(values)
+
+        finally:
+            # Parser can't be reused while views on its buffer exist
+            document = value = None
+
+    return lazyDecode
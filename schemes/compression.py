@@ -0,0 +1,246 @@
+# Copyright (C) 2018 Project-EBDO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# EBDO-Ingester
+# Author: Flebdo
+
+"""
+Compressed files used by local scheme
+
+Supported compressions: gzip (.gz), bz2 (.bz2), xz (.xz) and zstd (.zst,
+requires zstandard module).
+
+Functions:
+    - detectCompression: return the compression of a file, from its
+      extension or, if it has no known extension, its magic bytes (reading
+      only)
+    - openCompressed: open a compressed file as a binary stream, data is
+      (de)compressed by a helper thread
+
+(De)compression modules release the GIL: the helper thread (de)compresses
+data while the main thread parses or formats it.
+"""
+
+import logging as log
+import io
+import re
+import threading
+import queue
+
+
+# Size of chunks exchanged with helper threads
+CHUNK_SIZE = 1024 * 1024
+
+# Number of chunks buffered between helper thread and main thread
+QUEUE_DEPTH = 4
+
+# compression: (extension, magic bytes pattern)
+COMPRESSIONS = {
+    'gzip': ('.gz', re.compile(re.escape(b'\x1f\x8b\x08'))),
+    # Block size (1-9) followed by magic of first block (digits of pi) or of
+    # end of stream (digits of sqrt(pi)) if empty
+    'bz2': ('.bz2', re.compile(b'BZh[1-9](?:1AY&SY|\x17rE8P\x90)')),
+    'xz': ('.xz', re.compile(re.escape(b'\xfd7zXZ\x00'))),
+    'zstd': ('.zst', re.compile(re.escape(b'\x28\xb5\x2f\xfd')))
+    }
+
+# Number of bytes read to detect compression from magic bytes
+MAGIC_SIZE = 10
+
+
+# Custom compression exceptions
+class UnknownCompression(Exception):
+    """
+    Compression set in config file is not supported
+    """
+    pass
+
+
+class CompressionModuleNotInstalled(Exception):
+    """
+    Python module required by compression is not installed
+    """
+    pass
+
+
+def detectCompression(filepath, mode):
+    """
+    Return the compression of filepath (None if it is not compressed).
+    A known extension is trusted, magic bytes are read in 'read' mode only
+    if there is none (e.g. plain text starting with 'BZh' is not bz2).
+    """
+    for compression, (extension, magic) in COMPRESSIONS.items():
+        if str(filepath).endswith(extension):
+            return compression
+
+    if mode == 'read':
+        try:
+            with open(filepath, 'rb') as f:
+                head = f.read(MAGIC_SIZE)
+        except (OSError, TypeError):
+            head = b''  # let caller fail to open file
+        for compression, (extension, magic) in COMPRESSIONS.items():
+            if magic.match(head):
+                return compression
+
+    return None
+
+
+def openStream(filepath, mode, compression):
+    # Return binary (de)compressing stream
+    binaryMode = 'rb' if mode == 'read' else 'wb'
+
+    if compression == 'gzip':
+        import gzip
+        # Same level as gzip command (gzip module defaults to slowest level 9)
+        return gzip.open(filepath, binaryMode, compresslevel=6)
+    if compression == 'bz2':
+        import bz2
+        return bz2.open(filepath, binaryMode)
+    if compression == 'xz':
+        import lzma
+        return lzma.open(filepath, binaryMode)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            log.error("zstandard module for python is not installed.")
+            log.error("It is required to read or write .zst files.")
+            log.error("Try: pip3 install --user zstandard")
+            raise CompressionModuleNotInstalled
+        return zstandard.open(filepath, binaryMode)
+
+    log.error("Unknown compression '" + str(compression) + "'.")
+    raise UnknownCompression
+
+
+def openCompressed(filepath, mode, compression):
+    """
+    Open filepath as a binary stream (de)compressed by a helper thread.
+    """
+    if mode == 'read':
+        return ThreadedReader(openStream(filepath, mode, compression))
+    return ThreadedWriter(openStream(filepath, mode, compression))
+
+
+class ThreadedReader(io.RawIOBase):
+    """
+    Raw stream returning data read from stream by a helper thread
+    """
+
+    def __init__(self, stream):
+        self.__stream = stream
+        self.__chunks = queue.Queue(QUEUE_DEPTH)
+        self.__chunk = memoryview(b'')
+        self.__eof = False
+        self.__error = None
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(target=self.__read, daemon=True)
+        self.__thread.start()
+
+    def __put(self, chunk):
+        # Give up if reader is closed while queue is full
+        while not self.__stopped.is_set():
+            try:
+                self.__chunks.put(chunk, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __read(self):
+        try:
+            while True:
+                chunk = self.__stream.read(CHUNK_SIZE)
+                if not self.__put(chunk) or not chunk:
+                    break
+        except Exception as e:
+            self.__error = e
+            self.__put(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.__chunk:
+            if self.__eof:
+                return 0
+            chunk = self.__chunks.get()
+            if not chunk:
+                self.__eof = True
+                if self.__error is not None:
+                    log.error("Failed to decompress input file.")
+                    raise self.__error
+                return 0
+            self.__chunk = memoryview(chunk)
+
+        nbBytes = min(len(buffer), len(self.__chunk))
+        buffer[:nbBytes] = self.__chunk[:nbBytes]
+        self.__chunk = self.__chunk[nbBytes:]
+        return nbBytes
+
+    def close(self):
+        if not self.closed:
+            self.__stopped.set()
+            self.__thread.join()
+            self.__stream.close()
+        super().close()
+
+
+class ThreadedWriter(io.RawIOBase):
+    """
+    Raw stream whose data is written to stream by a helper thread
+    """
+
+    def __init__(self, stream):
+        self.__stream = stream
+        self.__chunks = queue.Queue(QUEUE_DEPTH)
+        self.__error = None
+        self.__thread = threading.Thread(target=self.__write, daemon=True)
+        self.__thread.start()
+
+    def __write(self):
+        while True:
+            chunk = self.__chunks.get()
+            if chunk is None:
+                break
+            if self.__error is None:  # keep consuming to never block writer
+                try:
+                    self.__stream.write(chunk)
+                except Exception as e:
+                    self.__error = e
+
+    def __checkError(self):
+        if self.__error is not None:
+            log.error("Failed to compress output file.")
+            raise self.__error
+
+    def writable(self):
+        return True
+
+    def write(self, buffer):
+        self.__checkError()
+        self.__chunks.put(bytes(buffer))
+        return len(buffer)
+
+    def close(self):
+        if self.closed:
+            return
+        self.__chunks.put(None)
+        self.__thread.join()
+        try:
+            self.__stream.close()
+        finally:
+            super().close()
+        self.__checkError()
@@ -20,25 +20,435 @@ Local filesystem scheme
 
 Parameters:
 filepath: (str) path to file
-mode: (str) 'read' or 'write', open file in reading or writing mode
+mode: (str) 'read', 'write' or 'append', open file in reading, writing or
+            appending mode
             Note that file is always opened as text (not binary)
+byteRange: (tuple, optional) (start, end) read only bytes from start to end
+           (excluded) of file (see splitFile)
+compression: (str, optional) 'auto' (default: detected from extension or
+             magic bytes), None, 'gzip', 'bz2', 'xz' or 'zstd'
+offset: (int, optional) read lines from offset and keep the offset following
+        the last line read in fd.offset (see TrackedLines)
 
-Variable:
+Variables:
 fd: file descriptor of opened file
+compression: compression of file (None if not compressed)
+
+Functions:
+splitFile: split a file in byte ranges aligned on record boundaries
+expandPath: return input files matching a path (file, directory, glob
+            pattern, zip or tar archive), see InputFile
 """
 
 import logging as log
+import io
+import os
+import mmap
+import locale
+import time
+import threading
+import glob
+import tarfile
+import zipfile
+
+from schemes.compression import detectCompression, openCompressed, ThreadedReader, CHUNK_SIZE
+
+
+# Size of windows used to count quotes (bounds memory used by splitFile)
+QUOTE_SCAN_WINDOW = 16 * 1024 * 1024
+
+# Followed files (see FollowedLines): default number of seconds between two
+# checks of new data, and maximum number of seconds between two flushes
+POLL_INTERVAL = 1.0
+FLUSH_INTERVAL = 1.0
+
+
+class ByteRange(io.RawIOBase):
+    """
+    Raw stream returning bytes from start to end (excluded) of a binary file
+    """
+
+    def __init__(self, raw, start, end):
+        raw.seek(start)
+        self.__raw = raw
+        self.__remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.__remaining <= 0:
+            return 0
+        nbBytes = self.__raw.readinto(memoryview(buffer)[:self.__remaining])
+        self.__remaining -= nbBytes
+        return nbBytes
+
+    def close(self):
+        self.__raw.close()
+        super().close()
+
+
+class RecordBoundaries():
+    """
+    Find record boundaries (newlines) in a memory-mapped file.
+    If quotechar is given, newlines enclosed in quotes are ignored: quotes are
+    counted from the beginning of the file (escaped quotes are doubled in DSV
+    files, so they don't change parity).
+    Positions given to after() must be increasing.
+    """
+
+    def __init__(self, mm, quotechar):
+        self.__mm = mm
+        self.__quote = quotechar.encode() if quotechar else None
+        self.__scanned = 0
+        self.__inQuotes = False
+
+    def __countQuotes(self, position):
+        # Update quote parity from last scanned position to position
+        while self.__scanned < position:
+            end = min(position, self.__scanned + QUOTE_SCAN_WINDOW)
+            if self.__mm[self.__scanned:end].count(self.__quote) % 2:
+                self.__inQuotes = not self.__inQuotes
+            self.__scanned = end
+
+    def after(self, position):
+        """
+        Return the offset following the first record boundary found from position
+        (size of file if there is none)
+        """
+        while True:
+            newline = self.__mm.find(b'\n', position)
+            if newline == -1:
+                return len(self.__mm)
+            if self.__quote is not None:
+                self.__countQuotes(newline)
+                if self.__inQuotes:
+                    position = newline + 1
+                    continue
+            return newline + 1
+
+
+def splitFile(filepath, rangeSize, skipHeader, quotechar=None):
+    """
+    Split file in byte ranges of about rangeSize bytes aligned on record
+    boundaries. Return a list of (start, end) tuples.
+
+    Parameters:
+    skipHeader: (bool) first record (header) is not part of any range
+    quotechar: (str or None) newlines enclosed in quotechar are not record
+               boundaries (set it if values may contain newlines)
+    """
+    with open(filepath, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            boundaries = RecordBoundaries(mm, quotechar)
+            start = boundaries.after(0) if skipHeader else 0
+            ranges = []
+            while start < len(mm):
+                end = boundaries.after(start + max(rangeSize, 1) - 1)
+                ranges.append((start, end))
+                start = end
+
+    return ranges
+
+
+class TrackedLines():
+    """
+    Iterator on lines of a text file read from offset start, keeping the
+    offset following the last line returned (offset). Line endings are
+    returned untranslated.
+    """
+
+    def __init__(self, filepath, start=0):
+        self.__file = open(filepath, 'rb')
+        self.__file.seek(start)
+        self.__encoding = locale.getpreferredencoding(False)  # same as open()
+        self.offset = start
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.__file.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line.decode(self.__encoding)
+
+    def close(self):
+        self.__file.close()
+
+
+class FollowedLines():
+    """
+    Iterator on complete lines of a text file which is still written (like
+    tail -F): at end of file, wait for new lines until stop() is called.
+    When path is rotated (renamed and created again), the new file is read
+    once the old one is read. A truncated file is read again from the
+    beginning. Line endings are returned untranslated.
+
+    Parameters:
+    filepath: (str) path to file
+    start: (int, optional) offset of first line
+    skipHeader: (bool, optional) skip first line of files read after a
+                rotation or a truncation (header of DSV files)
+    pollInterval: (float, optional) seconds between two checks of new data
+    flushInterval: (float, optional) maximum number of seconds between a line
+                   returned and the next call of flush
+    flush: (function, optional) called when waiting for new data and every
+           flushInterval seconds while lines are read (only if lines were
+           returned since the last call)
+    idleTimeout: (float, optional) stop after idleTimeout seconds without new
+                 data (default: wait until stop() is called)
+
+    Variable:
+    offset: offset following the last line returned in current file
+
+    Method:
+    stop: stop iteration (can be called by a signal handler or a thread)
+    """
+
+    def __init__(self, filepath, start=0, skipHeader=False, pollInterval=POLL_INTERVAL,
+                 flushInterval=FLUSH_INTERVAL, flush=None, idleTimeout=None):
+        self.__filepath = filepath
+        self.__skipHeader = skipHeader
+        self.__pollInterval = pollInterval
+        self.__flushInterval = flushInterval
+        self.__flush = flush
+        self.__idleTimeout = idleTimeout
+        self.__encoding = locale.getpreferredencoding(False)  # same as open()
+        self.__stopped = threading.Event()
+
+        self.__file = open(filepath, 'rb')
+        self.__file.seek(start)
+        self.offset = start
+        self.__partial = b''  # incomplete last line
+        self.__skipLine = False
+        self.__unflushed = False
+        self.__lastFlush = time.monotonic()
+
+    def stop(self):
+        self.__stopped.set()
+
+    def __iter__(self):
+        return self
+
+    def __reopen(self):
+        """
+        Read path again from the beginning if it was rotated or truncated.
+        Return False if there is nothing new to read.
+        """
+        try:
+            stat = os.stat(self.__filepath)
+        except FileNotFoundError:  # rotated, not created yet
+            return False
+        current = os.fstat(self.__file.fileno())
+
+        if (stat.st_dev, stat.st_ino) != (current.st_dev, current.st_ino):
+            log.info(self.__filepath + " was rotated, reading new file")
+            self.__file.close()
+            self.__file = open(self.__filepath, 'rb')
+        elif current.st_size < self.__file.tell():
+            log.warning(self.__filepath + " was truncated, reading it from the beginning")
+            self.__file.seek(0)
+            self.__partial = b''
+        else:
+            return False
+
+        self.offset = 0
+        self.__skipLine = self.__skipHeader
+        return True
+
+    def __wait(self, idleSince):
+        # Flush lines returned before waiting
+        if self.__flush is not None and self.__unflushed:
+            self.__flush()
+            self.__unflushed = False
+            self.__lastFlush = time.monotonic()
+
+        if self.__idleTimeout is not None and \
+            time.monotonic() - idleSince >= self.__idleTimeout:
+                log.info("No new data in " + self.__filepath + " for " +
+                         str(self.__idleTimeout) + "s, stopping")
+                self.stop()
+        self.__stopped.wait(self.__pollInterval)
+
+    def __next__(self):
+        idleSince = None
+        while not self.__stopped.is_set():
+            line = self.__file.readline()
+            if line:
+                idleSince = None
+                if not line.endswith(b'\n'):
+                    self.__partial += line  # wait for the end of line
+                    continue
+                line = self.__partial + line
+                self.__partial = b''
+                self.offset += len(line)
+                if self.__skipLine:
+                    self.__skipLine = False
+                    continue
+                return self.__return(line)
+
+            # End of file
+            if self.__reopen():
+                if self.__partial:  # last line of rotated file
+                    line = self.__partial
+                    self.__partial = b''
+                    return self.__return(line)
+                continue
+
+            if idleSince is None:
+                idleSince = time.monotonic()
+            self.__wait(idleSince)
+
+        raise StopIteration
+
+    def __return(self, line):
+        if self.__flush is not None:
+            # Flush previous lines (already processed by caller)
+            if self.__unflushed and time.monotonic() - self.__lastFlush >= self.__flushInterval:
+                self.__flush()
+                self.__lastFlush = time.monotonic()
+            self.__unflushed = True
+        return line.decode(self.__encoding)
+
+    def close(self):
+        self.__file.close()
+
 
 class LocalFile():
-    def __init__(self, filepath, mode):
+    def __init__(self, filepath, mode, byteRange=None, compression='auto', offset=None):
+
+        if compression == 'auto' and mode in ('read', 'write', 'append'):
+            compression = detectCompression(filepath, mode)
+        self.compression = compression
+
+        if compression is not None and (byteRange is not None or offset is not None):
+            log.error("Byte ranges of compressed files can't be read.")
+            raise Exception('ByteRangeOfCompressedFile')
+
+        if compression is not None and mode == 'append':
+            log.error("Compressed files can't be appended.")
+            raise Exception('AppendToCompressedFile')
+
+        if compression is not None and mode == 'read':
+            raw = openCompressed(filepath, mode, compression)
+            self.fd = io.TextIOWrapper(io.BufferedReader(raw, CHUNK_SIZE), newline='')
 
-        if mode == 'read':
+        elif compression is not None and mode == 'write':
+            raw = openCompressed(filepath, mode, compression)
+            self.fd = io.TextIOWrapper(io.BufferedWriter(raw, CHUNK_SIZE))
+
+        elif mode == 'read' and offset is not None:
+            self.fd = TrackedLines(filepath, offset)
+
+        elif mode == 'read' and byteRange is not None:
+            raw = ByteRange(open(filepath, 'rb', buffering=0), *byteRange)
+            self.fd = io.TextIOWrapper(io.BufferedReader(raw), newline='')
+
+        elif mode == 'read':
             # newline='' returns line endings untranslated (required for DSVReader)
             self.fd = open(filepath, 'rt', newline='')
 
         elif mode == 'write':
             self.fd = open(filepath, 'wt')
 
+        elif mode == 'append':
+            self.fd = open(filepath, 'at')
+
         else:
             log.error("Unknown mode '" + mode + "' for local scheme.")
             raise Exception('UnknownModeForLocalScheme')
+
+
+# Archives are recognized by their extension
+ZIP_EXTENSIONS = ('.zip',)
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+class NoInputFile(Exception):
+    """
+    No file matches input path
+    """
+    pass
+
+
+class InputFile():
+    """
+    File of a multi-file input: a file, a member of a zip archive or a whole
+    tar archive (members of a tar archive can only be read in order).
+    InputFile objects are picklable (they can be sent to worker processes).
+
+    Variable:
+    name: name of file, 'archive:member' for a member of a zip archive
+
+    Method:
+    files: iterate on (name, fd) of files to read: one file, or each regular
+           file of a tar archive (fd must be read before next iteration).
+           Members of archives are streamed, they are never extracted.
+    """
+
+    def __init__(self, path, member=None, archive=None):
+        self.path = path
+        self.member = member
+        self.archive = archive
+        self.name = path if member is None else path + ':' + member
+
+    def files(self):
+        if self.archive == 'zip':
+            with zipfile.ZipFile(self.path) as archive:
+                with io.TextIOWrapper(archive.open(self.member), newline='') as fd:
+                    yield self.name, fd
+
+        elif self.archive == 'tar':
+            with tarfile.open(self.path, 'r|*') as archive:
+                for member in archive:
+                    if member.isfile():
+                        # Members of a streamed archive are not seekable (required
+                        # by TextIOWrapper): they are read by a helper thread
+                        raw = ThreadedReader(archive.extractfile(member))
+                        with io.TextIOWrapper(io.BufferedReader(raw, CHUNK_SIZE),
+                                              newline='') as fd:
+                            yield self.path + ':' + member.name, fd
+
+        else:
+            fd = LocalFile(self.path, 'read').fd
+            try:
+                yield self.name, fd
+            finally:
+                fd.close()
+
+
+def expandPath(path):
+    """
+    Return the list of InputFile matching path: a file, a directory (files it
+    contains) or a glob pattern ('**' matches subdirectories), sorted by name.
+    Zip archives are replaced by their members.
+    """
+    if os.path.isfile(path):
+        paths = [path]
+    elif os.path.isdir(path):
+        paths = sorted(os.path.join(path, name) for name in os.listdir(path))
+    else:
+        paths = sorted(glob.glob(path, recursive=True))
+    paths = [p for p in paths if os.path.isfile(p)]
+
+    if not paths:
+        log.error("No input file matches '" + path + "'.")
+        raise NoInputFile
+
+    inputFiles = []
+    for p in paths:
+        if p.lower().endswith(ZIP_EXTENSIONS):
+            with zipfile.ZipFile(p) as archive:
+                inputFiles.extend(InputFile(p, info.filename, 'zip')
+                                  for info in archive.infolist() if not info.is_dir())
+        elif p.lower().endswith(TAR_EXTENSIONS):
+            inputFiles.append(InputFile(p, archive='tar'))
+        else:
+            inputFiles.append(InputFile(p))
+
+    return inputFiles
@@ -0,0 +1,98 @@
+# Copyright (C) 2018 Project-EBDO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# EBDO-Ingester
+# Author: Flebdo
+
+"""
+Test JSON codec with unittest
+"""
+
+import unittest
+import json
+
+from codec.jsoncodec import *
+
+
+class TestCodec(unittest.TestCase):
+
+    def installedBackends(self):
+        backends = []
+        for backend in BACKENDS:
+            try:
+                backends.append(JSONCodec(backend))
+            except JSONBackendNotInstalled:
+                pass
+        return backends
+
+    def test_JSONCodec(self):
+
+        Testsuite = [
+            {
+            'description': "Empty document",
+            'data': {}
+            },
+            {
+            'description': "Scalar values",
+            'data': {'str': 'abc', 'int': -42, 'float': 3.14, 'bool': True, 'none': None}
+            },
+            {
+            'description': "Nested values",
+            'data': {'location': {'lat': 48.85, 'lon': 2.35}, 'list': [1, 2.5, 'a', [None]]}
+            },
+            {
+            'description': "Non ASCII and escaped characters",
+            'data': {'city': 'Besançon', 'path': 'a/b', 'quote': '"\\\n\t'}
+            },
+            {
+            'description': "Float written with an exponent",
+            'data': {'small': 1e-7, 'large': 1.5e20}
+            },
+            {
+            'description': "Special floats",
+            'data': {'nan': float('nan'), 'inf': float('inf')}
+            },
+            {
+            'description': "Integer longer than 64 bits",
+            'data': {'big': 123456789012345678901234567890}
+            },
+            {
+            'description': "Keys are not strings",
+            'data': {1: 'one', None: 'none'}
+            }
+        ]
+
+        stdDumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+        for codec in self.installedBackends():
+            for test in Testsuite:
+                with self.subTest(backend=codec.backend, description=test['description']):
+                    expected = stdDumps(test['data'])
+                    self.assertEqual(codec.dumps(test['data']), expected)
+                    self.assertEqual(codec.dumpsPretty(test['data']),
+                                     json.dumps(test['data'], indent=4))
+                    # Compare encoded values (NaN is not equal to itself)
+                    self.assertEqual(stdDumps(codec.loads(expected)),
+                                     stdDumps(json.loads(expected)))
+
+    def test_unknownBackend(self):
+        with self.assertRaises(JSONBackendNotInstalled):
+            JSONCodec('notAJSONModule')
+
+    def test_autoBackend(self):
+        self.assertIn(JSONCodec().backend, BACKENDS)
+
+
+if __name__ == '__main__':
+    unittest.main()
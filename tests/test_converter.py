@@ -20,8 +20,11 @@ Test converter with unittest
 """
 
 import unittest
+import unittest.mock as mock
 import logging as log
 from converters.converter import *
+from converters.dateparser import *
+from datetime import datetime
 
 
 class TestConverter(unittest.TestCase):
@@ -160,6 +163,20 @@ class TestConverter(unittest.TestCase):
             'Exception': "FailedToParseDate"
             },
             {
+            'description': "Date is not a string (null timestamp of JSON or Parquet input)",
+            'data': {"Time of Observation": None},
+            'configConverters': {
+                'Time of Observation': {'inputType': 'str',
+                                        'inputName': 'Time of Observation',
+                                        'outputName': 'timestamp',
+                                        'outputType': 'timestamp',
+                                        'dateFormat': "%Y-%m-%dT%H:%M:%S",
+                                        'convertToEpoch': True
+                                        }
+                },
+            'Exception': "TypeMismatchForInput"
+            },
+            {
             'description': "Empty input value and no default specified",
             'data': {"Sea_temperature": ""},
             'configConverters': {'Sea_temperature': {'inputType': 'str',
@@ -340,3 +357,402 @@ class TestConverter(unittest.TestCase):
 
             else:
                 log.error("Unknown test (no 'result' or 'Exception' section found)")
+
+
+    def test_ConversionPlan(self):
+
+        configConverters = {
+            'Wind Direction': {'inputType': 'str',
+                               'inputName': 'Wind Direction',
+                               'outputName': 'wind_direction',
+                               'outputType': 'int',
+                               'defaultValue': None
+                               },
+            'Sea_temperature': {'inputType': 'str',
+                                'inputName': 'Sea_temperature',
+                                'outputName': 'sea_temperature',
+                                'outputType': 'float',
+                                'defaultValue': '-1'
+                                }
+            }
+        configFormat = {'noneValues': ['', None, 'N/A'], 'elasticsearch': {}}
+
+        Testsuite = [
+            {
+            'description': "Plan is reused for several rows",
+            'data': {'Wind Direction': '270', 'Sea_temperature': '20.5'},
+            'result': {'wind_direction': 270, 'sea_temperature': 20.5}
+            },
+            {
+            'description': "Plan handles default values",
+            'data': {'Wind Direction': 'N/A', 'Sea_temperature': ' '},
+            'result': {'wind_direction': None, 'sea_temperature': -1.0}
+            },
+            {
+            'description': "Empty data (empty source)",
+            'data': {},
+            'result': {}
+            },
+            {
+            'description': "Plan raises on conversion error",
+            'data': {'Wind Direction': 'North', 'Sea_temperature': '20.5'},
+            'Exception': "TypeConversionFailed"
+            }
+            ]
+
+        print("> Testing ConversionPlan...")
+
+        # Config is compiled once for all testcases
+        converter = Converter(configConverters, configFormat)
+        for testcase in Testsuite:
+            print(testcase['description'])
+
+            if 'result' in testcase:
+                self.assertEqual(converter.convert(testcase['data']),
+                                 testcase['result'])
+            else:
+                exception_class = eval(testcase['Exception'])
+                with self.assertRaises(exception_class):
+                    converter.convert(testcase['data'])
+
+        # Unsupported types are detected when config is compiled
+        configConverters['Wind Direction']['outputType'] = 'ThisTypeDoesNotExist'
+        with self.assertRaises(typeNotSupported):
+            Converter(configConverters, configFormat)
+
+
+    def test_DateParser(self):
+
+        Testsuite = [
+            {
+            'description': "ISO 8601 date (fast parser)",
+            'dateFormat': "%Y-%m-%dT%H:%M:%S",
+            'values': ["2010-08-01T00:00:00", "2016-02-29T23:59:59"],
+            'fast': True
+            },
+            {
+            'description': "Date only (fast parser)",
+            'dateFormat': "%Y%m%d",
+            'values': ["20100801", "19991231"],
+            'fast': True
+            },
+            {
+            'description': "Year only (fast parser, default month and day)",
+            'dateFormat': "%Y",
+            'values': ["2010", "1999"],
+            'fast': True
+            },
+            {
+            'description': "Year and month (fast parser, default day)",
+            'dateFormat': "%Y-%m",
+            'values': ["2010-08", "1999-12"],
+            'fast': True
+            },
+            {
+            'description': "Directives not in datetime order (fast parser)",
+            'dateFormat': "%d/%m/%Y %H:%M",
+            'values': ["01/08/2010 13:45", "31/12/1999  07:05"],
+            'fast': True
+            },
+            {
+            'description': "Values not fixed-width are parsed by strptime",
+            'dateFormat': "%Y-%m-%dT%H:%M:%S",
+            'values': ["2010-8-1T0:0:0", "2010-08-01t00:00:00"],
+            'fast': True
+            },
+            {
+            'description': "Format not supported by fast parser",
+            'dateFormat': "%d %b %Y %H:%M:%S.%f",
+            'values': ["01 Aug 2010 00:00:00.123"],
+            'fast': False
+            },
+            {
+            'description': "Incorrect date",
+            'dateFormat': "%Y-%m-%dT%H:%M:%S",
+            'values': ["2010-13-01T00:00:00"],
+            'Exception': "ValueError"
+            },
+            {
+            'description': "Incorrect format",
+            'dateFormat': "%Y---%m---%dT%H---%M---%S",
+            'values': ["2010-08-01T00:00:00"],
+            'Exception': "ValueError"
+            }
+            ]
+
+        print("> Testing DateParser...")
+        for testcase in Testsuite:
+            print(testcase['description'])
+
+            dateParser = DateParser(testcase['dateFormat'], True, 16)
+            for value in testcase['values']:
+                if 'Exception' in testcase:
+                    exception_class = eval(testcase['Exception'])
+                    with self.assertRaises(exception_class):
+                        dateParser.parse(value)
+                    continue
+
+                # Results must be the ones of strptime
+                expected = int(datetime.timestamp(
+                               datetime.strptime(value, testcase['dateFormat']))*1000)
+                self.assertEqual(dateParser.parse(value), expected)
+                self.assertEqual(DateParser(testcase['dateFormat'], False, 0).parse(value),
+                                 value)
+            if 'fast' in testcase:
+                self.assertEqual(dateParser.fast, testcase['fast'])
+
+        print("Cache statistics")
+        dateParser = DateParser("%Y-%m-%dT%H:%M:%S", True, 2)
+        for value in ["2010-08-01T00:00:00"] * 3 + ["2010-08-02T00:00:00"]:
+            dateParser.parse(value)
+        self.assertEqual(dateParser.cacheInfo().hits, 2)
+        self.assertEqual(dateParser.cacheInfo().misses, 2)
+        self.assertEqual(dateParser.hitRate(), 0.5)
+        self.assertEqual(DateParser("%Y", True, 0).cacheInfo(), None)
+
+
+    def test_convertBatch(self):
+
+        configConverters = {
+            'Time of Observation': {'inputType': 'str',
+                                    'inputName': 'Time of Observation',
+                                    'outputName': 'timestamp',
+                                    'outputType': 'timestamp',
+                                    'dateFormat': "%Y-%m-%dT%H:%M:%S",
+                                    'convertToEpoch': True
+                                    },
+            'Wind Direction': {'inputType': 'str',
+                               'inputName': 'Wind Direction',
+                               'outputName': 'wind_direction',
+                               'outputType': 'int',
+                               'defaultValue': None
+                               },
+            'Sea_temperature': {'inputType': 'str',
+                                'inputName': 'Sea_temperature',
+                                'outputName': 'sea_temperature',
+                                'outputType': 'float',
+                                'defaultValue': '-1'
+                                },
+            'Station': {'inputType': 'str',
+                        'inputName': 'Station',
+                        'outputName': 'station',
+                        'outputType': 'str'
+                        },
+            'Latitude': {'inputType': 'str',
+                         'inputName': 'Latitude',
+                         'outputName': 'latitude',
+                         'outputType': 'latitude'
+                         },
+            'Longitude': {'inputType': 'str',
+                          'inputName': 'Longitude',
+                          'outputName': 'longitude',
+                          'outputType': 'longitude'
+                          }
+            }
+        configFormat = {'noneValues': ['', None, 'N/A'],
+                        'elasticsearch': {'latitudeInputName': 'Latitude',
+                                          'longitudeInputName': 'Longitude'}
+                        }
+
+        Testsuite = [
+            {
+            'description': "Block without empty values",
+            'columns': {'Time of Observation': ["2010-08-01T00:00:00", "2010-08-01T01:00:00"],
+                        'Wind Direction': ["270", " 90 "],
+                        'Sea_temperature': ["20.5", "21"],
+                        'Station': ["B1", " B2"],
+                        'Latitude': ["47.3", "47.4"],
+                        'Longitude': ["14.7", "14.8 "]}
+            },
+            {
+            'description': "Block with empty values (default values)",
+            'columns': {'Time of Observation': ["2010-08-01T00:00:00", "2010-08-01T00:00:00"],
+                        'Wind Direction': ["N/A", "90"],
+                        'Sea_temperature': ["20.5", ""],
+                        'Station': ["B1", "B1"],
+                        'Latitude': ["47.3", "47.3"],
+                        'Longitude': ["14.7", "14.7"]}
+            },
+            {
+            'description': "Empty block",
+            'columns': {}
+            },
+            {
+            'description': "Type conversion failed in a block",
+            'columns': {'Time of Observation': ["2010-08-01T00:00:00", "2010-08-01T00:00:00"],
+                        'Wind Direction': ["270", "North"],
+                        'Sea_temperature': ["20.5", "21"],
+                        'Station': ["B1", "B1"],
+                        'Latitude': ["47.3", "47.3"],
+                        'Longitude': ["14.7", "14.7"]},
+            'Exception': "TypeConversionFailed"
+            },
+            {
+            'description': "Empty value and no default value in a block",
+            'columns': {'Time of Observation': ["2010-08-01T00:00:00", "2010-08-01T00:00:00"],
+                        'Wind Direction': ["270", "90"],
+                        'Sea_temperature': ["20.5", "21"],
+                        'Station': ["B1", ""],
+                        'Latitude': ["47.3", "47.3"],
+                        'Longitude': ["14.7", "14.7"]},
+            'Exception': "defaultNotDefined"
+            },
+            {
+            'description': "Incorrect date in a block",
+            'columns': {'Time of Observation': ["2010-08-01T00:00:00", "2010-08-01"],
+                        'Wind Direction': ["270", "90"],
+                        'Sea_temperature': ["20.5", "21"],
+                        'Station': ["B1", "B1"],
+                        'Latitude': ["47.3", "47.3"],
+                        'Longitude': ["14.7", "14.7"]},
+            'Exception': "FailedToParseDate"
+            },
+            {
+            'description': "Date is not a string in a block",
+            'columns': {'Time of Observation': ["2010-08-01T00:00:00", None],
+                        'Wind Direction': ["270", "90"],
+                        'Sea_temperature': ["20.5", "21"],
+                        'Station': ["B1", "B1"],
+                        'Latitude': ["47.3", "47.3"],
+                        'Longitude': ["14.7", "14.7"]},
+            'Exception': "TypeMismatchForInput"
+            },
+            {
+            'description': "Type mismatch in a block",
+            'columns': {'Time of Observation': ["2010-08-01T00:00:00", "2010-08-01T00:00:00"],
+                        'Wind Direction': ["270", 90],
+                        'Sea_temperature': ["20.5", "21"],
+                        'Station': ["B1", "B1"],
+                        'Latitude': ["47.3", "47.3"],
+                        'Longitude': ["14.7", "14.7"]},
+            'Exception': "TypeMismatchForInput"
+            }
+            ]
+
+        print("> Testing convertBatch...")
+
+        converter = Converter(configConverters, configFormat)
+        for testcase in Testsuite:
+            print(testcase['description'])
+
+            if 'Exception' in testcase:
+                exception_class = eval(testcase['Exception'])
+                with self.assertRaises(exception_class):
+                    converter.convertBatch(testcase['columns'])
+                continue
+
+            # Results must be the ones of the row by row conversion
+            rows = [dict(zip(testcase['columns'], values))
+                    for values in zip(*testcase['columns'].values())]
+            self.assertEqual(converter.convertBatch(testcase['columns']),
+                             [converter.convert(row) for row in rows])
+
+        print("Errors of rows tell what went wrong (dead-letter file)")
+        row = {'Time of Observation': 5, 'Wind Direction': "90", 'Sea_temperature': "a",
+               'Station': "B1", 'Latitude': "47.3", 'Longitude': "14.7"}
+        with self.assertRaises(TypeMismatchForInput) as context:
+            converter.convert(row)
+        self.assertEqual(context.exception.inputName, 'Time of Observation')
+        self.assertEqual(str(context.exception), "expected str (date), found int: 5")
+        row['Time of Observation'] = "2010-08-01T00:00:00"
+        with self.assertRaises(TypeConversionFailed) as context:
+            converter.convert(row)
+        self.assertEqual(context.exception.inputName, 'Sea_temperature')
+        self.assertTrue(str(context.exception).startswith("can't convert 'a' to float"))
+
+        print("Errors of rows are not logged by converter (but by ingester, once)")
+        with mock.patch('converters.converter.log') as converterLog:
+            for name, value in (('Sea_temperature', "a"), ('Time of Observation', "x"),
+                                ('Time of Observation', 5), ('Wind Direction', 90)):
+                invalidRow = dict(row, **{name: value})
+                with self.assertRaises(ROW_ERRORS):
+                    converter.convert(invalidRow)
+                with self.assertRaises(ROW_ERRORS):
+                    converter.convertBatch({name: [value] for name, value in invalidRow.items()})
+        converterLog.error.assert_not_called()
+        converterLog.exception.assert_not_called()
+
+
+    def test_ValueCache(self):
+
+        configConverters = {
+            'Station': {'inputType': 'str',
+                        'inputName': 'Station',
+                        'outputName': 'station',
+                        'outputType': 'int',
+                        'defaultValue': None,
+                        'cache': 2
+                        },
+            'Wind Speed': {'inputType': 'str',
+                           'inputName': 'Wind Speed',
+                           'outputName': 'wind_speed',
+                           'outputType': 'float',
+                           'cache': 'auto'
+                           }
+            }
+        configFormat = {'noneValues': ['', None, 'N/A'], 'elasticsearch': {}}
+
+        print("> Testing ValueCache...")
+        converter = Converter(configConverters, configFormat)
+        caches = converter.plan.valueCaches
+
+        print("Memoized conversions")
+        for station in ['1', '2', '1', 'N/A', '1']:
+            self.assertEqual(converter.convert({'Station': station, 'Wind Speed': '1'}),
+                             {'station': None if station == 'N/A' else int(station),
+                              'wind_speed': 1.0})
+        self.assertEqual(caches['Station'].cacheInfo().hits, 2)  # '2' evicted by 'N/A'
+        self.assertEqual(caches['Station'].cacheInfo().misses, 3)
+        self.assertEqual(caches['Station'].cacheInfo().currsize, 2)
+
+        print("Column conversion uses cache")
+        self.assertEqual(converter.convertBatch({'Station': ['1', '1'],
+                                                 'Wind Speed': ['2', '2']}),
+                         [{'station': 1, 'wind_speed': 2.0}] * 2)
+        self.assertEqual(caches['Station'].cacheInfo().hits, 4)
+
+        print("Errors are not memoized")
+        for i in range(2):
+            with self.assertRaises(TypeConversionFailed):
+                converter.convert({'Station': 'B1', 'Wind Speed': '1'})
+
+        print("Unhashable values are rejected as type mismatches")
+        with self.assertRaises(TypeMismatchForInput):
+            converter.convert({'Station': ['1'], 'Wind Speed': '1'})
+        with self.assertRaises(TypeMismatchForInput):
+            converter.convertBatch({'Station': ['1', {'a': 1}], 'Wind Speed': ['1', '1']})
+
+        print("Automatic cache is disabled if hit rate is too low")
+        self.assertTrue(converter.plan.tuneCaches())  # Not used enough yet
+        self.assertTrue(caches['Wind Speed'].enabled)
+        for i in range(AUTO_CACHE_PROBE // 2):
+            converter.convert({'Station': '1', 'Wind Speed': str(i)})
+        self.assertTrue(converter.plan.tuneCaches())
+        self.assertTrue(caches['Wind Speed'].enabled)
+        for i in range(AUTO_CACHE_PROBE // 2, AUTO_CACHE_PROBE):
+            converter.convert({'Station': '1', 'Wind Speed': str(i)})
+        self.assertFalse(converter.plan.tuneCaches())
+        self.assertFalse(caches['Wind Speed'].enabled)
+        self.assertTrue(caches['Station'].enabled)  # Not an automatic cache
+        misses = caches['Wind Speed'].cacheInfo().misses
+        self.assertEqual(converter.convert({'Station': '1', 'Wind Speed': '1000'}),
+                         {'station': 1, 'wind_speed': 1000.0})
+        self.assertEqual(caches['Wind Speed'].cacheInfo().misses, misses)
+
+        print("List values are not memoized (rows would share them)")
+        listConverters = {'Tags': {'inputType': 'str',
+                                   'inputName': 'Tags',
+                                   'outputName': 'tags',
+                                   'outputType': 'list',
+                                   'cache': 'auto'
+                                   }}
+        listConverter = Converter(listConverters, configFormat)
+        self.assertEqual(listConverter.plan.valueCaches, {})
+        row = listConverter.convert({'Tags': 'ab'})
+        row['tags'].append('c')
+        self.assertEqual(listConverter.convert({'Tags': 'ab'}), {'tags': ['a', 'b']})
+
+        print("Invalid cache option")
+        configConverters['Station']['cache'] = 'always'
+        with self.assertRaises(ValueError):
+            Converter(configConverters, configFormat)
@@ -0,0 +1,63 @@
+# Copyright (C) 2018 Project-EBDO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# EBDO-Ingester
+# Author: Flebdo
+
+"""
+Test ingester with unittest
+"""
+
+import unittest
+import logging as log
+
+from ingester import traceRows
+
+
+class TestIngester(unittest.TestCase):
+
+    def test_traceRows(self):
+
+        Testsuite = [
+            {
+            'description': "Block converted column by column",
+            'rows': [{'i': i} for i in range(10, 20)],
+            'rowNumbers': range(10, 20),
+            'traceEvery': 4,
+            'result': [(12, {'i': 12}), (16, {'i': 16})]
+            },
+            {
+            'description': "Rows rejected before and between traced rows",
+            'rows': [{'i': 10}, {'i': 11}, {'i': 13}, {'i': 14}, {'i': 16}, {'i': 19}],
+            'rowNumbers': [10, 11, 13, 14, 16, 19],
+            'traceEvery': 2,
+            'result': [(10, {'i': 10}), (14, {'i': 14}), (16, {'i': 16})]
+            },
+            {
+            'description': "Traced row rejected, last rows rejected",
+            'rows': [{'i': 1}, {'i': 2}],
+            'rowNumbers': [1, 2],
+            'traceEvery': 3,
+            'result': []
+            }
+            ]
+
+        print("> Testing traceRows...")
+        for testcase in Testsuite:
+            print(testcase['description'])
+            traced = []
+            traceRows(lambda message, rowNumber, row: traced.append((rowNumber, row)),
+                      testcase['traceEvery'], testcase['rows'], testcase['rowNumbers'])
+            self.assertEqual(traced, testcase['result'])
+
@@ -21,10 +21,22 @@ Test readers with unittest
 
 import unittest
 import io
+import itertools
+import json
 import logging as log
 
 from readers.DSVReader import *
 from readers.JSONReader import *
+from readers.jsonstream import *
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+if pyarrow is not None:
+    import pyarrow.parquet
+    import pyarrow.feather
+    from readers.ParquetReader import *
 
 class TestReaders(unittest.TestCase):
 
@@ -190,6 +202,42 @@ class TestReaders(unittest.TestCase):
                           (no 'result' or 'Exception' section found)")
 
 
+    def test_DSVReader_columns(self):
+
+        print("> Testing DSVReader columns...")
+        source = DSVReader(io.StringIO('Latitude,Longitude,Wind\n'
+                                       '47.3,14.7,270\n'
+                                       '47.4,14.8,90\n'
+                                       '47.5,14.9,\n'),
+                           ['Wind', 'Latitude'], ',', None, True)
+        self.assertEqual(list(source.columns(2)),
+                         [{'Wind': ['270', '90'], 'Latitude': ['47.3', '47.4']},
+                          {'Wind': [''], 'Latitude': ['47.5']}])
+        source.close()
+
+        print("Empty file")
+        source = DSVReader(io.StringIO('Latitude\n'), ['Latitude'], ',', None, True)
+        self.assertEqual(list(source.columns(2)), [])
+
+
+    def test_DSVReader_batches(self):
+
+        print("> Testing DSVReader batches...")
+        line = 'Latitude,Longitude,Wind\n47.3,14.7,270\n47.4,14.8,90\n47.5,14.9,\n'
+
+        source = DSVReader(io.StringIO(line), ['Wind', 'Latitude'], ',', None, True)
+        self.assertEqual(source.schema, ('Wind', 'Latitude'))
+        self.assertEqual(list(source.batches(2)),
+                         [[{'Latitude': '47.3', 'Wind': '270'},
+                           {'Latitude': '47.4', 'Wind': '90'}],
+                          [{'Latitude': '47.5', 'Wind': ''}]])
+
+        print("Tuples in schema order")
+        source = DSVReader(io.StringIO(line), ['Wind'], ',', None, True)
+        self.assertEqual(list(source.batches(5, tuples=True)),
+                         [[('270',), ('90',), ('',)]])
+
+
     def test_JSONReader(self):
 
         Testsuite = [
@@ -254,17 +302,60 @@ class TestReaders(unittest.TestCase):
             'result': {
                 'value': 45.5216578
                 }
+            },
+            {
+            'description': "Dotted paths to nested values",
+            'line': '{"location": {"lat": 47.3, "lon": [3.89, {"alt": 5}]}, "tags": ["a", "b"]}',
+            'inputValueNames': ['location.lat', 'location.lon.1', 'tags.1'],
+            'result': {'location.lat': 47.3, 'location.lon.1': {'alt': 5}, 'tags.1': 'b'}
+            },
+            {
+            'description': "Key containing dots wins over nested value",
+            'line': '{"location.lat": 1, "location": {"lat": 2}}',
+            'inputValueNames': ['location.lat'],
+            'result': {'location.lat': 1}
+            },
+            {
+            'description': "Duplicate keys: last value wins (as json module)",
+            'line': '{"a": 1, "location": {"lat": 1, "lat": 2}, "a": 3}',
+            'inputValueNames': ['a', 'location.lat'],
+            'result': {'a': 3, 'location.lat': 2}
+            },
+            {
+            'description': "Duplicate keys, one of them escaped",
+            'line': '{"a": 1, "\\u0061": 3}',
+            'inputValueNames': ['a'],
+            'result': {'a': 3}
+            },
+            {
+            'description': "Nested value name in config file but not in JSON file",
+            'line': '{"location": {"lat": 47.3}}',
+            'inputValueNames': ['location.lon'],
+            'Exception': "ValueNameNotFoundInJSONFile"
+            },
+            {
+            'description': "Values not handled by simdjson",
+            'line': '{"big": 123456789012345678901234567890, "nan": NaN}',
+            'inputValueNames': ['big'],
+            'result': {'big': 123456789012345678901234567890}
+            },
+            {
+            'description': "Invalid JSON",
+            'line': '{"Latitude": ',
+            'inputValueNames': ['Latitude'],
+            'Exception': "ValueError"
             }
             ]
 
         print("> Testing JSONReader...")
-        for testcase in Testsuite:
+        for testcase, lazyParsing in itertools.product(Testsuite, (True, False)):
             print(testcase['description'])
             log.debug("line: " + testcase['line'])
 
             if 'result' in testcase:
                 source = JSONReader(io.StringIO(testcase['line']),
-                                    testcase['inputValueNames']
+                                    testcase['inputValueNames'],
+                                    lazyParsing=lazyParsing
                                    )
                 # Use a loop because else StopIteration raised by
                 # source.data() will kill loop on Testsuite
@@ -277,7 +368,8 @@ class TestReaders(unittest.TestCase):
                 exception_class = eval(testcase['Exception'])
                 with self.assertRaises(exception_class):
                     source = JSONReader(io.StringIO(testcase['line']),
-                                        testcase['inputValueNames']
+                                        testcase['inputValueNames'],
+                                        lazyParsing=lazyParsing
                                        )
                     # Loop on data because some exceptions could be raised
                     # only if a call of data() was made
@@ -286,3 +378,229 @@ class TestReaders(unittest.TestCase):
 
             else:
                 log.error("Unknown test (no 'result' or 'Exception' section found)")
+
+
+    def test_JSONReader_columns(self):
+
+        print("> Testing JSONReader columns...")
+        source = JSONReader(io.StringIO('{"Latitude": "47.3", "TOB": [1, 2]}\n'
+                                        '{"Latitude": "47.4", "TOB": []}\n'
+                                        '{"Latitude": null, "TOB": [3]}\n'),
+                            ['TOB', 'Latitude'])
+        self.assertEqual(list(source.columns(2)),
+                         [{'TOB': [[1, 2], []], 'Latitude': ['47.3', '47.4']},
+                          {'TOB': [[3]], 'Latitude': [None]}])
+        source.close()
+
+        print("Value name in config file but not in JSON file")
+        source = JSONReader(io.StringIO('{"Latitude": "47.3"}\n'), ['Time'])
+        with self.assertRaises(ValueNameNotFoundInJSONFile):
+            list(source.columns(2))
+
+
+    def test_JSONReader_batches(self):
+
+        print("> Testing JSONReader batches...")
+        line = '{"Latitude": "47.3", "TOB": [1, 2]}\n{"Latitude": "47.4", "TOB": []}\n'
+
+        source = JSONReader(io.StringIO(line), ['TOB', 'Latitude'])
+        self.assertEqual(list(source.batches(1)),
+                         [[{'TOB': [1, 2], 'Latitude': '47.3'}],
+                          [{'TOB': [], 'Latitude': '47.4'}]])
+
+        print("Tuples in schema order")
+        source = JSONReader(io.StringIO(line), ['TOB', 'Latitude'])
+        self.assertEqual(source.schema, ('TOB', 'Latitude'))
+        self.assertEqual(list(source.batches(5, tuples=True)),
+                         [[([1, 2], '47.3'), ([], '47.4')]])
+
+        print("Value name in config file but not in JSON file")
+        source = JSONReader(io.StringIO(line), ['Time'])
+        with self.assertRaises(ValueNameNotFoundInJSONFile):
+            list(source.batches(5, tuples=True))
+
+
+    def test_JSONReader_layouts(self):
+
+        records = [{"Latitude": "47.3", "TOB": [1, 2]},
+                   {"Latitude": "47.4", "TOB": []},
+                   {"Latitude": None, "TOB": [3]}]
+        result = [{'Latitude': record['Latitude']} for record in records]
+
+        Testsuite = [
+            {
+            'description': "Top-level array",
+            'data': json.dumps(records, indent=4),
+            'layout': 'array'
+            },
+            {
+            'description': "Array in top-level object",
+            'data': json.dumps({'meta': {'records': '[]'}, 'data': {'records': records}}),
+            'layout': 'array',
+            'path': 'data.records'
+            },
+            {
+            'description': "Pretty-printed documents",
+            'data': ''.join(json.dumps(record, indent=4) for record in records),
+            'layout': 'concatenated'
+            },
+            {
+            'description': "One document per line",
+            'data': '\n'.join(map(json.dumps, records)),
+            'layout': 'concatenated'
+            }
+            ]
+
+        print("> Testing JSONReader layouts...")
+        for testcase in Testsuite:
+            print(testcase['description'])
+            source = JSONReader(io.StringIO(testcase['data']), ['Latitude'],
+                                layout=testcase['layout'], path=testcase.get('path'))
+            self.assertEqual(list(source.data()), result)
+
+            source = JSONReader(io.StringIO(testcase['data']), ['Latitude'],
+                                layout=testcase['layout'], path=testcase.get('path'))
+            self.assertEqual(list(source.columns(2)),
+                             [{'Latitude': ['47.3', '47.4']}, {'Latitude': [None]}])
+
+        print("Empty array")
+        source = JSONReader(io.StringIO('[]'), ['Latitude'], layout='array')
+        self.assertEqual(list(source.data()), [{}])
+
+        print("Path not found")
+        source = JSONReader(io.StringIO('{"data": []}'), ['Latitude'],
+                            layout='array', path='records')
+        with self.assertRaises(PathNotFoundInJSONFile):
+            list(source.data())
+
+        print("Value name in config file but not in JSON file")
+        source = JSONReader(io.StringIO(json.dumps(records)), ['Time'], layout='array')
+        with self.assertRaises(ValueNameNotFoundInJSONFile):
+            list(source.data())
+
+        print("Unknown layout")
+        with self.assertRaises(UnknownJSONLayout):
+            JSONReader(io.StringIO(''), ['Latitude'], layout='xml')
+
+
+    def test_JSONStream(self):
+
+        document = {'meta': {'a': [1, {'x': '}]'}]},
+                    'data': {'skip': 1,
+                             'records': [{'a': i, 's': 'x"],' * i} for i in range(20)] +
+                                        [1e5, 12345, "end"]}}
+        records = document['data']['records']
+
+        print("> Testing JSONStream...")
+        # Small chunks: values and tokens are split between chunks
+        for chunkSize in (1, 3, 7, 1024):
+            print("chunkSize: " + str(chunkSize))
+            stream = JSONStream(io.StringIO(json.dumps(document, indent=2)), chunkSize)
+            self.assertEqual(list(stream.array('data.records')), records)
+
+            stream = JSONStream(io.StringIO(json.dumps(records)), chunkSize)
+            self.assertEqual(list(stream.array()), records)
+
+            stream = JSONStream(io.StringIO('12 34\n{"a": 1}\n  [1]  5 '), chunkSize)
+            self.assertEqual(list(stream.concatenated()), [12, 34, {'a': 1}, [1], 5])
+
+        Testsuite = [
+            {
+            'description': "Top-level value is not an array",
+            'data': '{"a": 1}',
+            'Exception': InvalidJSONStructure
+            },
+            {
+            'description': "Missing delimiter",
+            'data': '[1 2]',
+            'Exception': InvalidJSONStructure
+            },
+            {
+            'description': "Truncated array",
+            'data': '[1, 2',
+            'Exception': InvalidJSONStructure
+            },
+            {
+            'description': "Truncated document",
+            'data': '[{"a": ',
+            'Exception': ValueError
+            }
+            ]
+
+        for testcase in Testsuite:
+            print(testcase['description'])
+            with self.assertRaises(testcase['Exception']):
+                list(JSONStream(io.StringIO(testcase['data']), 2).array())
+
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_ParquetReader(self):
+        import datetime
+
+        table = pyarrow.table({
+            'Station': ['S1', 'S2', None],
+            'Latitude': [47.3, 47.4, 47.5],
+            'Unused': [1, 2, 3],
+            'Time': pyarrow.array([datetime.datetime(2010, 5, 18, 4, 0, 0, 500000),
+                                   None,
+                                   datetime.datetime(2010, 5, 18, 5, 0)],
+                                  pyarrow.timestamp('ms')),
+            'Day': [datetime.date(2010, 5, 18), None, None]
+            })
+        inputValueNames = ['Time', 'Latitude', 'Station', 'Day']
+        result = {'Time': ['2010-05-18T04:00:00', None, '2010-05-18T05:00:00'],
+                  'Latitude': [47.3, 47.4, 47.5],
+                  'Station': ['S1', 'S2', None],
+                  'Day': ['2010-05-18T00:00:00', None, None]}
+
+        def parquetFile():
+            fd = io.BytesIO()
+            pyarrow.parquet.write_table(table, fd, row_group_size=2)
+            fd.seek(0)
+            return fd
+
+        def featherFile():
+            fd = io.BytesIO()
+            pyarrow.feather.write_feather(table, fd)
+            fd.seek(0)
+            return fd
+
+        def arrowStream():
+            fd = io.BytesIO()
+            with pyarrow.ipc.new_stream(fd, table.schema) as writer:
+                writer.write_table(table, max_chunksize=2)
+            fd.seek(0)
+            return fd
+
+        print("> Testing ParquetReader...")
+        for fileFormat, openFile in (('parquet', parquetFile),
+                                     ('feather', featherFile),
+                                     ('arrow', arrowStream)):
+            print(fileFormat + " columns")
+            source = ParquetReader(openFile(), inputValueNames, fileFormat)
+            self.assertEqual(source.schema, tuple(inputValueNames))
+            columns = list(source.columns(2))
+            self.assertEqual([len(block['Time']) for block in columns], [2, 1])
+            self.assertEqual({inputName: sum((block[inputName] for block in columns), [])
+                              for inputName in inputValueNames},
+                             result)
+            source.close()
+
+            print(fileFormat + " rows")
+            source = ParquetReader(openFile(), inputValueNames, fileFormat)
+            self.assertEqual(list(source.data()),
+                             [dict(zip(result, values)) for values in zip(*result.values())])
+
+            print(fileFormat + " tuples")
+            source = ParquetReader(openFile(), ['Station'], fileFormat)
+            # Blocks are at most one row group
+            self.assertEqual(sum(source.batches(5, tuples=True), []),
+                             [('S1',), ('S2',), (None,)])
+
+            print(fileFormat + " column name in config file but not in file")
+            with self.assertRaises(ColumnNameNotFoundInParquetFile):
+                ParquetReader(openFile(), ['Time', 'Wind'], fileFormat)
+
+        print("Timestamp format")
+        source = ParquetReader(parquetFile(), ['Time'], 'parquet', '%d/%m/%Y %H:%M')
+        self.assertEqual(next(source.columns(1)), {'Time': ['18/05/2010 04:00']})
@@ -22,9 +22,14 @@ Test schemes with unittest
 import unittest
 import unittest.mock as mock
 import io
+import os
+import tempfile
+import tarfile
+import zipfile
 import logging as log
 
 from schemes.local import *
+from schemes.compression import *
 
 
 class TestSchemes(unittest.TestCase):
@@ -74,3 +79,279 @@ class TestSchemes(unittest.TestCase):
 
                 destination.write(testcase['data'])
                 self.assertTrue(mock.call(testcase['data']) in m.mock_calls)
+
+
+        def test_splitFile(self):
+
+            Testsuite = [
+                {
+                'description': "Empty file",
+                'data': b'',
+                'rangeSize': 4,
+                'skipHeader': True,
+                'result': []
+                },
+                {
+                'description': "Header only",
+                'data': b'Latitude\n',
+                'rangeSize': 4,
+                'skipHeader': True,
+                'result': []
+                },
+                {
+                'description': "Ranges are aligned on newlines",
+                'data': b'Latitude\n12.15\n3.89\n47.3\n',
+                'rangeSize': 4,
+                'skipHeader': True,
+                'result': [b'12.15\n', b'3.89\n', b'47.3\n']
+                },
+                {
+                'description': "No header, no newline at end of file",
+                'data': b'12.15\n3.89\n47.3',
+                'rangeSize': 8,
+                'skipHeader': False,
+                'result': [b'12.15\n3.89\n', b'47.3']
+                },
+                {
+                'description': "Newlines enclosed in quotes (quotechar set)",
+                'data': b'Name,Value\n"a\nb",1\n"c ""\n"" d",2\ne,3\n',
+                'rangeSize': 1,
+                'skipHeader': True,
+                'quotechar': '"',
+                'result': [b'"a\nb",1\n', b'"c ""\n"" d",2\n', b'e,3\n']
+                }
+                ]
+
+            print("> Testing splitFile...")
+            for testcase in Testsuite:
+                print(testcase['description'])
+
+                with tempfile.NamedTemporaryFile(delete=False) as f:
+                    f.write(testcase['data'])
+                try:
+                    ranges = splitFile(f.name, testcase['rangeSize'],
+                                       testcase['skipHeader'],
+                                       testcase.get('quotechar'))
+                    self.assertEqual([testcase['data'][start:end] for start, end in ranges],
+                                     testcase['result'])
+
+                    # Read ranges as text
+                    for (start, end), result in zip(ranges, testcase['result']):
+                        source = LocalFile(f.name, 'read', (start, end)).fd
+                        self.assertEqual(source.read(), result.decode())
+                        source.close()
+                finally:
+                    os.remove(f.name)
+
+
+        def test_compression(self):
+
+            # Several chunks, line endings must be left untranslated
+            data = ''.join('%d,é,value\r\n' % i for i in range(300000))
+
+            Testsuite = [
+                {'compression': 'gzip', 'extension': '.gz'},
+                {'compression': 'bz2', 'extension': '.bz2'},
+                {'compression': 'xz', 'extension': '.xz'},
+                {'compression': 'zstd', 'extension': '.zst'},
+                {'compression': None, 'extension': '.csv'}
+                ]
+
+            print("> Testing compressed local files...")
+            with tempfile.TemporaryDirectory() as directory:
+                for testcase in Testsuite:
+                    print(testcase['compression'])
+                    path = os.path.join(directory, 'data' + testcase['extension'])
+
+                    try:
+                        output = LocalFile(path, 'write')
+                    except CompressionModuleNotInstalled:
+                        print("skipped (module not installed)")
+                        continue
+                    self.assertEqual(output.compression, testcase['compression'])
+                    output.fd.write(data)
+                    output.fd.close()
+
+                    # Compression detected from magic bytes
+                    renamed = os.path.join(directory, 'data')
+                    os.rename(path, renamed)
+                    source = LocalFile(renamed, 'read')
+                    self.assertEqual(source.compression, testcase['compression'])
+                    self.assertEqual(source.fd.read(), data)
+                    source.fd.close()
+
+                    # Reader closed before end of file
+                    source = LocalFile(renamed, 'read')
+                    self.assertEqual(source.fd.readline(), '0,é,value\r\n')
+                    source.fd.close()
+
+                    if testcase['compression'] is not None:
+                        with self.assertRaises(Exception):
+                            LocalFile(renamed, 'read', (0, 10))
+                    os.remove(renamed)
+
+                print("Corrupted compressed file")
+                path = os.path.join(directory, 'corrupted.gz')
+                with open(path, 'wb') as f:
+                    f.write(b'\x1f\x8b' + b'\x00' * 100)
+                source = LocalFile(path, 'read').fd
+                with self.assertRaises(Exception):
+                    source.read()
+                source.close()
+
+                print("Text starting like bz2 magic bytes")
+                for name in ('brands', 'brands.csv'):
+                    path = os.path.join(directory, name)
+                    with open(path, 'w') as f:
+                        f.write('BZh,Bzip,1\n')
+                    source = LocalFile(path, 'read')
+                    self.assertIsNone(source.compression)
+                    self.assertEqual(source.fd.read(), 'BZh,Bzip,1\n')
+                    source.fd.close()
+
+                print("Empty compressed file detected from magic bytes")
+                for compression in ('gzip', 'bz2'):
+                    path = os.path.join(directory, 'empty')
+                    LocalFile(path, 'write', compression=compression).fd.close()
+                    self.assertEqual(detectCompression(path, 'read'), compression)
+
+
+        def test_expandPath(self):
+
+            print("> Testing expandPath...")
+            with tempfile.TemporaryDirectory() as directory:
+                files = {'a.csv': 'h\n1\n', 'b.csv': 'h\n2\n', 'c.json': '{}\n'}
+                os.mkdir(os.path.join(directory, 'sub'))
+                for name, data in files.items():
+                    with open(os.path.join(directory, name), 'w') as f:
+                        f.write(data)
+                with open(os.path.join(directory, 'sub', 'd.csv'), 'w') as f:
+                    f.write('h\n3\n')
+
+                def read(inputFiles):
+                    return [(os.path.relpath(name, directory), fd.read())
+                            for inputFile in inputFiles
+                            for name, fd in inputFile.files()]
+
+                print("File")
+                self.assertEqual(read(expandPath(os.path.join(directory, 'a.csv'))),
+                                 [('a.csv', 'h\n1\n')])
+
+                print("Directory (subdirectories ignored)")
+                self.assertEqual(read(expandPath(directory)),
+                                 [('a.csv', 'h\n1\n'), ('b.csv', 'h\n2\n'), ('c.json', '{}\n')])
+
+                print("Glob patterns")
+                self.assertEqual(read(expandPath(os.path.join(directory, '*.csv'))),
+                                 [('a.csv', 'h\n1\n'), ('b.csv', 'h\n2\n')])
+                self.assertEqual(read(expandPath(os.path.join(directory, '**', '*.csv'))),
+                                 [('a.csv', 'h\n1\n'), ('b.csv', 'h\n2\n'),
+                                  (os.path.join('sub', 'd.csv'), 'h\n3\n')])
+
+                print("Zip archive")
+                path = os.path.join(directory, 'archive.zip')
+                with zipfile.ZipFile(path, 'w') as archive:
+                    archive.writestr('x.csv', 'h\r\n4\r\n')
+                    archive.writestr('y/z.csv', 'h\n5\n')
+                self.assertEqual([inputFile.name for inputFile in expandPath(path)],
+                                 [path + ':x.csv', path + ':y/z.csv'])
+                self.assertEqual(read(expandPath(path)),
+                                 [('archive.zip:x.csv', 'h\r\n4\r\n'),
+                                  ('archive.zip:y/z.csv', 'h\n5\n')])
+                os.remove(path)
+
+                print("Compressed tar archive (streamed)")
+                path = os.path.join(directory, 'archive.tar.gz')
+                with tarfile.open(path, 'w:gz') as archive:
+                    for name in ('a.csv', 'b.csv'):
+                        archive.add(os.path.join(directory, name), name)
+                inputFiles = expandPath(path)
+                self.assertEqual(len(inputFiles), 1)
+                self.assertEqual(read(inputFiles),
+                                 [('archive.tar.gz:a.csv', 'h\n1\n'),
+                                  ('archive.tar.gz:b.csv', 'h\n2\n')])
+
+                print("No file matches path")
+                with self.assertRaises(NoInputFile):
+                    expandPath(os.path.join(directory, '*.xml'))
+
+
+        def test_offset(self):
+
+            print("> Testing offset of lines read and append mode...")
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'input.csv')
+                with open(path, 'wb') as f:
+                    f.write('h\r\n1,é\n"2\n"\n3'.encode())
+
+                print("Offset following each line")
+                fd = LocalFile(path, 'read', offset=0).fd
+                offsets = [(line, fd.offset) for line in fd]
+                fd.close()
+                self.assertEqual(offsets, [('h\r\n', 3), ('1,é\n', 8), ('"2\n', 11),
+                                           ('"\n', 13), ('3', 14)])
+
+                print("Read from offset")
+                fd = LocalFile(path, 'read', offset=8).fd
+                self.assertEqual(list(fd), ['"2\n', '"\n', '3'])
+                self.assertEqual(fd.offset, 14)
+                fd.close()
+
+                print("Append")
+                fd = LocalFile(path, 'append').fd
+                fd.write('\n4\n')
+                fd.close()
+                with open(path, 'rt', newline='') as f:
+                    self.assertEqual(f.read(), 'h\r\n1,é\n"2\n"\n3\n4\n')
+
+                print("Compressed files")
+                gzPath = os.path.join(directory, 'input.csv.gz')
+                LocalFile(gzPath, 'write').fd.close()
+                with self.assertRaises(Exception):
+                    LocalFile(gzPath, 'read', offset=0)
+                with self.assertRaises(Exception):
+                    LocalFile(gzPath, 'append')
+
+
+        def test_FollowedLines(self):
+
+            print("> Testing FollowedLines...")
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'input.csv')
+                with open(path, 'wb') as f:
+                    f.write(b'h\n1\n2')
+
+                # File is changed each time reader waits for new data
+                def append():
+                    with open(path, 'ab') as f:
+                        f.write(b'\n3\n')
+
+                def rotate():
+                    os.rename(path, path + '.1')
+                    with open(path, 'wb') as f:
+                        f.write(b'h\n4\n44\n')
+
+                def truncate():
+                    with open(path, 'wb') as f:
+                        f.write(b'h\n5\n')
+
+                changes = [append, rotate, truncate]
+
+                def flush():
+                    if changes:
+                        changes.pop(0)()
+
+                fd = FollowedLines(path, skipHeader=True, pollInterval=0.01,
+                                   flush=flush, idleTimeout=0.1)
+                print("Complete lines, rotated and truncated files (header skipped)")
+                self.assertEqual(list(fd), ['h\n', '1\n', '2\n', '3\n', '4\n', '44\n', '5\n'])
+                self.assertEqual(fd.offset, 4)
+                self.assertEqual(changes, [])
+                fd.close()
+
+                print("Read from offset, stop")
+                fd = FollowedLines(path, start=2, pollInterval=0.01)
+                self.assertEqual(next(fd), '5\n')
+                fd.stop()
+                self.assertEqual(list(fd), [])
+                fd.close()
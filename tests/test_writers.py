@@ -23,7 +23,177 @@ import unittest
 import io
 import logging as log
 import json
+import time
+import threading
+import http.server
 from writers.JSONWriter import *
+from writers.bulkcontrol import *
+from writers.PartitionedWriter import *
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+if pyarrow is not None:
+    import pyarrow.parquet
+    from writers.ParquetWriter import *
+
+try:
+    import elasticsearch
+except ImportError:
+    elasticsearch = None
+if elasticsearch is not None:
+    from writers.ESWriter import *
+
+
+class ESStub():
+    """
+    Local HTTP server emulating elasticsearch (ping, info, _bulk API and
+    indices: create, settings, refresh).
+    Status of each bulk item is given by status(document, attempt), attempt
+    is the number of times document was received before.
+    Documents of each bulk request are stored in requests.
+    Bulk requests are answered after delay seconds, maximum number of
+    requests processed at once is stored in maxInFlight.
+    Failures of whole requests are injected by failures: statuses returned
+    to next bulk requests (documents are not stored).
+    Indices are stored in indices {name: {'mappings', 'settings', 'params',
+    'refreshes'}}, updates of settings in settingsUpdates [(name, settings)].
+    Documents with an _id are stored in ids {_id: document} (409 Conflict if
+    they are created twice). Documents received by each index (_index of
+    action line or index of URL) are counted in documentCounts.
+    """
+
+    def __init__(self, status=None, delay=0, failures=(), version='6.8.0'):
+        self.requests = []
+        self.indices = {}
+        self.settingsUpdates = []
+        self.ids = {}
+        self.documentCounts = {}
+        self.failures = list(failures)
+        self.status = status or (lambda document, attempt: 201)
+        self.maxInFlight = 0
+        attempts = {}
+        inFlight = []
+        lock = threading.Lock()
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, body, status=200):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('X-Elastic-Product', 'Elasticsearch')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(data)
+
+            def route(self):
+                # (index, endpoint) of path, query string
+                path, _, query = self.path.partition('?')
+                parts = path.strip('/').split('/')
+                return parts[0], parts[-1] if len(parts) > 1 else None, query
+
+            def body(self):
+                return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+            def do_HEAD(self):
+                index, endpoint, query = self.route()
+                self.reply({}, 200 if not index or index in stub.indices else 404)
+
+            def do_GET(self):
+                index, endpoint, query = self.route()
+                if endpoint == '_settings':
+                    self.reply({name: {'settings': {'index': dict(stub.indices[name]['settings'],
+                                                                  provided_name=name)}}
+                                for name in stub.indices if name == index})
+                    return
+                self.reply({'version': {'number': version}, 'tagline': 'You Know, for Search'})
+
+            def do_PUT(self):
+                index, endpoint, query = self.route()
+                body = json.loads(self.body())
+                with lock:
+                    if endpoint == '_settings':
+                        settings = stub.indices[index]['settings']
+                        for name, value in body['index'].items():
+                            if value is None:
+                                settings.pop(name, None)  # default value
+                            else:
+                                settings[name] = str(value)
+                        stub.settingsUpdates.append((index, body['index']))
+                    else:
+                        stub.indices[index] = {'mappings': body['mappings'],
+                                               'settings': {'number_of_replicas': '1'},
+                                               'params': query,
+                                               'refreshes': 0}
+                self.reply({'acknowledged': True})
+
+            def do_POST(self):
+                index, endpoint, query = self.route()
+                if endpoint == '_refresh':
+                    with lock:
+                        stub.indices[index]['refreshes'] += 1
+                    self.body()
+                    self.reply({'_shards': {}})
+                    return
+
+                lines = self.body().splitlines()
+                documents = [json.loads(line) for line in lines[1::2]]
+                with lock:
+                    failure = stub.failures.pop(0) if stub.failures else None
+                if failure is not None:
+                    self.reply({'error': {'type': 'error_' + str(failure)}, 'status': failure},
+                               failure)
+                    return
+                with lock:
+                    stub.requests.append(documents)
+                    inFlight.append(self)
+                    stub.maxInFlight = max(stub.maxInFlight, len(inFlight))
+                time.sleep(delay)
+                with lock:
+                    inFlight.remove(self)
+
+                items = []
+                for action, line, document in zip(lines[0::2], lines[1::2], documents):
+                    (opType, metadata), = json.loads(action).items()
+                    name = metadata.get('_index', index)
+                    with lock:
+                        stub.documentCounts[name] = stub.documentCounts.get(name, 0) + 1
+                    attempt = attempts.get(line, 0)
+                    attempts[line] = attempt + 1
+                    status = stub.status(document, attempt)
+                    if status < 300 and '_id' in metadata:
+                        with lock:
+                            if metadata['_id'] not in stub.ids:
+                                stub.ids[metadata['_id']] = document
+                            elif opType == 'create':
+                                status = 409
+                            else:
+                                stub.ids[metadata['_id']] = document
+                                status = 200
+                    item = {'status': status}
+                    if status >= 300:
+                        item['error'] = {'type': 'error_' + str(status)}
+                    items.append({opType: item})
+                self.reply({'took': 1,
+                            'errors': any(item['status'] >= 300
+                                          for result in items for item in result.values()),
+                            'items': items})
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
 
 
 class TestWriters(unittest.TestCase):
@@ -66,6 +236,7 @@ class TestWriters(unittest.TestCase):
                 fd = io.StringIO()
                 destination = JSONWriter(fd)
                 destination.write(testcase['data'])
+                destination.flush()  # Data is buffered
 
                 """json.dump method use multiple calls to open.write(),
                 it's difficult to assert an exact match.
@@ -83,3 +254,619 @@ class TestWriters(unittest.TestCase):
                 except:
                     self.fail('json module failed to load written data')
                 self.assertEqual(loadedData, testcase['data'])
+
+
+        def test_JSONWriter_layouts(self):
+
+            rows = [{'a': 1, 'b': 'é'}, {}, {'c': [1.5, None], 'd': {'e': True}}]
+
+            print("> Testing JSONWriter layouts and buffering...")
+            for layout in ('pretty', 'ndjson'):
+                print("Layout " + layout)
+                fd = io.StringIO()
+                destination = JSONWriter(fd, layout=layout, bufferSize=40)
+                destination.write(rows[0])
+                self.assertEqual(fd.getvalue(), '')  # buffered
+                destination.writeBatch(rows[1:])
+                destination.writeBatch([])
+                written = fd.getvalue()
+                self.assertTrue(written)  # buffer full
+                destination.flush()
+
+                if layout == 'pretty':
+                    self.assertEqual(fd.getvalue(),
+                                     ''.join(json.dumps(data, indent=4) + '\n' for data in rows))
+                else:
+                    self.assertEqual(fd.getvalue().splitlines(),
+                                     [json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+                                      for data in rows])
+
+            print("Unknown layout")
+            with self.assertRaises(UnknownJSONOutputLayout):
+                JSONWriter(io.StringIO(), layout='array')
+
+
+        def test_bulkcontrol(self):
+
+            print("> Testing BulkSizeController...")
+            controller = BulkSizeController(1000, 100, 1200, targetLatency=1.0)
+            controller.update(0.5)
+            self.assertEqual(controller.size, 1100)  # additive increase
+            controller.update(0.5)
+            controller.update(0.5)
+            self.assertEqual(controller.size, 1200)  # maximum
+            controller.update(2.0)
+            self.assertEqual(controller.size, 960)  # slow
+            controller.update(0.5, rejected=True)
+            self.assertEqual(controller.size, 480)  # multiplicative decrease
+            for i in range(3):
+                controller.reject()
+            self.assertEqual(controller.size, 100)  # minimum
+
+            print("Fixed size")
+            controller = BulkSizeController(1000)
+            controller.reject()
+            controller.update(0.1)
+            self.assertEqual(controller.size, 1000)
+
+            print("> Testing TokenBucket...")
+            bucket = TokenBucket(100)
+            start = time.perf_counter()
+            bucket.consume(50)
+            bucket.consume(50)
+            self.assertLess(time.perf_counter() - start, 0.1)  # burst
+            bucket.consume(50)
+            bucket.consume(10)
+            self.assertGreater(time.perf_counter() - start, 0.55)
+            self.assertGreater(bucket.waitTime, 0.55)
+
+
+        def test_PartitionedWriter(self):
+
+            print("> Testing PartitionedWriter...")
+            self.assertEqual(compilePattern('ode-{yyyy.MM.dd}'), 'ode-%Y.%m.%d')
+            self.assertEqual(compilePattern('out/{yyyy}/{MM}/{dd}-{HH}h%.json'),
+                             'out/%Y/%m/%d-%Hh%%.json')
+            for pattern in ('ode', 'ode-{yyyy.mm}', 'ode-{yyyy'):
+                with self.assertRaises(UnknownPartitionPattern):
+                    compilePattern(pattern)
+
+            files = {}
+            opened = []
+
+            def openWriter(name, mode):
+                opened.append((name, mode))
+                if mode == 'write':
+                    files[name] = io.StringIO()
+                fd = files[name]
+                writer = JSONWriter(fd, layout='ndjson')
+                writer.close = writer.flush  # keep content of StringIO
+                return writer
+
+            print("Epochs partitioned by UTC day, least recently used partition closed")
+            day = 24 * 3600 * 1000
+            epoch = 1700000000000  # 2023-11-14T22:13:20Z
+            rows = [{'t': epoch + i * 3600 * 1000, 'i': i} for i in range(0, 48, 6)]
+            partitioner = Partitioner('d/{yyyy}/{MM}/{dd}.json', 't', {'convertToEpoch': True})
+            destination = PartitionedWriter(partitioner, openWriter, maxOpen=2)
+            destination.writeBatch(rows[:4])
+            destination.write({'t': epoch - day, 'i': -1})
+            destination.write({'t': epoch + 1, 'i': 1})
+            destination.writeBatch(rows[4:])
+            destination.close()
+            self.assertEqual(opened, [('d/2023/11/14.json', 'write'),
+                                      ('d/2023/11/15.json', 'write'),
+                                      ('d/2023/11/13.json', 'write'),
+                                      ('d/2023/11/14.json', 'append'),
+                                      ('d/2023/11/15.json', 'append'),
+                                      ('d/2023/11/16.json', 'write')])
+            self.assertEqual(destination.nbReopened, 2)
+            content = {name: [json.loads(line)['i'] for line in fd.getvalue().splitlines()]
+                       for name, fd in files.items()}
+            self.assertEqual(content, {'d/2023/11/13.json': [-1],
+                                       'd/2023/11/14.json': [0, 1],
+                                       'd/2023/11/15.json': [6, 12, 18, 24],
+                                       'd/2023/11/16.json': [30, 36, 42]})
+
+            print("Partitions that can't be appended (Parquet, compressed) are kept open")
+            files.clear()
+            opened.clear()
+
+            def openFinalWriter(name, mode):
+                if mode == 'append':
+                    raise NotImplementedError("Can't append " + name)
+                return openWriter(name, mode)
+
+            destination = PartitionedWriter(partitioner, openFinalWriter, maxOpen=2,
+                                            appendable=False)
+            destination.writeBatch(rows[:4])
+            destination.write({'t': epoch - day, 'i': -1})
+            destination.write({'t': epoch + 1, 'i': 1})
+            destination.writeBatch(rows[4:])
+            destination.close()
+            self.assertEqual(opened, [('d/2023/11/14.json', 'write'),
+                                      ('d/2023/11/15.json', 'write'),
+                                      ('d/2023/11/13.json', 'write'),
+                                      ('d/2023/11/16.json', 'write')])
+            self.assertEqual(destination.nbReopened, 0)
+            content = {name: [json.loads(line)['i'] for line in fd.getvalue().splitlines()]
+                       for name, fd in files.items()}
+            self.assertEqual(content, {'d/2023/11/13.json': [-1],
+                                       'd/2023/11/14.json': [0, 1],
+                                       'd/2023/11/15.json': [6, 12, 18, 24],
+                                       'd/2023/11/16.json': [30, 36, 42]})
+
+            print("Dates partitioned by wall time")
+            files.clear()
+            opened.clear()
+            partitioner = Partitioner('ode-{yyyy.MM}', 'date', {'dateFormat': '%d/%m/%Y %H:%M'})
+            destination = PartitionedWriter(partitioner, openWriter)
+            destination.writeBatch([{'date': '31/12/2023 23:59'}, {'date': '01/01/2024 00:00'},
+                                    {'date': '5/12/2023 10:00'}])  # strptime
+            destination.close()
+            self.assertEqual(opened, [('ode-2023.12', 'write'), ('ode-2024.01', 'write')])
+            self.assertEqual(len(files['ode-2023.12'].getvalue().splitlines()), 2)
+
+            print("Partition field with year and month only")
+            files.clear()
+            opened.clear()
+            partitioner = Partitioner('ode-{yyyy.MM}', 'month', {'dateFormat': '%Y-%m'})
+            destination = PartitionedWriter(partitioner, openWriter)
+            destination.writeBatch([{'month': '2023-12'}, {'month': '2024-01'}])
+            destination.close()
+            self.assertEqual(opened, [('ode-2023.12', 'write'), ('ode-2024.01', 'write')])
+
+            print("Documents without timestamp")
+            destination = PartitionedWriter(Partitioner('ode-{yyyy}', 'date', {'dateFormat': '%Y'}),
+                                            openWriter)
+            destination.write({'date': None})  # buffered
+            with self.assertRaises(MissingPartitionValue):
+                destination.flush()
+
+
+        @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+        def test_ParquetWriter(self):
+            import datetime
+
+            configConverters = {
+                'Time': {'outputName': 'timestamp', 'outputType': 'timestamp',
+                         'dateFormat': '%Y-%m-%dT%H:%M:%S', 'convertToEpoch': True},
+                'Wind': {'outputName': 'wind', 'outputType': 'float'},
+                'Count': {'outputName': 'count', 'outputType': 'int'},
+                'Station': {'outputName': 'station', 'outputType': 'str'},
+                'Tags': {'outputName': 'tags', 'outputType': 'list', 'listType': 'int'},
+                'Latitude': {'outputName': 'Latitude', 'outputType': 'latitude'},
+                'Longitude': {'outputName': 'Longitude', 'outputType': 'longitude'}
+                }
+            rows = [
+                {'timestamp': 1274148000000, 'wind': 4.5, 'count': 1, 'station': 'S1',
+                 'tags': [1, 2], 'location': {'lat': '47.3', 'lon': '-3.89'}},
+                {'timestamp': None, 'wind': None, 'count': 2, 'station': None,
+                 'tags': [], 'location': {'lat': '0', 'lon': '0'}},
+                {'timestamp': 0, 'wind': 0.0, 'count': 3, 'station': 'S3',
+                 'tags': [3], 'location': {'lat': '-1.5', 'lon': '2'}}
+                ]
+
+            print("> Testing ParquetWriter...")
+            fd = io.BytesIO()
+            fd.close = lambda: None  # Keep buffer readable
+            destination = ParquetWriter(fd, configConverters, rowGroupSize=2)
+            for data in rows:
+                destination.write(data)
+            destination.close()
+
+            parquetFile = pyarrow.parquet.ParquetFile(io.BytesIO(fd.getvalue()))
+            print("Row groups")
+            self.assertEqual(parquetFile.num_row_groups, 2)
+
+            print("Schema derived from output types")
+            schema = parquetFile.schema_arrow
+            self.assertEqual(schema.names, ['timestamp', 'wind', 'count', 'station', 'tags', 'location'])
+            self.assertEqual(schema.field('timestamp').type, pyarrow.timestamp('ms', tz='UTC'))
+            self.assertEqual(schema.field('wind').type, pyarrow.float64())
+            self.assertEqual(schema.field('count').type, pyarrow.int64())
+            self.assertEqual(schema.field('station').type, pyarrow.string())
+            self.assertEqual(schema.field('tags').type, pyarrow.list_(pyarrow.int64()))
+            self.assertEqual(schema.field('location').type,
+                             pyarrow.struct([('lat', pyarrow.float64()), ('lon', pyarrow.float64())]))
+
+            print("Values")
+            table = parquetFile.read()
+            self.assertEqual(table.column('timestamp').cast(pyarrow.int64()).to_pylist(),
+                             [1274148000000, None, 0])
+            self.assertEqual(table.column('location').to_pylist(),
+                             [{'lat': 47.3, 'lon': -3.89}, {'lat': 0.0, 'lon': 0.0},
+                              {'lat': -1.5, 'lon': 2.0}])
+            self.assertEqual(table.drop(['timestamp', 'location']).to_pylist(),
+                             [{key: value for key, value in data.items()
+                               if key not in ('timestamp', 'location')} for data in rows])
+
+            print("Dates not converted to epoch")
+            configConverters = {'Time': {'outputName': 'timestamp', 'outputType': 'timestamp',
+                                         'dateFormat': '%d/%m/%Y %H:%M'}}
+            fd = io.BytesIO()
+            fd.close = lambda: None
+            destination = ParquetWriter(fd, configConverters)
+            destination.write({'timestamp': '18/05/2010 04:00'})
+            destination.close()
+            table = pyarrow.parquet.read_table(io.BytesIO(fd.getvalue()))
+            self.assertEqual(table.schema.field('timestamp').type, pyarrow.timestamp('ms'))
+            self.assertEqual(table.column('timestamp').to_pylist(),
+                             [datetime.datetime(2010, 5, 18, 4, 0)])
+
+            print("Value not matching output type")
+            destination = ParquetWriter(io.BytesIO(), {'Count': {'outputName': 'count',
+                                                                 'outputType': 'int'}})
+            destination.write({'count': 'a'})
+            with self.assertRaises(ParquetWriteFailed):
+                destination.close()
+
+            print("Empty input (readers return one empty row)")
+            configConverters = {'Count': {'outputName': 'count', 'outputType': 'int'},
+                                'Tags': {'outputName': 'tags', 'outputType': 'list'}}
+            fd = io.BytesIO()
+            fd.close = lambda: None
+            destination = ParquetWriter(fd, configConverters)
+            destination.write({})
+            destination.writeBatch([{}])
+            destination.close()
+            table = pyarrow.parquet.read_table(io.BytesIO(fd.getvalue()))
+            self.assertEqual(table.num_rows, 0)
+            self.assertEqual(table.schema.names, ['count', 'tags'])
+
+            print("List type set in config (first row group without values)")
+            fd = io.BytesIO()
+            fd.close = lambda: None
+            destination = ParquetWriter(fd, configConverters, rowGroupSize=2)
+            destination.writeBatch([{'count': 1, 'tags': None}, {'count': 2, 'tags': []},
+                                    {'count': 3, 'tags': ['a', 'b']}])
+            destination.close()
+            table = pyarrow.parquet.read_table(io.BytesIO(fd.getvalue()))
+            self.assertEqual(table.schema.field('tags').type, pyarrow.list_(pyarrow.string()))
+            self.assertEqual(table.column('tags').to_pylist(), [None, [], ['a', 'b']])
+
+
+        @unittest.skipIf(elasticsearch is None, "elasticsearch is not installed")
+        def test_ESWriter(self):
+
+            rows = [{'id': i, 'station': 'S' + str(i)} for i in range(7)]
+
+            print("> Testing ESWriter...")
+            stub = ESStub()
+            try:
+                print("Bulk requests of bulkSize documents, flushed on close")
+                destination = ESWriter('127.0.0.1', stub.port, 'index', bulkSize=3)
+                destination.writeBatch(rows[:4])
+                self.assertEqual(stub.requests, [rows[:3]])
+                for data in rows[4:]:
+                    destination.write(data)
+                destination.close()
+                self.assertEqual(stub.requests, [rows[:3], rows[3:6], rows[6:]])
+                self.assertEqual((destination.nbIndexed, destination.nbRequests), (7, 3))
+
+                print("Bulk requests of at most bulkBytes bytes")
+                stub.requests.clear()
+                size = len(b'{"index":{}}\n{"id":0,"station":"S0"}\n')
+                destination = ESWriter('127.0.0.1', stub.port, 'index', bulkBytes=2 * size)
+                destination.writeBatch(rows)
+                destination.flush()
+                self.assertEqual(stub.requests, [rows[0:2], rows[2:4], rows[4:6], rows[6:]])
+                destination.close()
+                self.assertEqual(len(stub.requests), 4)
+            finally:
+                stub.close()
+
+            print("Only rejected documents are sent again")
+            stub = ESStub(lambda document, attempt: 429 if document['id'] % 3 > attempt else 201)
+            try:
+                destination = ESWriter('127.0.0.1', stub.port, 'index', retryDelay=0)
+                destination.writeBatch(rows)
+                destination.close()
+                self.assertEqual(stub.requests, [rows,
+                                                 [rows[1], rows[2], rows[4], rows[5]],
+                                                 [rows[2], rows[5]]])
+                self.assertEqual((destination.nbIndexed, destination.nbRetried), (7, 6))
+
+                print("Documents still rejected after maxRetries")
+                destination = ESWriter('127.0.0.1', stub.port, 'index', maxRetries=1, retryDelay=0)
+                destination.writeBatch([{'id': 5, 'station': 'S'}])
+                with self.assertRaises(ESimportFailed):
+                    destination.flush()
+            finally:
+                stub.close()
+
+            print("Invalid documents are not sent again")
+            stub = ESStub(lambda document, attempt: 400 if document['id'] == 1 else 201)
+            try:
+                destination = ESWriter('127.0.0.1', stub.port, 'index', retryDelay=0)
+                destination.writeBatch(rows)
+                with self.assertRaises(ESimportFailed):
+                    destination.close()
+                self.assertEqual(len(stub.requests), 1)
+            finally:
+                stub.close()
+
+            print("Concurrent bulk requests")
+            stub = ESStub(delay=0.2)
+            try:
+                destination = ESWriter('127.0.0.1', stub.port, 'index', bulkSize=1, concurrency=4)
+                start = time.perf_counter()
+                destination.writeBatch(rows[:4])
+                self.assertLess(time.perf_counter() - start, 0.2)
+                destination.write(rows[4])  # blocked until a request completes
+                self.assertGreater(time.perf_counter() - start, 0.1)
+                destination.writeBatch(rows[5:])
+                destination.close()
+                elapsed = time.perf_counter() - start
+                self.assertEqual(sorted(data['id'] for documents in stub.requests
+                                        for data in documents), list(range(7)))
+                self.assertEqual(stub.maxInFlight, 4)
+                self.assertLess(elapsed, 7 * 0.2)
+                self.assertEqual((destination.nbIndexed, destination.nbRequests), (7, 7))
+                self.assertGreaterEqual(destination.maxLatency, 0.2)
+
+                print("Errors of requests in flight are raised")
+                stub.status = lambda document, attempt: 400
+                destination = ESWriter('127.0.0.1', stub.port, 'index', bulkSize=1, concurrency=2)
+                destination.writeBatch(rows[:2])
+                with self.assertRaises(ESimportFailed):
+                    destination.close()
+            finally:
+                stub.close()
+
+            print("Failed requests are sent again")
+            stub = ESStub(failures=[429, 503, 429])
+            try:
+                destination = ESWriter('127.0.0.1', stub.port, 'index', retryDelay=0)
+                destination.writeBatch(rows)
+                destination.close()
+                self.assertEqual(stub.requests, [rows])
+                self.assertEqual((destination.nbIndexed, destination.nbRequestRetries,
+                                  destination.nbRejectedRequests), (7, 3, 2))
+
+                print("Requests still failing after maxRetries")
+                stub.failures = [503, 503]
+                destination = ESWriter('127.0.0.1', stub.port, 'index', maxRetries=1, retryDelay=0)
+                destination.writeBatch(rows)
+                with self.assertRaises(ESimportFailed):
+                    destination.flush()
+
+                print("Invalid requests are not sent again")
+                stub.requests.clear()
+                stub.failures = [400, 400]
+                destination = ESWriter('127.0.0.1', stub.port, 'index', retryDelay=0)
+                destination.writeBatch(rows)
+                with self.assertRaises(ESimportFailed):
+                    destination.flush()
+                self.assertEqual(stub.failures, [400])
+                stub.failures.clear()
+
+                print("Requests are sent to nodes still alive")
+                unused = http.server.HTTPServer(('127.0.0.1', 0), http.server.BaseHTTPRequestHandler)
+                deadPort = unused.server_address[1]
+                unused.server_close()
+                stub.requests.clear()
+                nodes = [{'host': '127.0.0.1', 'port': deadPort},
+                         {'host': '127.0.0.1', 'port': stub.port}]
+                destination = ESWriter(None, None, 'index', bulkSize=1, nodes=nodes, retryDelay=0)
+                destination.writeBatch(rows)
+                destination.close()
+                self.assertEqual(sorted(data['id'] for documents in stub.requests
+                                        for data in documents), list(range(7)))
+
+                print("No node alive")
+                with self.assertRaises(ESnotReachable):
+                    ESWriter(None, None, 'index', nodes=nodes[:1], retryDelay=0)
+            finally:
+                stub.close()
+
+            print("Adaptive bulk size")
+            rows = [{'id': i, 'station': 'S' + str(i)} for i in range(200)]
+            stub = ESStub()
+            try:
+                destination = ESWriter('127.0.0.1', stub.port, 'index', bulkSize=10,
+                                       adaptive=True, minBulkSize=5, maxBulkSize=20)
+                destination.writeBatch(rows)
+                destination.close()
+                sizes = [len(documents) for documents in stub.requests]
+                self.assertEqual(sizes[:4], [10, 11, 12, 13])  # fast requests
+                self.assertEqual(sizes[-2:], [20, 15])  # maximum
+
+                print("Adaptive bulk size reduced by rejections")
+                stub.requests.clear()
+                stub.failures = [429]
+                destination = ESWriter('127.0.0.1', stub.port, 'index', bulkSize=20,
+                                       adaptive=True, minBulkSize=5, retryDelay=0)
+                destination.writeBatch(rows[:50])
+                destination.close()
+                self.assertEqual([len(documents) for documents in stub.requests][:3], [20, 12, 14])  # halved, increased
+                self.assertEqual(destination.nbRejectedRequests, 1)
+
+                print("Adaptive bulk size reduced by latency")
+                stub.requests.clear()
+                stub.status = lambda document, attempt: time.sleep(0.02) or 201
+                destination = ESWriter('127.0.0.1', stub.port, 'index', bulkSize=10,
+                                       adaptive=True, minBulkSize=5, targetLatency=0.15)
+                destination.writeBatch(rows[:40])
+                destination.close()
+                self.assertEqual([len(documents) for documents in stub.requests][:3], [10, 8, 6])
+                stub.status = lambda document, attempt: 201
+
+                print("Rate limits")
+                stub.requests.clear()
+                destination = ESWriter('127.0.0.1', stub.port, 'index', bulkSize=10,
+                                       maxDocsPerSecond=100)
+                start = time.perf_counter()
+                destination.writeBatch(rows[:150])
+                destination.close()
+                self.assertGreater(time.perf_counter() - start, 0.45)
+                size = len(b'{"index":{}}\n{"id":100,"station":"S100"}\n')
+                destination = ESWriter('127.0.0.1', stub.port, 'index', bulkSize=10,
+                                       maxBytesPerSecond=10 * size)
+                start = time.perf_counter()
+                destination.writeBatch(rows[100:120])
+                destination.close()
+                self.assertGreater(time.perf_counter() - start, 0.95)
+            finally:
+                stub.close()
+
+            print("Mapping of converted documents")
+            configConverters = {
+                'a': {'outputName': 'name', 'outputType': 'str'},
+                'b': {'outputName': 'count', 'outputType': 'int'},
+                'c': {'outputName': 'tags', 'outputType': 'list'},
+                'd': {'outputName': 'timestamp', 'outputType': 'timestamp',
+                      'dateFormat': '%Y-%m-%dT%H:%M:%S', 'convertToEpoch': True},
+                'e': {'outputName': 'date', 'outputType': 'timestamp',
+                      'dateFormat': '%d/%m/%Y at %Hh'},
+                'f': {'outputName': 'lat', 'outputType': 'latitude'},
+                'g': {'outputName': 'lon', 'outputType': 'longitude'}
+                }
+            mapping = {'properties': {
+                'name': {'type': 'text',
+                         'fields': {'keyword': {'type': 'keyword', 'ignore_above': 256}}},
+                'count': {'type': 'long'},
+                'timestamp': {'type': 'date', 'format': 'epoch_millis'},
+                'date': {'type': 'date', 'format': "dd/MM/yyyy 'at' HH'h'"},
+                'location': {'type': 'geo_point'}
+                }}
+            self.assertEqual(buildMapping(configConverters), mapping)
+            self.assertEqual(javaDateFormat('%Y-%m-%dT%H:%M:%S.%f'),
+                             "yyyy-MM-dd'T'HH:mm:ss.SSSSSS")
+            self.assertEqual(javaDateFormat("%H o'"), "HH 'o'''")
+            self.assertEqual(javaDateFormat('%Y-%m-%d UTC'), "yyyy-MM-dd 'UTC'")
+            self.assertEqual(javaDateFormat("%H o'clock"), "HH 'o''clock'")
+            self.assertIsNone(javaDateFormat('%a %d'))
+
+            print("Index created with mapping, refresh and replicas disabled during ingestion")
+            stub = ESStub()
+            try:
+                destination = ESWriter('127.0.0.1', stub.port, 'index',
+                                       configConverters=configConverters, ingestSettings=True)
+                index = stub.indices['index']
+                self.assertEqual(index['mappings'], {DOC_TYPE: mapping})
+                self.assertEqual(index['params'], '')
+                # Settings are unchanged until documents are sent
+                self.assertEqual(index['settings'], {'number_of_replicas': '1'})
+                destination.writeBatch(rows)
+                destination.flush()
+                self.assertEqual(index['settings'],
+                                 {'refresh_interval': '-1', 'number_of_replicas': '0'})
+                destination.close()
+                self.assertEqual(index['settings'], {'number_of_replicas': '1'})
+                self.assertEqual(index['refreshes'], 1)
+                self.assertEqual(len(stub.settingsUpdates), 2)
+
+                print("Existing index is not created, settings unchanged")
+                index['settings']['refresh_interval'] = '30s'
+                stub.settingsUpdates.clear()
+                destination = ESWriter('127.0.0.1', stub.port, 'index',
+                                       configConverters={}, ingestSettings=False)
+                destination.close()
+                self.assertEqual(index['mappings'], {DOC_TYPE: mapping})
+                self.assertEqual(stub.settingsUpdates, [])
+                self.assertEqual(index['refreshes'], 2)
+
+                print("Original settings restored")
+                destination = ESWriter('127.0.0.1', stub.port, 'index', ingestSettings=True)
+                destination.write(rows[0])
+                destination.flush()
+                self.assertEqual(index['settings']['refresh_interval'], '-1')
+                destination.restoreSettings()
+                self.assertEqual(index['settings'],
+                                 {'refresh_interval': '30s', 'number_of_replicas': '1'})
+                destination.close()
+                self.assertEqual(len(stub.settingsUpdates), 2)  # restored once
+
+                print("Settings set by another ingestion are not restored")
+                index['settings']['refresh_interval'] = '-1'
+                stub.settingsUpdates.clear()
+                destination = ESWriter('127.0.0.1', stub.port, 'index', ingestSettings=True)
+                destination.write(rows[0])
+                destination.close()
+                self.assertEqual(stub.settingsUpdates, [('index', {'number_of_replicas': 0}),
+                                                        ('index', {'number_of_replicas': '1'})])
+                self.assertEqual(index['settings'],
+                                 {'refresh_interval': '-1', 'number_of_replicas': '1'})
+
+                print("Index unchanged if nothing is sent")
+                stub.settingsUpdates.clear()
+                ESWriter('127.0.0.1', stub.port, 'index', ingestSettings=True).close()
+                self.assertEqual(stub.settingsUpdates, [])
+            finally:
+                stub.close()
+
+            print("Typed mapping of ES 7")
+            stub = ESStub(version='7.17.0')
+            try:
+                ESWriter('127.0.0.1', stub.port, 'index', configConverters={}).close()
+                self.assertEqual(stub.indices['index']['params'], 'include_type_name=true')
+            finally:
+                stub.close()
+
+            print("Document ids")
+            data = {'b': [1.5, None], 'a': 'é'}
+            self.assertEqual(hashValues(data), hashValues({'a': 'é', 'b': [1.5, None]}))
+            self.assertNotEqual(hashValues(data), hashValues({'a': 'é', 'b': [1.5]}))
+            self.assertEqual(len(hashValues(data)), 32)
+            with self.assertRaises(UnknownOpType):
+                ESWriter('127.0.0.1', 1, 'index', opType='update')
+            with self.assertRaises(UnknownIdField):
+                ESWriter('127.0.0.1', 1, 'index', idFields=['statoin'],
+                         configConverters={'Station': {'outputName': 'station',
+                                                       'outputType': 'str'}})
+
+            stub = ESStub(lambda document, attempt: 429 if document['id'] == 2 > attempt else 201)
+            try:
+                print("Ids from idFields, documents replaced")
+                rows = [{'id': i, 'station': 'S' + str(i % 2)} for i in range(7)]
+                destination = ESWriter('127.0.0.1', stub.port, 'index', idFields=['station'],
+                                       retryDelay=0)
+                destination.writeBatch(rows)
+                destination.close()
+                self.assertEqual(sorted(stub.ids.values(), key=lambda data: data['station']),
+                                 [rows[2], rows[5]])  # last documents sent (2 sent again)
+                self.assertEqual(set(stub.ids), {hashValues(['S0']), hashValues(['S1'])})
+                self.assertEqual((destination.nbIndexed, destination.nbDuplicates), (7, 0))
+
+                print("Documents without id values refused")
+                destination = ESWriter('127.0.0.1', stub.port, 'index', idFields=['station', 'id'])
+                destination.write({'id': None, 'station': 'S0'})  # one value is enough
+                with self.assertRaises(MissingIdValues):
+                    destination.write({'id': None, 'station': None})
+                destination.close()
+
+                print("Documents created once")
+                stub.ids.clear()
+                for i in range(2):
+                    destination = ESWriter('127.0.0.1', stub.port, 'index', idHash=True,
+                                           opType='create', bulkSize=3, retryDelay=0)
+                    destination.writeBatch(rows[:5] + rows[2:4])
+                    destination.close()
+                    self.assertEqual(len(stub.ids), 5)
+                    self.assertEqual(set(stub.ids), {hashValues(data) for data in rows[:5]})
+                    self.assertEqual((destination.nbIndexed, destination.nbDuplicates),
+                                     (5, 2) if i == 0 else (0, 7))
+            finally:
+                stub.close()
+
+            print("Daily indices")
+            stub = ESStub()
+            try:
+                partitioner = Partitioner('ode-{yyyy.MM.dd}', 't', {'convertToEpoch': True})
+                destination = ESWriter('127.0.0.1', stub.port, 'ode-{yyyy.MM.dd}', bulkSize=2,
+                                       ingestSettings=True, partitioner=partitioner)
+                destination.writeBatch([{'t': 1700000000000}, {'t': 1700100000000},
+                                        {'t': 1700000000001}])
+                destination.close()
+                # Documents of interleaved indices are sent in the same requests
+                self.assertEqual([len(documents) for documents in stub.requests], [2, 1])
+                self.assertEqual(stub.documentCounts, {'ode-2023.11.14': 2, 'ode-2023.11.16': 1})
+                self.assertEqual(sorted(stub.indices), ['ode-2023.11.14', 'ode-2023.11.16'])
+                self.assertEqual([index['refreshes'] for name, index in sorted(stub.indices.items())],
+                                 [1, 1])
+                self.assertEqual([name for name, settings in stub.settingsUpdates],
+                                 ['ode-2023.11.14', 'ode-2023.11.16',
+                                  'ode-2023.11.14', 'ode-2023.11.16'])
+            finally:
+                stub.close()
@@ -22,14 +22,97 @@ Parameters:
     - host: hostname or ip address of ES instance
     - port: port of ES API
     - index: elasticsearch index where data will be imported
+    - codec: (JSONCodec, optional) JSON codec used to encode requests
+    - bulkSize: (int, optional) maximum number of documents of a bulk request
+    - bulkBytes: (int, optional) maximum size of a bulk request (bytes)
+    - maxRetries: (int, optional) number of times a request failed because of
+                  a transient error (connection error, timeout, 429 Too Many
+                  Requests, 502, 503, 504) or documents rejected by ES
+                  (same statuses in bulk response) are sent again
+    - retryDelay: (float, optional) maximum number of seconds to wait before
+                  the first retry (doubled on each retry, see backoff)
+    - concurrency: (int, optional) maximum number of bulk requests in flight
+                   (1: requests are sent by the calling thread)
+    - nodes: (list, optional) nodes of ES cluster ({'host': ..., 'port': ...}
+             or 'host:port'), replace host and port
+    - timeout: (float, optional) timeout of requests (seconds)
+    - adaptive: (bool, optional) adjust number of documents of bulk requests
+                to latency and rejections (bulkSize is the initial size, see
+                BulkSizeController)
+    - minBulkSize, maxBulkSize: (int, optional) bounds of adaptive size
+    - targetLatency: (float, optional) latency of bulk requests (seconds)
+                     above which adaptive size is reduced
+    - maxDocsPerSecond: (float, optional) maximum number of documents sent
+                        per second (None: no limit)
+    - maxBytesPerSecond: (float, optional) maximum number of bytes sent per
+                         second (None: no limit)
+    - configConverters: (dict, optional) config of converters {inputName:
+                        {...}, ...} used to derive the mapping of the index
+                        (see buildMapping)
+    - createIndex: (bool, optional) create index with this mapping if it
+                   does not exist
+    - ingestSettings: (bool, optional) disable refresh and replicas of index
+                      during ingestion (default to False)
+    - idFields: (list of str, optional) outputNames of the values identifying
+                a document: _id is a hash of these values (None: ids are
+                generated by ES). Documents without any of these values are
+                refused (MissingIdValues).
+    - idHash: (bool, optional) _id is a hash of the whole document (ignored
+              if idFields is set)
+    - opType: (str, optional) action of bulk requests: 'index' (a document
+              with the same _id is replaced) or 'create' (a document with the
+              same _id is kept, requires idFields or idHash)
+    - partitioner: (Partitioner, optional) index of each document (time
+                   partition, see PartitionedWriter), index parameter is the
+                   pattern of indices
 
 Methods:
     - write:
-        - data: (dict) import data to ES to the index defined in parameters
-    - close: do nothing (present to satisfy required methods to be a valid writer)
+        - data: (dict) buffer data, imported to ES (index defined in
+                parameters) by bulk requests
+    - writeBatch:
+        - rows: (list of dict) buffer rows (see write)
+    - flush: import buffered documents
+    - restoreSettings: restore settings of index changed for ingestion
+    - close: import buffered documents, restore settings of index and
+             refresh it, report statistics (documents, duplicates, requests,
+             retries and rejections)
+
+Documents are sent through _bulk API once bulkSize documents or bulkBytes
+bytes are buffered. Only the documents rejected by ES (failed items of the
+response) are sent again.
+If concurrency is greater than 1, bulk requests are sent by a pool of
+threads: documents are converted while previous requests are processed by
+ES. write blocks while concurrency requests are in flight.
+Requests are spread over nodes (round-robin), connections are kept alive.
+A node which fails is not used for a while, the request is sent again to
+another node after a random delay (exponential backoff with full jitter).
+With document ids (idFields or idHash), sending documents again (retries,
+ingestion run again) doesn't duplicate them. Documents already in index are
+counted as duplicates with 'create' (409 Conflict).
+Documents sent again count in maxDocsPerSecond and maxBytesPerSecond: the
+cluster may be shared with other clients.
+If ingestSettings is set, refresh_interval and number_of_replicas of index
+are set to -1 and 0 from the first bulk request to close (replicas are
+rebuilt once documents are imported). A setting already set to -1 or 0
+(e.g. by another ingestion) is neither changed nor restored. If ingestion
+is killed, original settings (logged) must be restored by hand.
+With a partitioner, the index of each document is set in its action line:
+a bulk request holds documents of several indices. Indices are created
+(mapping) when their first document is written, their settings are set
+before their documents are sent, restored and refreshed on close.
 """
 
 import logging as log
+import json
+import hashlib
+import time
+import random
+import threading
+import concurrent.futures
+from codec.jsoncodec import JSONCodec
+from writers.bulkcontrol import BulkSizeController, TokenBucket
+from writers.bulkcontrol import MIN_BULK_SIZE, MAX_BULK_SIZE, TARGET_LATENCY
 
 
 # Custom ESWriter exceptions
@@ -54,10 +137,37 @@ class ESimportFailed(Exception):
     pass
 
 
+class UnknownOpType(Exception):
+    """
+    Action of bulk requests set in config file is not 'index' or 'create'
+    (or 'create' is used without document ids)
+    """
+    pass
+
+
+class UnknownIdField(Exception):
+    """
+    A value name of idFields set in config file is not the outputName of a
+    converter
+    """
+    pass
+
+
+class MissingIdValues(Exception):
+    """
+    A document has no value of idFields: all such documents would have the
+    same _id
+    """
+    pass
+
+
 # Try to import ES module (it is not a standard python module),
 # show instructions if it is not installed
 try:
     from elasticsearch import Elasticsearch
+    from elasticsearch.serializer import JSONSerializer
+    from elasticsearch.exceptions import SerializationError, TransportError
+    from elasticsearch.exceptions import ConnectionError as ESConnectionError
 except ImportError:
     log.error("Elasticsearch module for python is not installed.")
     log.error("It is required to use elasticsearch backend.")
@@ -65,32 +175,568 @@ except ImportError:
     raise ESmoduleNotInstalled
 
 
+# Default size of bulk requests: number of documents and bytes
+BULK_SIZE = 1000
+BULK_BYTES = 5 * 1024 * 1024
+
+# Default retry policy of requests and documents rejected by ES, maximum
+# delay between two retries
+MAX_RETRIES = 3
+RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 60.0
+
+# Default timeout of requests (seconds)
+TIMEOUT = 30.0
+
+# Statuses of requests and bulk items which may succeed if sent again
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# Type of documents, actions of bulk requests (index and type are set in URL,
+# or in action lines if documents are partitioned)
+DOC_TYPE = "ode_data"
+OP_TYPES = ('index', 'create')
+
+# Status of a document created while a document with the same _id exists
+CONFLICT_STATUS = 409
+
+# ES types of outputTypes (str: same as dynamic mapping)
+ES_TYPES = {
+    'str': {'type': 'text', 'fields': {'keyword': {'type': 'keyword', 'ignore_above': 256}}},
+    'int': {'type': 'long'},
+    'float': {'type': 'double'}
+    }
+
+# Settings of index during ingestion
+INGEST_SETTINGS = {'refresh_interval': '-1', 'number_of_replicas': 0}
+
+# strftime directives: java date format (ES)
+DATE_DIRECTIVES = {
+    'Y': 'yyyy',
+    'y': 'yy',
+    'm': 'MM',
+    'd': 'dd',
+    'H': 'HH',
+    'I': 'hh',
+    'M': 'mm',
+    'S': 'ss',
+    'f': 'SSSSSS',
+    'p': 'a',
+    'b': 'MMM',
+    'B': 'MMMM',
+    'j': 'DDD',
+    'z': 'Z',
+    '%': '%'
+    }
+
+
+def hashValues(values):
+    """
+    Return a hash of values (JSON serializable), used as document _id.
+    Values are encoded by json module (keys sorted, compact layout): ids
+    don't depend on the JSON backend.
+    """
+    canonical = json.dumps(values, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+def javaDateFormat(dateFormat):
+    """
+    Return the java date format (used by ES mappings) of strftime format
+    dateFormat, None if a directive is not supported. Each run of letters
+    is quoted once ('UTC'): '' is a quote, inside or outside quoted text.
+    """
+    javaFormat = ''
+    i = 0
+    while i < len(dateFormat):
+        char = dateFormat[i]
+        if char == '%':
+            directive = dateFormat[i + 1:i + 2]
+            if directive not in DATE_DIRECTIVES:
+                return None
+            javaFormat += DATE_DIRECTIVES[directive]
+            i += 2
+        elif char.isalpha() or char == "'":
+            end = i
+            while end < len(dateFormat) and (dateFormat[end].isalpha() or dateFormat[end] == "'"):
+                end += 1
+            literal = dateFormat[i:end].replace("'", "''")
+            if any(c.isalpha() for c in literal):
+                literal = "'" + literal + "'"
+            javaFormat += literal
+            i = end
+        else:
+            javaFormat += char
+            i += 1
+    return javaFormat
+
+
+def buildMapping(configConverters):
+    """
+    Return the mapping of documents converted by configConverters:
+    properties of outputNames by outputType. Lists are mapped dynamically
+    (type of values is unknown), timestamps are dates (epoch_millis if
+    convertToEpoch), latitude and longitude are a geo_point 'location'.
+    """
+    properties = {}
+    outputTypes = set()
+    for definition in configConverters.values():
+        outputType = definition['outputType']
+        outputTypes.add(outputType)
+        if outputType == 'timestamp':
+            if definition.get('convertToEpoch', False):
+                properties[definition['outputName']] = {'type': 'date', 'format': 'epoch_millis'}
+                continue
+            javaFormat = javaDateFormat(definition['dateFormat'])
+            if javaFormat is None:
+                log.warning("Date format '" + definition['dateFormat'] + "' can't be set "
+                            "in mapping, ES default date format is used")
+                properties[definition['outputName']] = {'type': 'date'}
+            else:
+                properties[definition['outputName']] = {'type': 'date', 'format': javaFormat}
+        elif outputType in ES_TYPES:
+            properties[definition['outputName']] = ES_TYPES[outputType]
+
+    # Location is added by converter if both latitude and longitude are set
+    if {'latitude', 'longitude'} <= outputTypes:
+        properties['location'] = {'type': 'geo_point'}
+    return {'properties': properties}
+
+
+class CodecSerializer(JSONSerializer):
+    """
+    Serializer of elasticsearch client using a JSONCodec
+    """
+
+    def __init__(self, codec):
+        self.__codec = codec
+
+    def loads(self, s):
+        try:
+            return self.__codec.loads(s)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(s, e)
+
+    def dumps(self, data):
+        # don't serialize strings (e.g. body of bulk requests)
+        if isinstance(data, (str, bytes)):
+            return data
+        try:
+            return self.__codec.dumps(data)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(data, e)
+
+
 class ESWriter():
 
-    def __init__(self, host, port, index):
+    def __init__(self, host, port, index, codec=None, bulkSize=BULK_SIZE,
+                 bulkBytes=BULK_BYTES, maxRetries=MAX_RETRIES, retryDelay=RETRY_DELAY,
+                 concurrency=1, nodes=None, timeout=TIMEOUT, adaptive=False,
+                 minBulkSize=MIN_BULK_SIZE, maxBulkSize=MAX_BULK_SIZE,
+                 targetLatency=TARGET_LATENCY, maxDocsPerSecond=None, maxBytesPerSecond=None,
+                 configConverters=None, createIndex=True, ingestSettings=False,
+                 idFields=None, idHash=False, opType='index', partitioner=None):
+
+        codec = codec or JSONCodec()
+
+        # Action line of each document, _id of documents (if any)
+        if opType not in OP_TYPES or (opType == 'create' and not (idFields or idHash)):
+            log.error("Unknown opType '" + str(opType) + "', expected one of " + str(OP_TYPES) +
+                      " ('create' requires idFields or idHash)")
+            raise UnknownOpType
+        if idFields:
+            idFields = tuple(idFields)
+            if configConverters is not None:
+                # Values of converted documents (location is added by converter)
+                outputNames = {definition['outputName'] for definition in configConverters.values()}
+                if {'latitude', 'longitude'} <= {definition['outputType']
+                                                 for definition in configConverters.values()}:
+                    outputNames.add('location')
+                unknown = [name for name in idFields if name not in outputNames]
+                if unknown:
+                    log.error("idFields " + str(unknown) + " are not outputNames of converters")
+                    raise UnknownIdField
+
+            def documentId(data):
+                values = [data.get(name) for name in idFields]
+                if values.count(None) == len(values):
+                    log.error("Document has no value of idFields " + str(list(idFields)) +
+                              ": " + str(data))
+                    raise MissingIdValues
+                return hashValues(values)
 
-        # Create ES objet
-        self.__es = Elasticsearch([
-                                  {'host': host, 'port': port}
-                                  ])
+            self.__documentId = documentId
+        elif idHash:
+            self.__documentId = hashValues
+        else:
+            self.__documentId = None
+        self.__opType = opType
+        self.__action, self.__actionPrefix = self.__actionLines('')
+
+        self.__maxRetries = maxRetries
+        self.__retryDelay = retryDelay
+
+        # Create ES objet: pool of connections to nodes (one connection by
+        # request in flight to each node). Failed requests are retried by
+        # ESWriter (with a delay), not by the client.
+        self.__es = Elasticsearch(nodes or [{'host': host, 'port': port}],
+                                  serializer=CodecSerializer(codec),
+                                  maxsize=concurrency,
+                                  timeout=timeout,
+                                  max_retries=0
+                                  )
         self.__es_index = index
 
-        if not self.__es.ping():
-            log.error("Elasticsearch is not reachable")
-            log.error("Check host and port.")
-            raise ESnotReachable
+        # A failed node is not used by next attempt
+        retry = 0
+        while not self.__es.ping():
+            if retry == maxRetries:
+                log.error("Elasticsearch is not reachable")
+                log.error("Check host and port.")
+                raise ESnotReachable
+            log.warning("Elasticsearch is not reachable, retrying...")
+            self.backoff(retry)
+            retry += 1
+
+        # Indices prepared for ingestion (mapping) and their action lines
+        # {name: (action, actionPrefix)}, indices whose settings are set
+        # before next bulk request, original settings of indices {name: settings}
+        self.__mapping = buildMapping(configConverters or {}) if createIndex else None
+        self.__ingestSettings = ingestSettings
+        self.__version = None
+        self.__indices = {}
+        self.__unsetIndices = []
+        self.__settings = {}
+        self.__partitioner = partitioner
+        if partitioner is None:
+            self.__prepareIndex(index)
+
+        self.__dumps = codec.dumps
+        self.__bulkBytes = bulkBytes
+
+        # Number of documents of bulk requests (fixed if not adaptive)
+        if adaptive:
+            self.__bulkSize = BulkSizeController(bulkSize, minBulkSize, maxBulkSize, targetLatency)
+        else:
+            self.__bulkSize = BulkSizeController(bulkSize)
+
+        # Rate limits (shared by threads of executor)
+        self.__docsBucket = TokenBucket(maxDocsPerSecond) if maxDocsPerSecond else None
+        self.__bytesBucket = TokenBucket(maxBytesPerSecond) if maxBytesPerSecond else None
+
+        # Documents buffered (encoded lines of next bulk request)
+        self.__documents = []
+        self.__size = 0
+
+        # Bulk requests in flight (see __send)
+        self.__concurrency = concurrency
+        self.__executor = None
+        if concurrency > 1:
+            self.__executor = concurrent.futures.ThreadPoolExecutor(concurrency)
+        self.__pending = set()
+
+        # Statistics (updated by threads of executor)
+        self.__lock = threading.Lock()
+        self.__start = None
+        self.nbIndexed = 0
+        self.nbDuplicates = 0
+        self.nbRequests = 0
+        self.nbRetried = 0
+        self.nbRequestRetries = 0
+        self.nbRejectedRequests = 0
+        self.requestsTime = 0.0
+        self.maxLatency = 0.0
+
+    def __request(self, request, **kwargs):
+        """
+        Send request (e.g. self.__es.indices.create) with kwargs, send it
+        again after a transient error (same policy as bulk requests)
+        """
+        retry = 0
+        while True:
+            try:
+                return request(**kwargs)
+            except TransportError as e:
+                transient = isinstance(e, ESConnectionError) or e.status_code in RETRY_STATUSES
+                if not transient or retry == self.__maxRetries:
+                    raise
+            self.backoff(retry)
+            retry += 1
+
+    def __actionLines(self, metadata):
+        # Action line of documents without _id, beginning of action line of
+        # documents with _id (hex: no escaping)
+        return (('{"' + self.__opType + '":{' + metadata + '}}\n').encode(),
+                ('{"' + self.__opType + '":{' + metadata + (',' if metadata else '') +
+                 '"_id":"').encode())
+
+    def __prepareIndex(self, index):
+        # Create index (mapping). Settings during ingestion are set before
+        # the first bulk request: index is unchanged if ingestion fails before
+        try:
+            if self.__mapping is not None and \
+                    not self.__request(self.__es.indices.exists, index=index):
+                self.__createIndex(index)
+        except TransportError:
+            log.exception("Failed to prepare index '" + index + "' for ingestion")
+            raise ESimportFailed
+        if self.__ingestSettings:
+            self.__unsetIndices.append(index)
+        self.__indices[index] = self.__actionLines('"_index":' + json.dumps(index) +
+                                                   ',"_type":"' + DOC_TYPE + '"')
+        return self.__indices[index]
+
+    def __createIndex(self, index):
+        # Mappings of ES 7 have no type, unless include_type_name is set
+        # (unknown parameter in ES 6)
+        if self.__version is None:
+            self.__version = int(self.__request(self.__es.info)['version']['number'].split('.')[0])
+        params = {}
+        if self.__version >= 7:
+            params['include_type_name'] = 'true'
+        try:
+            self.__request(self.__es.indices.create,
+                           index=index,
+                           body={'mappings': {DOC_TYPE: self.__mapping}},
+                           params=params)
+        except TransportError as e:
+            if e.error != 'resource_already_exists_exception':  # created meanwhile
+                raise
+        log.info("Index '" + index + "' created, mapping: " + str(self.__mapping))
+
+    def __setIngestSettings(self, index):
+        # Original settings of each index (index may be an alias), None if
+        # setting is not set (default value). A setting already set for
+        # ingestion is left to whoever set it: it would be restored to -1 or 0
+        response = self.__request(self.__es.indices.get_settings, index=index)
+        for name, indexSettings in response.items():
+            indexSettings = indexSettings['settings'].get('index', {})
+            original = {}
+            for setting, value in INGEST_SETTINGS.items():
+                if indexSettings.get(setting) == str(value):
+                    log.warning("Setting " + setting + " of index '" + name + "' is already " +
+                                str(value) + " (another ingestion running?), it won't be restored")
+                else:
+                    original[setting] = indexSettings.get(setting)
+            if not original:
+                continue
+            log.info("Settings of index '" + name + "' during ingestion: " +
+                     str({setting: INGEST_SETTINGS[setting] for setting in original}) +
+                     ", original settings: " + str(original))
+            self.__request(self.__es.indices.put_settings, index=name,
+                           body={'index': {setting: INGEST_SETTINGS[setting]
+                                           for setting in original}})
+            self.__settings[name] = original
+
+    def restoreSettings(self):
+        settings = self.__settings
+        self.__settings = {}
+        try:
+            for name, original in settings.items():
+                self.__request(self.__es.indices.put_settings, index=name, body={'index': original})
+        except TransportError:
+            log.exception("Failed to restore settings of index '" + self.__es_index +
+                          "': " + str(settings))
+            raise ESimportFailed
+
+    def __bulk(self, documents):
+        """
+        Send documents (action and source lines) in a bulk request, return
+        documents which should be sent again
+        """
+        body = b''.join(documents)
+        retry = 0
+        while True:
+            if self.__docsBucket is not None:
+                self.__docsBucket.consume(len(documents))
+            if self.__bytesBucket is not None:
+                self.__bytesBucket.consume(len(body))
+
+            start = time.perf_counter()
+            try:
+                if self.__partitioner is None:
+                    response = self.__es.bulk(body=body,
+                                              index=self.__es_index,
+                                              doc_type=DOC_TYPE
+                                              )
+                else:
+                    response = self.__es.bulk(body=body)
+                break
+            except TransportError as e:
+                # Connection errors and timeouts have no status
+                transient = isinstance(e, ESConnectionError) or e.status_code in RETRY_STATUSES
+                if e.status_code == 429:
+                    with self.__lock:
+                        self.nbRejectedRequests += 1
+                if e.status_code in RETRY_STATUSES:  # ES is overloaded
+                    self.__bulkSize.reject()
+                if not transient or retry == self.__maxRetries:
+                    log.exception("Error while importing data to ES")
+                    raise ESimportFailed
+                log.warning("Bulk request failed (" + str(e) + "), retrying...")
+            except Exception:
+                log.exception("Error while importing data to ES")
+                raise ESimportFailed
+
+            with self.__lock:
+                self.nbRequestRetries += 1
+            self.backoff(retry)
+            retry += 1
+        latency = time.perf_counter() - start
+        log.debug("Bulk request of " + str(len(documents)) + " documents (" +
+                  str(len(body)) + " bytes) in " + format(latency, '.3f') + "s: " +
+                  format(len(documents) / max(latency, 1e-6), '.0f') + " documents/s")
+
+        rejected = []
+        nbDuplicates = 0
+        if response['errors']:
+            for document, item in zip(documents, response['items']):
+                result = next(iter(item.values()))  # {action: result}
+                if result['status'] in RETRY_STATUSES:
+                    rejected.append(document)
+                elif result['status'] == CONFLICT_STATUS and 'create' in item:
+                    nbDuplicates += 1  # already in index
+                elif result['status'] >= 300:
+                    log.error("Error while importing data to ES: " + str(result.get('error')))
+                    log.error("data : " + document.decode())
+                    raise ESimportFailed
+        self.__bulkSize.update(latency, rejected=bool(rejected))
+
+        with self.__lock:
+            self.nbRequests += 1
+            self.nbIndexed += len(documents) - len(rejected) - nbDuplicates
+            self.nbDuplicates += nbDuplicates
+            self.requestsTime += latency
+            self.maxLatency = max(self.maxLatency, latency)
+        return rejected
+
+    def __index(self, documents):
+        """
+        Index documents, send rejected documents again (up to maxRetries times)
+        """
+        retry = 0
+        while documents:
+            documents = self.__bulk(documents)
+            if not documents:
+                break
+            if retry == self.__maxRetries:
+                log.error(str(len(documents)) + " documents still rejected by ES after " +
+                          str(retry) + " retries")
+                raise ESimportFailed
+
+            log.warning(str(len(documents)) + " documents rejected by ES, sending them again")
+            self.backoff(retry)
+            retry += 1
+            with self.__lock:
+                self.nbRetried += len(documents)
+
+    def backoff(self, retry):
+        """
+        Wait before retry number retry (from 0): random delay up to
+        retryDelay * 2 ** retry seconds (at most MAX_RETRY_DELAY), so that
+        writers don't retry at the same time
+        """
+        time.sleep(random.uniform(0, min(self.__retryDelay * 2 ** retry, MAX_RETRY_DELAY)))
+
+    def __wait(self, returnWhen):
+        # Wait for requests in flight, raise errors of completed requests
+        done, self.__pending = concurrent.futures.wait(self.__pending, return_when=returnWhen)
+        for future in done:
+            future.result()
+
+    def __send(self):
+        documents = self.__documents
+        if not documents:
+            return
+        self.__documents = []
+        self.__size = 0
+        while self.__unsetIndices:
+            index = self.__unsetIndices.pop(0)
+            try:
+                self.__setIngestSettings(index)
+            except TransportError:
+                log.exception("Failed to set settings of index '" + index + "' for ingestion")
+                raise ESimportFailed
+        if self.__start is None:
+            self.__start = time.perf_counter()
+
+        if self.__executor is None:
+            self.__index(documents)
+            return
+
+        # Backpressure: wait for a request to complete if all are in flight
+        if len(self.__pending) >= self.__concurrency:
+            self.__wait(concurrent.futures.FIRST_COMPLETED)
+        self.__pending.add(self.__executor.submit(self.__index, documents))
 
     def write(self, data):
+        if self.__partitioner is None:
+            action, actionPrefix = self.__action, self.__actionPrefix
+        else:
+            index = self.__partitioner(data)
+            action, actionPrefix = self.__indices.get(index) or self.__prepareIndex(index)
         try:
-            self.__es.index(index=self.__es_index,
-                            doc_type="ode_data",
-                            body=data
-                            )
+            document = (self.__dumps(data) + "\n").encode()
+            if self.__documentId is None:
+                document = action + document
+            else:
+                document = (actionPrefix + self.__documentId(data).encode() +
+                            b'"}}\n' + document)
+        except MissingIdValues:
+            raise
         except Exception:
             log.exception("Error while importing data to ES")
             log.error("data : " + str(data))
             raise ESimportFailed
 
+        self.__documents.append(document)
+        self.__size += len(document)
+        if len(self.__documents) >= self.__bulkSize.size or self.__size >= self.__bulkBytes:
+            self.__send()
+
+    def writeBatch(self, rows):
+        for data in rows:
+            self.write(data)
+
+    def flush(self):
+        self.__send()
+        self.__wait(concurrent.futures.ALL_COMPLETED)
+
     def close(self):
+        try:
+            self.flush()
+        finally:
+            if self.__executor is not None:
+                self.__executor.shutdown()
+            self.restoreSettings()
+
+        # Make documents searchable now
+        for index in self.__indices:
+            try:
+                self.__request(self.__es.indices.refresh, index=index)
+            except TransportError:
+                log.exception("Failed to refresh index '" + index + "'")
+                raise ESimportFailed
+        if self.__partitioner is not None:
+            log.info(str(len(self.__indices)) + " indices written (" + self.__es_index + ")")
+
+        log.info(str(self.nbIndexed) + " documents imported to ES in " +
+                 str(self.nbRequests) + " bulk requests (" +
+                 str(self.nbRetried) + " documents sent again)")
+        if self.nbDuplicates:
+            log.info(str(self.nbDuplicates) + " documents already in index (same _id)")
+        if self.nbRequestRetries or self.nbRejectedRequests:
+            log.warning(str(self.nbRequestRetries) + " bulk requests sent again, " +
+                        str(self.nbRejectedRequests) + " rejected by ES (429 Too Many Requests)")
+        if self.nbRequests:
+            elapsed = time.perf_counter() - self.__start
+            log.info("Bulk requests: " + format(self.nbIndexed / elapsed, '.0f') +
+                     " documents/s, latency " +
+                     format(self.requestsTime / self.nbRequests, '.3f') + "s (mean), " +
+                     format(self.maxLatency, '.3f') + "s (max)")
+        if self.__bulkSize.minimum != self.__bulkSize.maximum:
+            log.info("Adaptive bulk size: " + str(self.__bulkSize.size) + " documents")
+        waitTime = sum(bucket.waitTime for bucket in (self.__docsBucket, self.__bytesBucket)
+                       if bucket is not None)
+        if waitTime:
+            log.info("Rate limits: requests delayed by " + format(waitTime, '.1f') + "s")
         # No explicit way to close ES socket (AFAIK)
-        pass
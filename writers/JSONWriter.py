@@ -18,28 +18,89 @@
 """
 JSON writer
 
-Parameter:
+Parameters:
     - fd: (fd) file descriptor of output file
+    - codec: (JSONCodec, optional) JSON codec
+    - layout: (str, optional) 'pretty' (default: indented documents) or
+              'ndjson' (one compact document per line, can be read by
+              JSONReader and sent to elasticsearch _bulk API)
+    - bufferSize: (int, optional) number of characters buffered before
+                  being written to fd
 
 Methods:
     - write:
         - data: (dict) data to write as json
-    - close: close fd of output file
+    - writeBatch:
+        - rows: (list of dict) data to write as json
+    - flush: write buffered data to output file
+    - close: write buffered data and close fd of output file
+
+Documents are written to fd when the buffer is full, when flush() is called
+(e.g. at checkpoints) and on close().
 """
 
 import logging as log
-import json
+from codec.jsoncodec import JSONCodec
+
+
+# Default number of characters buffered
+BUFFER_SIZE = 1024 * 1024
+
+# Layouts of output file
+LAYOUTS = ('pretty', 'ndjson')
+
+
+# Custom JSON writer exceptions
+class UnknownJSONOutputLayout(Exception):
+    """
+    Layout of JSON output file is not pretty or ndjson
+    """
+    pass
 
 
 class JSONWriter():
 
-    def __init__(self, fd):
+    def __init__(self, fd, codec=None, layout='pretty', bufferSize=BUFFER_SIZE):
         self.__fd = fd
+        codec = codec or JSONCodec()
+        self.__bufferSize = bufferSize
+
+        if layout == 'pretty':
+            self.__dumps = codec.dumpsPretty  # nice file format
+        elif layout == 'ndjson':
+            self.__dumps = codec.dumps
+        else:
+            log.error("Unknown layout '" + str(layout) + "' of JSON output file.")
+            raise UnknownJSONOutputLayout
+
+        self.__buffer = []
+        self.__buffered = 0
+
+    def __append(self, string):
+        self.__buffer.append(string)
+        self.__buffered += len(string)
+        if self.__buffered >= self.__bufferSize:
+            self.__write()
+
+    def __write(self):
+        if self.__buffer:
+            self.__fd.write(''.join(self.__buffer))
+            self.__buffer = []
+            self.__buffered = 0
 
     def write(self, data):
         # data is a dictionary
-        json.dump(data, self.__fd, indent=4)
-        self.__fd.write("\n")  # nice file format
+        self.__append(self.__dumps(data) + "\n")
+
+    def writeBatch(self, rows):
+        # rows is a list of dictionaries, serialized at once
+        if rows:
+            self.__append("\n".join(map(self.__dumps, rows)) + "\n")
+
+    def flush(self):
+        self.__write()
+        self.__fd.flush()
 
     def close(self):
+        self.__write()
         self.__fd.close()
@@ -0,0 +1,201 @@
+# Copyright (C) 2018 Project-EBDO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# EBDO-Ingester
+# Author: Flebdo
+
+"""
+Parquet writer
+
+Parameters:
+    - fd: (fd) file descriptor of output file (text fds are written through
+          their binary buffer)
+    - configConverters: (dict) config of converters {inputName: {...}, ...}
+                        used to derive the schema of the file
+    - rowGroupSize: (int, optional) number of rows of each row group
+    - compression: (str, optional) compression of column chunks ('snappy',
+                   'zstd', 'gzip', 'none'...)
+
+Methods:
+    - write:
+        - data: (dict) converted data, written when a row group is full
+                (empty rows of empty inputs are ignored)
+    - writeBatch:
+        - rows: (list of dict) converted data, written by full row groups
+    - flush: write buffered rows (as a smaller row group)
+    - close: write buffered rows and close fd of output file
+
+Schema of the file (one column per converter, in config file order):
+    - str, int, float: string, int64, double
+    - list: list of values of listType of converter (str, int or float,
+            default to str)
+    - timestamp: timestamp in milliseconds. Epochs (convertToEpoch) are
+                 instants (UTC), dates are parsed with dateFormat (wall time,
+                 no timezone).
+    - latitude, longitude: location column, struct of doubles {lat, lon}
+"""
+
+import logging as log
+
+
+# Custom Parquet exceptions
+class PyarrowModuleNotInstalled(Exception):
+    """
+    pyarrow module for python 3 is not installed
+    (or the install is broken)
+    """
+    pass
+
+
+class ParquetWriteFailed(Exception):
+    """
+    Failed to convert rows to the schema of Parquet file.
+    """
+    pass
+
+
+# Try to import pyarrow module (it is not a standard python module),
+# show instructions if it is not installed
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.compute as pc
+except ImportError:
+    log.error("pyarrow module for python is not installed.")
+    log.error("It is required to write Parquet files.")
+    log.error("Try: pip3 install --user pyarrow")
+    raise PyarrowModuleNotInstalled
+
+
+# Default number of rows of row groups
+ROW_GROUP_SIZE = 65536
+
+# Arrow types of outputTypes
+ARROW_TYPES = {
+    'str': pa.string(),
+    'int': pa.int64(),
+    'float': pa.float64()
+    }
+
+LOCATION_TYPE = pa.struct([('lat', pa.float64()), ('lon', pa.float64())])
+
+
+class ParquetWriter():
+
+    def __init__(self, fd, configConverters, rowGroupSize=ROW_GROUP_SIZE,
+                 compression='snappy'):
+
+        # Store fd
+        self.__fd = fd
+        self.__rowGroupSize = rowGroupSize
+        self.__compression = compression
+
+        # Columns: (outputName, function converting a list of values to an array)
+        self.__columns = []
+        outputTypes = set()
+        for definition in configConverters.values():
+            outputType = definition['outputType']
+            outputTypes.add(outputType)
+            if outputType in ('latitude', 'longitude'):
+                continue
+            self.__columns.append((definition['outputName'], self.__arrayBuilder(definition)))
+
+        # Location is added by converter if both latitude and longitude are set
+        if {'latitude', 'longitude'} <= outputTypes:
+            self.__columns.append(('location', self.__locationArray))
+
+        self.__rows = []
+        self.__writer = None
+
+    def __arrayBuilder(self, definition):
+        outputType = definition['outputType']
+
+        if outputType == 'timestamp':
+            if definition.get('convertToEpoch', False):
+                return lambda values: pa.array(values, pa.int64()).cast(
+                    pa.timestamp('ms', tz='UTC'))
+            dateFormat = definition['dateFormat']
+            return lambda values: pc.strptime(pa.array(values, pa.string()),
+                                              format=dateFormat, unit='ms')
+
+        if outputType == 'list':
+            # Type of values set in config: a column of empty lists or None
+            # has the same type as the other row groups
+            listType = definition.get('listType', 'str')
+            if listType not in ARROW_TYPES:
+                log.error("listType " + str(listType) + " is not supported by Parquet writer")
+                raise NotImplementedError("Unknown list type: " + str(listType))
+            listArrowType = pa.list_(ARROW_TYPES[listType])
+            return lambda values: pa.array(values, listArrowType)
+
+        if outputType not in ARROW_TYPES:
+            log.error("Type " + outputType + " is not supported by Parquet writer")
+            raise NotImplementedError("Unknown output type: " + outputType)
+        arrowType = ARROW_TYPES[outputType]
+        return lambda values: pa.array(values, arrowType)
+
+    def __locationArray(self, values):
+        # Converter writes lat/long as strings (elasticsearch geo format)
+        latitudes = pa.array([None if value is None else value['lat'] for value in values],
+                             pa.string())
+        longitudes = pa.array([None if value is None else value['lon'] for value in values],
+                              pa.string())
+        return pa.StructArray.from_arrays([latitudes.cast(pa.float64()),
+                                           longitudes.cast(pa.float64())],
+                                          fields=list(LOCATION_TYPE))
+
+    def __flush(self, nbRows=None):
+        # Write first nbRows rows (all rows by default)
+        rows = self.__rows[:nbRows]
+        self.__rows = self.__rows[len(rows):]
+
+        arrays = []
+        names = []
+        try:
+            for outputName, toArray in self.__columns:
+                arrays.append(toArray([row[outputName] for row in rows]))
+                names.append(outputName)
+            table = pa.Table.from_arrays(arrays, names=names)
+        except (pa.ArrowException, KeyError) as e:
+            log.error("Failed to convert rows to Parquet column '" + outputName + "': " + str(e))
+            raise ParquetWriteFailed
+
+        if self.__writer is None:
+            self.__writer = pq.ParquetWriter(getattr(self.__fd, 'buffer', self.__fd),
+                                             table.schema,
+                                             compression=self.__compression)
+        self.__writer.write_table(table, row_group_size=self.__rowGroupSize)
+
+    def write(self, data):
+        # data is a dictionary, empty if input has no rows (e.g. header only)
+        if not data:
+            return
+        self.__rows.append(data)
+        if len(self.__rows) >= self.__rowGroupSize:
+            self.__flush()
+
+    def writeBatch(self, rows):
+        self.__rows.extend(data for data in rows if data)
+        if len(self.__rows) >= self.__rowGroupSize:
+            self.__flush(len(self.__rows) - len(self.__rows) % self.__rowGroupSize)
+
+    def flush(self):
+        if self.__rows:
+            self.__flush()
+
+    def close(self):
+        if self.__rows or self.__writer is None:  # Empty file has a schema
+            self.__flush()
+        self.__writer.close()
+        self.__fd.close()
@@ -0,0 +1,255 @@
+# Copyright (C) 2018 Project-EBDO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# EBDO-Ingester
+# Author: Flebdo
+
+"""
+Time-partitioned output: documents are routed to a partition (output file,
+ES index) named after their timestamp
+
+Partitioner:
+    Parameters:
+        - pattern: (str) name of partitions, date fields are set between
+                   braces: yyyy, yy, MM, dd, HH (e.g. 'ode-{yyyy.MM.dd}',
+                   'out/{yyyy}/{MM}/{dd}.json')
+        - field: (str) outputName of the timestamp of documents
+        - definition: (dict) config of the converter of field (dateFormat,
+                      convertToEpoch)
+    Call:
+        - data: (dict) converted data, returns the name of its partition
+                (raises MissingPartitionValue if it has no timestamp)
+    Epochs (convertToEpoch) are partitioned in UTC, dates are partitioned by
+    their wall time (dateFormat, no timezone).
+    Also used by ESWriter to route documents to time-partitioned indices.
+
+PartitionedWriter:
+    Parameters:
+        - partitioner: (Partitioner) gives the partition of documents
+        - openWriter: (function) openWriter(name, mode) returns the writer of
+                      partition name, mode is 'write' (first time) or
+                      'append' (partition was closed before)
+        - maxOpen: (int, optional) maximum number of partitions open at once
+        - appendable: (bool, optional) False if partitions can't be appended
+                      (compressed or Parquet files): they are never closed
+                      before the end, maxOpen is then ignored
+    Methods:
+        - write:
+            - data: (dict) converted data, buffered and written by the writer
+                    of its partition (see writeBatch)
+        - writeBatch:
+            - rows: (list of dict) converted data, written partition by
+                    partition (order of rows is kept in each partition)
+        - flush: write buffered rows, flush writers of open partitions
+        - close: close writers of open partitions, report statistics
+    Partitions are kept open in LRU order: the least recently used partition
+    is closed when maxOpen partitions are open (it is appended if it is used
+    again). Rows written one by one are routed by batches of BATCH_SIZE rows:
+    if there are more than maxOpen partitions, rows of partitions interleaved
+    in input don't close and reopen partitions for each row.
+"""
+
+import logging as log
+import re
+from collections import OrderedDict
+from functools import lru_cache
+from datetime import datetime, timezone
+from converters.dateparser import compileFormat
+
+
+# Default maximum number of partitions open at once
+MAX_OPEN = 16
+
+# Number of rows written one by one routed at once
+BATCH_SIZE = 4096
+
+# Date fields of partition names: strftime directive
+DATE_FIELDS = {
+    'yyyy': '%Y',
+    'yy': '%y',
+    'MM': '%m',
+    'dd': '%d',
+    'HH': '%H'
+    }
+
+# Longest field first (yyyy before yy)
+FIELDS = re.compile('|'.join(sorted(DATE_FIELDS, key=len, reverse=True)) + '|[A-Za-z]|.')
+
+# Partitions change at most every hour (HH): milliseconds per hour
+HOUR = 3600 * 1000
+
+# Number of dates (strings) whose partition is memoized
+CACHE_SIZE = 4096
+
+
+# Custom partition exceptions
+class UnknownPartitionPattern(Exception):
+    """
+    Pattern of partition names set in config file has an unknown date field
+    or unbalanced braces
+    """
+    pass
+
+
+class MissingPartitionValue(Exception):
+    """
+    A document has no timestamp: its partition is unknown
+    """
+    pass
+
+
+def compilePattern(pattern):
+    """
+    Return the strftime format of pattern (partition names)
+    """
+    strftimeFormat = ''
+    for literal, fields in re.findall(r'([^{}]*)(?:\{([^{}]*)\}|$)', pattern):
+        strftimeFormat += literal.replace('%', '%%')
+        for token in FIELDS.findall(fields):
+            if token in DATE_FIELDS:
+                strftimeFormat += DATE_FIELDS[token]
+            elif token.isalpha():
+                log.error("Unknown date field '" + token + "' in partition pattern '" +
+                          pattern + "', expected one of " + str(list(DATE_FIELDS)))
+                raise UnknownPartitionPattern
+            else:
+                strftimeFormat += token.replace('%', '%%')
+
+    if pattern.count('{') != pattern.count('}') or strftimeFormat == pattern.replace('%', '%%'):
+        log.error("Invalid partition pattern '" + pattern + "'")
+        raise UnknownPartitionPattern
+    return strftimeFormat
+
+
+class Partitioner():
+
+    def __init__(self, pattern, field, definition):
+        self.__field = field
+        self.__partition = self.__compilePartition(compilePattern(pattern), definition)
+
+    def __compilePartition(self, strftimeFormat, definition):
+        # Return a function giving the partition of a timestamp
+        if definition.get('convertToEpoch', False):
+            names = {}  # hour: name
+
+            def partition(value):
+                hour = value // HOUR
+                name = names.get(hour)
+                if name is None:
+                    date = datetime.fromtimestamp(hour * HOUR / 1000, timezone.utc)
+                    name = names[hour] = date.strftime(strftimeFormat)
+                return name
+
+            return partition
+
+        dateFormat = definition['dateFormat']
+        fastParse = compileFormat(dateFormat)
+        strptime = datetime.strptime
+
+        @lru_cache(maxsize=CACHE_SIZE)
+        def partition(value):
+            try:
+                date = fastParse(value) if fastParse is not None else None
+            except ValueError:  # e.g. month is 13: let strptime raise
+                date = None
+            if date is None:
+                date = strptime(value, dateFormat)
+            return date.strftime(strftimeFormat)
+
+        return partition
+
+    def __call__(self, data):
+        value = data.get(self.__field)
+        if value is None:
+            log.error("No value of '" + self.__field + "' (partition) in document: " + str(data))
+            raise MissingPartitionValue
+        return self.__partition(value)
+
+
+class PartitionedWriter():
+
+    def __init__(self, partitioner, openWriter, maxOpen=MAX_OPEN, appendable=True):
+
+        self.__name = partitioner
+        self.__openWriter = openWriter
+        self.__maxOpen = maxOpen
+        self.__appendable = appendable
+
+        # Rows written one by one, not routed yet
+        self.__rows = []
+
+        # Writers of open partitions, least recently used first
+        self.__writers = OrderedDict()
+        self.__names = set()  # names of partitions opened once
+        self.nbReopened = 0
+
+    def __writer(self, name):
+        writer = self.__writers.get(name)
+        if writer is not None:
+            self.__writers.move_to_end(name)
+            return writer
+
+        if len(self.__writers) == self.__maxOpen and not self.__appendable:
+            log.warning("More than " + str(self.__maxOpen) + " partitions open: they " +
+                        "can't be closed and appended later, all are kept open.")
+        elif len(self.__writers) >= self.__maxOpen and self.__appendable:
+            oldest, writer = self.__writers.popitem(last=False)
+            log.debug("Partition " + oldest + " closed (" + str(self.__maxOpen) +
+                      " partitions open)")
+            writer.close()
+
+        if name in self.__names:
+            self.nbReopened += 1
+            writer = self.__openWriter(name, 'append')
+        else:
+            log.info("Partition " + name + " opened")
+            self.__names.add(name)
+            writer = self.__openWriter(name, 'write')
+        self.__writers[name] = writer
+        return writer
+
+    def write(self, data):
+        self.__rows.append(data)
+        if len(self.__rows) >= BATCH_SIZE:
+            self.writeBatch([])
+
+    def writeBatch(self, rows):
+        # Rows written one by one before come first
+        if self.__rows:
+            rows = self.__rows + list(rows)
+            self.__rows = []
+
+        partitions = {}
+        name = self.__name
+        for data in rows:
+            key = name(data)
+            if key in partitions:
+                partitions[key].append(data)
+            else:
+                partitions[key] = [data]
+        for key, partitionRows in partitions.items():
+            self.__writer(key).writeBatch(partitionRows)
+
+    def flush(self):
+        self.writeBatch([])
+        for writer in self.__writers.values():
+            writer.flush()
+
+    def close(self):
+        self.writeBatch([])
+        while self.__writers:
+            name, writer = self.__writers.popitem(last=False)
+            writer.close()
+        log.info(str(len(self.__names)) + " partitions written (" +
+                 str(self.nbReopened) + " reopened)")
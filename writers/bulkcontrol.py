@@ -0,0 +1,113 @@
+# Copyright (C) 2018 Project-EBDO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# EBDO-Ingester
+# Author: Flebdo
+
+"""
+Control of bulk requests used by ESWriter: size of requests and rate
+
+BulkSizeController:
+    Parameters:
+        - size: (int) initial number of documents of bulk requests
+        - minimum, maximum: (int, optional) bounds of size (size is fixed if
+                            both are equal to size)
+        - targetLatency: (float, optional) latency (seconds) above which
+                         requests are considered too large
+    Attributes:
+        - size: current number of documents of bulk requests
+    Methods:
+        - update:
+            - latency: (float) latency of last bulk request
+            - rejected: (bool) documents or request were rejected by ES
+                        (429 Too Many Requests, 5xx)
+        - reject: same as update for a request which failed
+
+    Size is adjusted after each request (AIMD, as TCP congestion control):
+    increased by a tenth of initial size while requests are fast, halved if
+    ES rejects documents, reduced by a fifth if requests are slower than
+    targetLatency. Size converges on the largest requests ES processes
+    without rejection in targetLatency.
+
+TokenBucket:
+    Parameters:
+        - rate: (float) number of tokens (documents, bytes...) per second
+    Methods:
+        - consume:
+            - amount: (int) tokens used, blocks until they are available
+    Bursts of at most one second of tokens are allowed. An amount larger
+    than the bucket is borrowed: next consumers wait until it is paid back.
+    Attribute waitTime is the total time spent waiting for tokens.
+"""
+
+import threading
+import time
+
+
+# Default bounds and target latency of adaptive bulk size
+MIN_BULK_SIZE = 100
+MAX_BULK_SIZE = 10000
+TARGET_LATENCY = 1.0
+
+# AIMD factors
+INCREASE_RATIO = 0.1  # of initial size
+REJECTION_FACTOR = 0.5
+SLOW_FACTOR = 0.8
+
+
+class BulkSizeController():
+
+    def __init__(self, size, minimum=None, maximum=None, targetLatency=TARGET_LATENCY):
+        self.minimum = size if minimum is None else minimum
+        self.maximum = size if maximum is None else maximum
+        self.size = min(max(size, self.minimum), self.maximum)
+        self.__increment = max(1, int(size * INCREASE_RATIO))
+        self.__targetLatency = targetLatency
+        self.__lock = threading.Lock()
+
+    def __resize(self, size):
+        self.size = int(min(max(size, self.minimum), self.maximum))
+
+    def update(self, latency, rejected=False):
+        with self.__lock:
+            if rejected:
+                self.__resize(self.size * REJECTION_FACTOR)
+            elif latency > self.__targetLatency:
+                self.__resize(self.size * SLOW_FACTOR)
+            else:
+                self.__resize(self.size + self.__increment)
+
+    def reject(self):
+        self.update(None, rejected=True)
+
+
+class TokenBucket():
+
+    def __init__(self, rate):
+        self.__rate = rate
+        self.__tokens = rate
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+        self.waitTime = 0.0
+
+    def consume(self, amount):
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.__rate, self.__tokens + (now - self.__last) * self.__rate)
+            self.__last = now
+            self.__tokens -= amount
+            delay = -self.__tokens / self.__rate if self.__tokens < 0 else 0.0
+            self.waitTime += delay
+        if delay:
+            time.sleep(delay)